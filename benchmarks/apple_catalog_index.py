@@ -0,0 +1,257 @@
+# BSD 3-Clause License
+#
+# Copyright 2011 Disney Enterprises, Inc.
+# Copyright (c) 2019, Jacob F. Grant
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders, including the names "Disney",
+# "Walt Disney Pictures", "Walt Disney Animation Studios", nor the names of
+# their contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Apple Catalog Index Benchmark
+
+Compares two ways of listing the products of an Apple catalog:
+
+- scan: a ProductInfo table scan filtered on its AppleCatalogs set
+- query: a query of the catalog products index
+  (anejocommon.get_apple_catalog_product_keys)
+
+Seeds both tables with --products products (20,000 by default) shaped like
+Apple's. Each product is in a run of consecutive merged catalogs. For the
+newest and the oldest catalog, the benchmark reports:
+
+- the DynamoDB requests
+- the items each request evaluates, and their approximate size (DynamoDB
+  bills scans by every item read, not just the filter matches)
+- the products found
+- the wall time under moto
+
+Runs against moto's DynamoDB mock. Moto scans its tables, so the wall
+times only roughly compare the two.
+
+Requires moto (pip install moto).
+
+Usage:
+    python benchmarks/apple_catalog_index.py [--products 20000]
+
+
+Author:  Jacob F. Grant
+Created: 10/19/26
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+from moto import mock_aws
+
+import anejocommon
+
+
+PRODUCT_INFO_TABLE = 'AnejoProductInfo'
+APPLE_CATALOG_PRODUCTS_TABLE = 'AnejoAppleCatalogProducts'
+
+request_stats = {'requests': 0, 'evaluated': 0}
+
+
+
+### Functions ###
+
+def count_request(parsed, **kwargs):
+    """Count a DynamoDB request and the items it evaluated (botocore after-call event handler)."""
+    request_stats['requests'] += 1
+    request_stats['evaluated'] += parsed.get('ScannedCount', parsed.get('Count', 0))
+
+
+def get_item_size(item):
+    """Return the approximate DynamoDB size of an item in bytes."""
+    return sum([len(key) + len(str(value)) for key, value in item.items()])
+
+
+def create_tables():
+    """Create the ProductInfo and catalog products tables."""
+    dynamodb_client = boto3.client('dynamodb')
+    dynamodb_client.create_table(
+        TableName=PRODUCT_INFO_TABLE,
+        KeySchema=[{'AttributeName': 'product_key', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'product_key', 'AttributeType': 'S'}],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    dynamodb_client.create_table(
+        TableName=APPLE_CATALOG_PRODUCTS_TABLE,
+        KeySchema=[
+            {'AttributeName': 'apple_catalog', 'KeyType': 'HASH'},
+            {'AttributeName': 'product_key', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'apple_catalog', 'AttributeType': 'S'},
+            {'AttributeName': 'product_key', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def seed_products(product_count, apple_catalogs):
+    """Write product_count products to both tables.
+
+    Returns the average item size of each table.
+    """
+    dynamodb = boto3.resource('dynamodb')
+    rng = random.Random(0)
+    product_sizes = []
+    index_sizes = []
+    with dynamodb.Table(PRODUCT_INFO_TABLE).batch_writer() as product_batch, \
+            dynamodb.Table(APPLE_CATALOG_PRODUCTS_TABLE).batch_writer() as index_batch:
+        for i in range(product_count):
+            product_key = '041-' + str(i).zfill(5)
+            first_catalog = rng.randrange(len(apple_catalogs))
+            product_catalogs = apple_catalogs[first_catalog:first_catalog + rng.randint(1, 3)]
+            catalog_entry = {
+                'Packages': [
+                    {
+                        'URL': 'https://swcdn.apple.com/content/downloads/' + product_key + '/Example' + str(package) + '.pkg',
+                        'Size': 104857600 + package,
+                        'Digest': '%040x' % (i * 10 + package)
+                    }
+                    for package in range(3)
+                ],
+                'PostDate': '2019-01-01 00:00:00'
+            }
+            product = {
+                'product_key': product_key,
+                'AppleCatalogs': set(product_catalogs),
+                'OriginalAppleCatalogs': set(product_catalogs),
+                'CatalogEntry': anejocommon.compress_dict(catalog_entry, True),
+                'title': 'Example Update ' + str(i),
+                'version': '1.0',
+                'PostDate': '2019-01-01 00:00:00',
+                'description': 'An example update. ' * 20
+            }
+            product_batch.put_item(Item=product)
+            product_sizes.append(get_item_size(product))
+            for apple_catalog in product_catalogs:
+                index_item = {
+                    'apple_catalog': apple_catalog,
+                    'product_key': product_key,
+                    'run_time': '2019-01-01 00:00:00'
+                }
+                index_batch.put_item(Item=index_item)
+                index_sizes.append(get_item_size(index_item))
+    return {
+        'scan': float(sum(product_sizes)) / len(product_sizes),
+        'query': float(sum(index_sizes)) / len(index_sizes)
+    }
+
+
+def scan_apple_catalog_product_keys(apple_catalog, product_info_table):
+    """Return the product keys of an Apple catalog from a ProductInfo scan."""
+    dynamodb_args = {
+        'Select': 'SPECIFIC_ATTRIBUTES',
+        'ProjectionExpression': 'product_key',
+        'FilterExpression': Attr('AppleCatalogs').contains(apple_catalog)
+    }
+    product_keys = []
+    while True:
+        request = boto3.resource('dynamodb').Table(product_info_table).scan(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            product_keys.append(dynamodb_item['product_key'])
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return product_keys
+
+
+def measure(operation, *args):
+    """Return the results, DynamoDB requests, evaluated items and wall time (ms) of an operation."""
+    request_stats.update({'requests': 0, 'evaluated': 0})
+    start = time.perf_counter()
+    results = operation(*args)
+    wall_ms = (time.perf_counter() - start) * 1000
+    return results, request_stats['requests'], request_stats['evaluated'], wall_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Apple catalog listing (scan vs catalog products index).")
+    parser.add_argument('--products', type=int, default=20000, help="products to seed")
+    args = parser.parse_args()
+
+    apple_catalogs = [
+        os.path.basename(catalog_url)
+        for catalog_url in anejocommon.get_default_prefs()['AppleCatalogURLs']
+    ]
+    with mock_aws():
+        boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register('after-call.dynamodb', count_request)
+        create_tables()
+        item_sizes = seed_products(args.products, apple_catalogs)
+
+        print(
+            "{:<8} {:<6} {:>9} {:>10} {:>12} {:>9} {:>9}".format(
+                'catalog', 'method', 'requests', 'evaluated', 'evaluated KB', 'products', 'moto ms'
+            )
+        )
+        for catalog_label, apple_catalog in [('newest', apple_catalogs[-1]), ('oldest', apple_catalogs[0])]:
+            scan_keys, scan_requests, scan_evaluated, scan_ms = measure(
+                scan_apple_catalog_product_keys,
+                apple_catalog,
+                PRODUCT_INFO_TABLE
+            )
+            query_keys, query_requests, query_evaluated, query_ms = measure(
+                anejocommon.get_apple_catalog_product_keys,
+                apple_catalog,
+                APPLE_CATALOG_PRODUCTS_TABLE
+            )
+            if set(scan_keys) != set(query_keys):
+                raise RuntimeError(apple_catalog + ": scan and query disagree")
+            for method, requests, evaluated, wall_ms in [
+                ('scan', scan_requests, scan_evaluated, scan_ms),
+                ('query', query_requests, query_evaluated, query_ms)
+            ]:
+                print(
+                    "{:<8} {:<6} {:>9} {:>10} {:>12.1f} {:>9} {:>9.1f}".format(
+                        catalog_label,
+                        method,
+                        requests,
+                        evaluated,
+                        evaluated * item_sizes[method] / 1024.0,
+                        len(query_keys),
+                        wall_ms
+                    )
+                )
+
+
+
+if __name__ == "__main__":
+    main()
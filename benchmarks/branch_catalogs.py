@@ -0,0 +1,183 @@
+# BSD 3-Clause License
+#
+# Copyright 2011 Disney Enterprises, Inc.
+# Copyright (c) 2019, Jacob F. Grant
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders, including the names "Disney",
+# "Walt Disney Pictures", "Walt Disney Animation Studios", nor the names of
+# their contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Branch Catalog Benchmark
+
+Measures how the wall time of anejocommon.write_branch_catalogs scales with
+the number of branches, for a serial build (1 worker) and for the bounded
+worker pool.
+
+Branch catalogs are built from a synthetic local catalog. Uploads go to a
+simulated S3 client that waits --put-latency seconds per put_object, or to a
+real bucket with --bucket (using the default AWS credentials).
+
+Usage:
+    python benchmarks/branch_catalogs.py [--branches 1,2,4,8,16,32] [--workers 1,8]
+
+
+Author:  Jacob F. Grant
+Created: 10/19/26
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import boto3
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+import anejocommon
+
+
+LOCAL_CATALOG_PATH = 'html/content/catalogs/others/index-benchmark.merged-1.sucatalog'
+
+
+
+### Classes ###
+
+class SimulatedS3Client(object):
+    """S3 client stand-in whose put_object takes a fixed latency."""
+
+    def __init__(self, put_latency):
+        self.put_latency = put_latency
+
+    def put_object(self, **kwargs):
+        time.sleep(self.put_latency)
+        return {}
+
+
+
+### Functions ###
+
+def get_catalog_plist(product_count):
+    """Return a local catalog of product_count products."""
+    products = {}
+    for i in range(product_count):
+        product_key = '041-' + str(i).zfill(5)
+        base_url = 'https://anejo.example.com/content/downloads/' + product_key + '/'
+        products[product_key] = {
+            'ServerMetadataURL': base_url + 'Example.smd',
+            'Packages': [
+                {
+                    'URL': base_url + 'Example' + str(package) + '.pkg',
+                    'Size': 104857600 + package,
+                    'Digest': '%040x' % (i * 10 + package)
+                }
+                for package in range(3)
+            ],
+            'Distributions': {
+                'English': base_url + product_key + '.English.dist'
+            }
+        }
+    return {
+        'CatalogVersion': 2,
+        'Products': products
+    }
+
+
+def get_branches(branch_count, catalog_plist, branch_product_count):
+    """Return branch_count branches of branch_product_count products each."""
+    product_keys = sorted(catalog_plist['Products'])
+    return [
+        {
+            'catalog_branch': 'branch' + str(i),
+            'product_keys': product_keys[i:i + branch_product_count]
+        }
+        for i in range(branch_count)
+    ]
+
+
+def time_branch_writes(branches, workers, catalog_plist, s3_bucket, s3_client):
+    """Return the wall time (seconds) of writing the branch catalogs."""
+    build_state = {
+        'branch_workers': workers,
+        's3_client': s3_client,
+        'local_catalog_url_base': '',
+        'localization_pruning': '',
+        'preferred_localizations': [],
+        'catalog_branches': branches,
+        'product_info': {}
+    }
+    # Drop the per-branch progress output
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        anejocommon.write_branch_catalogs(
+            LOCAL_CATALOG_PATH,
+            s3_bucket,
+            None,
+            None,
+            catalog_plist,
+            build_state
+        )
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark branch catalog writes by branch count.")
+    parser.add_argument('--branches', default='1,2,4,8,16,32', help="comma-separated branch counts")
+    parser.add_argument('--workers', default='1,8', help="comma-separated worker pool sizes")
+    parser.add_argument('--products', type=int, default=2000, help="products in the local catalog")
+    parser.add_argument('--branch-products', type=int, default=500, help="products in each branch")
+    parser.add_argument('--put-latency', type=float, default=0.05, help="simulated put_object seconds")
+    parser.add_argument('--bucket', help="write to this S3 bucket instead of the simulated client")
+    args = parser.parse_args()
+
+    if args.bucket:
+        s3_client = boto3.client('s3')
+    else:
+        s3_client = SimulatedS3Client(args.put_latency)
+    catalog_plist = get_catalog_plist(args.products)
+    worker_counts = [int(workers) for workers in args.workers.split(',')]
+
+    print(
+        "{:>8} ".format('branches') +
+        " ".join(["{:>12}".format(str(workers) + ' workers s') for workers in worker_counts])
+    )
+    for branch_count in [int(branches) for branches in args.branches.split(',')]:
+        branches = get_branches(branch_count, catalog_plist, args.branch_products)
+        wall_times = [
+            time_branch_writes(branches, workers, catalog_plist, args.bucket, s3_client)
+            for workers in worker_counts
+        ]
+        print(
+            "{:>8} ".format(branch_count) +
+            " ".join(["{:>12.3f}".format(wall_time) for wall_time in wall_times])
+        )
+
+
+
+if __name__ == "__main__":
+    main()
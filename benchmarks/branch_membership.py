@@ -0,0 +1,327 @@
+# BSD 3-Clause License
+#
+# Copyright 2011 Disney Enterprises, Inc.
+# Copyright (c) 2019, Jacob F. Grant
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders, including the names "Disney",
+# "Walt Disney Pictures", "Walt Disney Animation Studios", nor the names of
+# their contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Branch Membership Benchmark
+
+Compares branch membership changes on large branches between the legacy
+model (a product_keys list on the branch item) and the members table (one
+item per branch and product, written by anejocommon.write_branch_members).
+
+For each branch size, reports the DynamoDB requests, the item data read,
+and the size of the largest item written when adding a product, removing a
+product, and listing the branch. DynamoDB bills reads and writes by item
+size. Legacy branches fail once the list outgrows the 400 KB item limit.
+
+Runs against moto's DynamoDB mock. Moto scans its tables, so the wall times
+(moto ms) grow with table size in both models and only roughly compare them.
+
+Requires moto (pip install moto).
+
+Usage:
+    python benchmarks/branch_membership.py [--members 1000,10000,40000]
+
+
+Author:  Jacob F. Grant
+Created: 10/19/26
+"""
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+import boto3
+from botocore.exceptions import ClientError
+from moto import mock_aws
+
+import anejocommon
+
+
+BRANCHES_TABLE = 'AnejoCatalogBranches'
+MEMBERS_TABLE = 'AnejoCatalogBranchMembers'
+LEGACY_BRANCHES_TABLE = 'AnejoLegacyCatalogBranches'
+
+request_stats = {'requests': 0, 'read_bytes': 0}
+
+
+
+### Functions ###
+
+def count_request(parsed, **kwargs):
+    """Count a DynamoDB request and the item data it read (botocore after-call event handler)."""
+    request_stats['requests'] += 1
+    items = parsed.get('Items', [])
+    if 'Item' in parsed:
+        items = [parsed['Item']]
+    for table_items in parsed.get('Responses', {}).values():
+        items = items + list(table_items)
+    request_stats['read_bytes'] += sum([get_item_size(item) for item in items])
+
+
+def get_item_size(item):
+    """Return the approximate DynamoDB size of an item in bytes."""
+    def get_value_size(value):
+        if isinstance(value, dict) and len(value) == 1 and list(value)[0] in ['S', 'N', 'L', 'M', 'SS', 'NS', 'BOOL']:
+            # Typed attribute value (as returned by the client)
+            return get_value_size(list(value.values())[0])
+        elif isinstance(value, str):
+            return len(value.encode('utf-8'))
+        elif isinstance(value, (list, set)):
+            return 3 + sum([get_value_size(element) + 1 for element in value])
+        elif isinstance(value, dict):
+            return 3 + sum([len(key) + get_value_size(element) + 1 for key, element in value.items()])
+        return 21
+    return sum([len(key) + get_value_size(value) for key, value in item.items()])
+
+
+def create_tables():
+    """Create the branch, members and legacy branch tables."""
+    dynamodb_client = boto3.client('dynamodb')
+    for table_name in [BRANCHES_TABLE, LEGACY_BRANCHES_TABLE]:
+        dynamodb_client.create_table(
+            TableName=table_name,
+            KeySchema=[{'AttributeName': 'catalog_branch', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'catalog_branch', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+    dynamodb_client.create_table(
+        TableName=MEMBERS_TABLE,
+        KeySchema=[
+            {'AttributeName': 'catalog_branch', 'KeyType': 'HASH'},
+            {'AttributeName': 'product_key', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'catalog_branch', 'AttributeType': 'S'},
+            {'AttributeName': 'product_key', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+
+
+def seed_branches(catalog_branch, product_keys):
+    """Write a branch of the given products in both models.
+
+    Returns an error message if the legacy branch item cannot be written.
+    """
+    dynamodb = boto3.resource('dynamodb')
+    dynamodb.Table(BRANCHES_TABLE).put_item(
+        Item={
+            'catalog_branch': catalog_branch,
+            'membership_revision': 1,
+            'member_count': len(product_keys)
+        }
+    )
+    with dynamodb.Table(MEMBERS_TABLE).batch_writer() as batch:
+        for product_key in product_keys:
+            batch.put_item(
+                Item={
+                    'catalog_branch': catalog_branch,
+                    'product_key': product_key
+                }
+            )
+    try:
+        dynamodb.Table(LEGACY_BRANCHES_TABLE).put_item(
+            Item={
+                'catalog_branch': catalog_branch,
+                'product_keys': product_keys
+            }
+        )
+    except ClientError as e:
+        return e.response['Error']['Message']
+    return None
+
+
+def legacy_add_product(catalog_branch, product_key):
+    """Add a product to a legacy branch (list_append with a contains() condition)."""
+    try:
+        boto3.resource('dynamodb').Table(LEGACY_BRANCHES_TABLE).update_item(
+            Key={
+                'catalog_branch': catalog_branch
+            },
+            UpdateExpression="SET product_keys = list_append(product_keys, :new_product_key_list)",
+            ExpressionAttributeValues={
+                ':new_product_key': product_key,
+                ':new_product_key_list': [product_key]
+            },
+            ConditionExpression='NOT contains(product_keys, :new_product_key)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def legacy_remove_product(catalog_branch, product_key):
+    """Remove a product from a legacy branch (read and rewrite the list)."""
+    legacy_branches = boto3.resource('dynamodb').Table(LEGACY_BRANCHES_TABLE)
+    product_keys = set(
+        legacy_branches.get_item(
+            Key={
+                'catalog_branch': catalog_branch
+            },
+            ConsistentRead=True
+        )['Item']['product_keys']
+    )
+    product_keys.discard(product_key)
+    legacy_branches.update_item(
+        Key={
+            'catalog_branch': catalog_branch
+        },
+        UpdateExpression="SET product_keys = :updated_product_keys",
+        ExpressionAttributeValues={
+            ':updated_product_keys': list(product_keys)
+        }
+    )
+
+
+def legacy_list_products(catalog_branch):
+    """List the products of a legacy branch."""
+    return boto3.resource('dynamodb').Table(LEGACY_BRANCHES_TABLE).get_item(
+        Key={
+            'catalog_branch': catalog_branch
+        },
+        ConsistentRead=True
+    )['Item']['product_keys']
+
+
+def get_legacy_written_size(catalog_branch, product_key):
+    """Return the size of the item a legacy membership change writes."""
+    return get_item_size(
+        boto3.resource('dynamodb').Table(LEGACY_BRANCHES_TABLE).get_item(
+            Key={
+                'catalog_branch': catalog_branch
+            }
+        )['Item']
+    )
+
+
+def get_members_written_size(catalog_branch, product_key):
+    """Return the size of the largest item a members table change writes."""
+    return max(
+        get_item_size(
+            boto3.resource('dynamodb').Table(BRANCHES_TABLE).get_item(
+                Key={
+                    'catalog_branch': catalog_branch
+                }
+            )['Item']
+        ),
+        get_item_size({'catalog_branch': catalog_branch, 'product_key': product_key})
+    )
+
+
+def measure(operation, *args):
+    """Return the DynamoDB requests, bytes read and wall time (ms) of an operation.
+
+    Raises ClientError if the operation fails (e.g. on the item size limit).
+    """
+    request_stats.update({'requests': 0, 'read_bytes': 0})
+    start = time.perf_counter()
+    operation(*args)
+    wall_ms = (time.perf_counter() - start) * 1000
+    return request_stats['requests'], request_stats['read_bytes'], wall_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark branch membership changes by branch size.")
+    parser.add_argument('--members', default='1000,10000', help="comma-separated branch sizes")
+    args = parser.parse_args()
+
+    with mock_aws():
+        boto3.setup_default_session()
+        boto3.DEFAULT_SESSION.events.register('after-call.dynamodb', count_request)
+        create_tables()
+
+        print(
+            "{:>8} {:<8} {:<7} {:>9} {:>9} {:>11} {:>9}".format(
+                'members', 'model', 'op', 'requests', 'read KB', 'written KB', 'moto ms'
+            )
+        )
+        for member_count in [int(members) for members in args.members.split(',')]:
+            catalog_branch = 'branch' + str(member_count)
+            product_keys = ['041-' + str(i).zfill(6) for i in range(member_count)]
+            legacy_error = seed_branches(catalog_branch, product_keys)
+            new_product_key = '041-' + str(member_count).zfill(6)
+
+            models = [
+                (
+                    'members',
+                    [
+                        ('add', anejocommon.write_branch_members, (catalog_branch, [new_product_key], 'Put', BRANCHES_TABLE, MEMBERS_TABLE)),
+                        ('remove', anejocommon.write_branch_members, (catalog_branch, [new_product_key], 'Delete', BRANCHES_TABLE, MEMBERS_TABLE)),
+                        ('list', anejocommon.get_branch_product_keys, (catalog_branch, MEMBERS_TABLE))
+                    ],
+                    get_members_written_size
+                )
+            ]
+            if legacy_error is None:
+                models.append((
+                    'legacy',
+                    [
+                        ('add', legacy_add_product, (catalog_branch, new_product_key)),
+                        ('remove', legacy_remove_product, (catalog_branch, new_product_key)),
+                        ('list', legacy_list_products, (catalog_branch,))
+                    ],
+                    get_legacy_written_size
+                ))
+            else:
+                print("{:>8} {:<8} {}".format(member_count, 'legacy', legacy_error))
+
+            for model, operations, get_written_size in models:
+                for operation_name, operation, operation_args in operations:
+                    try:
+                        requests, read_bytes, wall_ms = measure(operation, *operation_args)
+                    except ClientError as e:
+                        print("{:>8} {:<8} {:<7} {}".format(member_count, model, operation_name, e.response['Error']['Message']))
+                        continue
+                    written_kb = ''
+                    if operation_name == 'add':
+                        written_kb = "{:.1f}".format(get_written_size(catalog_branch, new_product_key) / 1024.0)
+                    print(
+                        "{:>8} {:<8} {:<7} {:>9} {:>9.1f} {:>11} {:>9.1f}".format(
+                            member_count,
+                            model,
+                            operation_name,
+                            requests,
+                            read_bytes / 1024.0,
+                            written_kb,
+                            wall_ms
+                        )
+                    )
+
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+# BSD 3-Clause License
+#
+# Copyright 2011 Disney Enterprises, Inc.
+# Copyright (c) 2019, Jacob F. Grant
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders, including the names "Disney",
+# "Walt Disney Pictures", "Walt Disney Animation Studios", nor the names of
+# their contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Catalog Parser Benchmark
+
+Compares the time and peak memory of parsing Apple catalogs with plistlib
+(whole catalog in memory) and with anejocommon.iter_catalog_products
+(streamed in 64 KiB chunks, one product at a time).
+
+Catalogs are downloaded to a temporary directory first, so network time is
+not measured. By default the merged catalogs of the default AppleCatalogURLs
+preference are used; catalog URLs or local paths can be given instead, or a
+synthetic catalog of Apple-shaped products generated with --synthetic.
+
+Usage:
+    python benchmarks/catalog_parser.py [--repeat N] [CATALOG ...]
+    python benchmarks/catalog_parser.py --synthetic 20000
+
+
+Author:  Jacob F. Grant
+Created: 10/19/26
+"""
+
+import argparse
+import datetime
+import os
+import plistlib
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+import anejocommon
+
+
+
+### Functions ###
+
+def download_catalog(catalog, download_dir):
+    """Return a local path to a catalog URL or path."""
+    if os.path.exists(catalog):
+        return catalog
+    catalog_path = os.path.join(download_dir, os.path.basename(catalog))
+    response = anejocommon.retrieve_url(catalog)
+    if response.status != 200:
+        raise RuntimeError(catalog + " returned HTTP " + str(response.status))
+    with open(catalog_path, 'wb') as catalog_file:
+        for chunk in response.stream(65536):
+            catalog_file.write(chunk)
+    response.release_conn()
+    return catalog_path
+
+
+def write_synthetic_catalog(product_count, download_dir):
+    """Write a catalog of product_count products shaped like Apple's."""
+    languages = [
+        'English', 'French', 'German', 'Japanese', 'Spanish', 'Italian', 'Dutch', 'da', 'fi',
+        'ko', 'no', 'pl', 'pt', 'pt_PT', 'ru', 'sv', 'zh_CN', 'zh_TW'
+    ]
+    products = {}
+    for i in range(product_count):
+        product_key = '041-' + str(i).zfill(5)
+        base_url = 'https://swcdn.apple.com/content/downloads/' + str(i % 100).zfill(2) + '/' + product_key + '/'
+        products[product_key] = {
+            'ServerMetadataURL': base_url + 'Example.smd',
+            'Packages': [
+                {
+                    'URL': base_url + 'Example' + str(package) + '.pkg',
+                    'MetadataURL': base_url + 'Example' + str(package) + '.pkm',
+                    'Size': 104857600 + package,
+                    'Digest': '%040x' % (i * 10 + package)
+                }
+                for package in range(3)
+            ],
+            'PostDate': datetime.datetime(2019, 1, 1) + datetime.timedelta(minutes=i),
+            'Distributions': {
+                language: base_url + product_key + '.' + language + '.dist'
+                for language in languages
+            }
+        }
+    catalog_path = os.path.join(download_dir, 'synthetic-' + str(product_count) + '.sucatalog')
+    with open(catalog_path, 'wb') as catalog_file:
+        plistlib.dump(
+            {
+                'CatalogVersion': 2,
+                'ApplePostURL': 'http://swpost.apple.com/stats',
+                'IndexDate': datetime.datetime(2019, 1, 1),
+                'Products': products
+            },
+            catalog_file
+        )
+    return catalog_path
+
+
+def read_chunks(catalog_path, chunk_size=65536):
+    """Read a file in chunks of bytes."""
+    with open(catalog_path, 'rb') as catalog_file:
+        while True:
+            chunk = catalog_file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+
+def parse_plistlib(catalog_path):
+    """Parse a catalog with plistlib, returning its product count."""
+    with open(catalog_path, 'rb') as catalog_file:
+        catalog = plistlib.loads(catalog_file.read())
+    return len(catalog.get('Products', {}))
+
+
+def parse_streaming(catalog_path):
+    """Parse a catalog with iter_catalog_products, returning its product count.
+
+    Each product is dropped once parsed, as the catalog sync fan-out does.
+    """
+    product_count = 0
+    for product_key, product in anejocommon.iter_catalog_products(read_chunks(catalog_path)):
+        product_count += 1
+    return product_count
+
+
+def measure(parser, catalog_path, repeat):
+    """Return the product count, best time (seconds), and peak memory (bytes) of a parser."""
+    best_seconds = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        product_count = parser(catalog_path)
+        seconds = time.perf_counter() - start
+        if best_seconds is None or seconds < best_seconds:
+            best_seconds = seconds
+
+    # Peak memory is measured separately, as tracing slows parsing down
+    tracemalloc.start()
+    parser(catalog_path)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return product_count, best_seconds, peak_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark catalog parsing (plistlib vs streaming).")
+    parser.add_argument('catalogs', nargs='*', help="catalog URLs or paths (default: AppleCatalogURLs)")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per parser (best is reported)")
+    parser.add_argument('--synthetic', type=int, metavar='PRODUCTS', help="benchmark a generated catalog instead")
+    args = parser.parse_args()
+
+    download_dir = tempfile.mkdtemp()
+    try:
+        if args.synthetic:
+            catalogs = [write_synthetic_catalog(args.synthetic, download_dir)]
+        else:
+            catalogs = args.catalogs or anejocommon.get_default_prefs()['AppleCatalogURLs']
+        print(
+            "{:<72} {:>8} {:>9} {:>9} {:>10} {:>10}".format(
+                'catalog', 'products', 'plist s', 'stream s', 'plist MiB', 'stream MiB'
+            )
+        )
+        for catalog in catalogs:
+            catalog_path = download_catalog(catalog, download_dir)
+            plist_count, plist_seconds, plist_peak = measure(parse_plistlib, catalog_path, args.repeat)
+            stream_count, stream_seconds, stream_peak = measure(parse_streaming, catalog_path, args.repeat)
+            if plist_count != stream_count:
+                raise RuntimeError(catalog + ": parsers disagree on product count")
+            print(
+                "{:<72} {:>8} {:>9.3f} {:>9.3f} {:>10.1f} {:>10.1f}".format(
+                    os.path.basename(catalog)[-72:],
+                    plist_count,
+                    plist_seconds,
+                    stream_seconds,
+                    plist_peak / 1048576.0,
+                    stream_peak / 1048576.0
+                )
+            )
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+
+
+if __name__ == "__main__":
+    main()
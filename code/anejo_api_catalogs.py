@@ -40,9 +40,10 @@ Author:  Jacob F. Grant
 Created: 03/04/19
 """
 
-import json
+import datetime
 
 import boto3
+from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
 
 import anejocommon
@@ -60,8 +61,12 @@ def get_all_catalogs(catalog_branches_table):
     return anejocommon.generate_api_response(200, catalogs_list)
 
 
-def get_branch_catalog(catalog_name, catalog_branches_table):
-    """Return single branch catalog"""
+def get_branch_catalog(catalog_name, catalog_branches_table, catalog_members_table, if_none_match=None):
+    """Return single branch catalog
+
+    Its validator is the branch's membership revision, so a matching
+    If-None-Match is answered without reading the members.
+    """
     dynamodb_args = {
         'Key': {
             'catalog_branch': catalog_name
@@ -69,17 +74,21 @@ def get_branch_catalog(catalog_name, catalog_branches_table):
         'ConsistentRead': True
     }
     catalog = boto3.resource('dynamodb').Table(catalog_branches_table).get_item(**dynamodb_args)
-    try:
-        catalog_products = catalog['Item']['product_keys']
-        response_code = 200
-    except KeyError:
-        catalog_products = 'Branch catalog does not exist'
-        response_code = 404
-    return anejocommon.generate_api_response(response_code, catalog_products)
+    if 'Item' not in catalog:
+        return anejocommon.generate_api_response(404, 'Branch catalog does not exist')
+
+    validator = anejocommon.get_api_validator(
+        catalog_name,
+        catalog['Item'].get('membership_revision', 0)
+    )
+    if anejocommon.validator_matches(validator, if_none_match or []):
+        return anejocommon.generate_validated_api_response(304, '', validator)
+    catalog_products = anejocommon.get_branch_product_keys(catalog_name, catalog_members_table)
+    return anejocommon.generate_validated_api_response(200, catalog_products, validator)
 
 
-def delete_branch_catalog(catalog_name, catalog_branches_table):
-    """Delete a branch catalog"""
+def delete_branch_catalog(catalog_name, catalog_branches_table, catalog_members_table, catalog_changes_table=None):
+    """Delete a branch catalog (with its members and snapshot changes)"""
     dynamodb_args = {
         'Key': {
             'catalog_branch': catalog_name
@@ -87,31 +96,39 @@ def delete_branch_catalog(catalog_name, catalog_branches_table):
         'ReturnValues': 'NONE'
     }
     boto3.resource('dynamodb').Table(catalog_branches_table).delete_item(**dynamodb_args)
+
+    # Remove the branch's members
+    with boto3.resource('dynamodb').Table(catalog_members_table).batch_writer() as batch:
+        for product_key in anejocommon.get_branch_product_keys(catalog_name, catalog_members_table):
+            batch.delete_item(
+                Key={
+                    'catalog_branch': catalog_name,
+                    'product_key': product_key
+                }
+            )
+    if catalog_changes_table:
+        anejocommon.delete_branch_changes(catalog_name, catalog_changes_table)
     return anejocommon.generate_api_response(200, catalog_name)
 
 
 def create_branch_catalog(catalog_name, catalog_branches_table):
     """Create a branch catalog"""
     dynamodb_args = {
-        'Key': {
+        'Item': {
             'catalog_branch': catalog_name
         },
-        'UpdateExpression': "SET product_keys = :empty_product_keys",
-        'ExpressionAttributeValues': {
-            ':empty_product_keys': []
-        },
-        'ConditionExpression': 'attribute_not_exists(catalog_branch) AND attribute_not_exists(product_keys)'
+        'ConditionExpression': 'attribute_not_exists(catalog_branch)'
     }
     try:
-        boto3.resource('dynamodb').Table(catalog_branches_table).update_item(**dynamodb_args)
+        boto3.resource('dynamodb').Table(catalog_branches_table).put_item(**dynamodb_args)
     except ClientError as e:
-        # Ignore ConditionalCheckFailedExceptionother
+        # Catalog already exists
         if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
             return anejocommon.generate_api_response(500, str(e))
     return anejocommon.generate_api_response(200, catalog_name)
 
 
-def copy_branch_catalog(catalog_name, source_catalog_name, catalog_branches_table):
+def copy_branch_catalog(catalog_name, source_catalog_name, catalog_branches_table, catalog_members_table, catalog_changes_table=None):
     """Copy all items from one branch catalog to another"""
     # Exit with error if source catalog does not exist
     source_catalog = boto3.resource('dynamodb').Table(catalog_branches_table).get_item(
@@ -120,10 +137,11 @@ def copy_branch_catalog(catalog_name, source_catalog_name, catalog_branches_tabl
         },
         ConsistentRead=True
     )
-    try:
-        source_catalog_products = set(source_catalog['Item']['product_keys'])
-    except KeyError:
+    if 'Item' not in source_catalog:
         return anejocommon.generate_api_response(404, 'Source catalog does not exist')
+    source_catalog_products = set(
+        anejocommon.get_branch_product_keys(source_catalog_name, catalog_members_table)
+    )
 
     response = {
         'destination_catalog': catalog_name,
@@ -131,120 +149,549 @@ def copy_branch_catalog(catalog_name, source_catalog_name, catalog_branches_tabl
         'copied_product_keys': []
     }
 
-    # Check if catalog already exists
-    catalog = boto3.resource('dynamodb').Table(catalog_branches_table).get_item(
-        Key={
-            'catalog_branch': catalog_name
-        },
-        ConsistentRead=True
+    # Create catalog if it does not already exist
+    create_response = create_branch_catalog(catalog_name, catalog_branches_table)
+    if create_response['statusCode'] != 200:
+        return create_response
+    catalog_products = set(
+        anejocommon.get_branch_product_keys(catalog_name, catalog_members_table)
     )
-    try:
-        catalog_products = set(catalog['Item']['product_keys'])
-    except KeyError:
-        catalog_products = set()
 
-    updated_product_keys = source_catalog_products.union(catalog_products)
-    if updated_product_keys != catalog_products:
-        response['copied_product_keys'] = list(source_catalog_products.difference(catalog_products))
-        dynamodb_args = {
-            'Key': {
-                'catalog_branch': catalog_name
-            },
-            'UpdateExpression': "SET product_keys = :updated_product_keys",
-            'ExpressionAttributeValues': {
-                ':updated_product_keys': list(updated_product_keys)
-            }
-        }
-        try:
-            boto3.resource('dynamodb').Table(catalog_branches_table).update_item(**dynamodb_args)
-        except ClientError as e:
-            return anejocommon.generate_api_response(500, str(e))
+    # Only write the members missing from the destination catalog
+    copied_product_keys, write_error = anejocommon.write_branch_members(
+        catalog_name,
+        sorted(source_catalog_products.difference(catalog_products)),
+        'Put',
+        catalog_branches_table,
+        catalog_members_table,
+        catalog_changes_table
+    )
+    response['copied_product_keys'] = copied_product_keys or []
+    if write_error:
+        response['error'] = write_error
+        return anejocommon.generate_api_response(500, response)
     return anejocommon.generate_api_response(200, response)
 
 
-def remove_product_from_catalog(catalog_name, product_key, catalog_branches_table):
-    """Remove the given product from the branch catalog"""
+def update_catalog_member(catalog_name, product_key, member_action, catalog_branches_table, catalog_members_table, catalog_changes_table=None):
+    """Put or delete a branch catalog member if the branch catalog exists"""
     response = {
         'branch_catalog': catalog_name,
         'product_key': product_key
     }
+    written_keys, write_error = anejocommon.write_branch_members(
+        catalog_name,
+        [product_key],
+        member_action,
+        catalog_branches_table,
+        catalog_members_table,
+        catalog_changes_table
+    )
+    if written_keys is None:
+        return anejocommon.generate_api_response(404, 'Catalog does not exist')
+    if write_error:
+        return anejocommon.generate_api_response(500, write_error)
+    return anejocommon.generate_api_response(200, response)
+
+
+def remove_product_from_catalog(catalog_name, product_key, catalog_branches_table, catalog_members_table, catalog_changes_table=None):
+    """Remove the given product from the branch catalog"""
+    return update_catalog_member(
+        catalog_name,
+        product_key,
+        'Delete',
+        catalog_branches_table,
+        catalog_members_table,
+        catalog_changes_table
+    )
+
 
+def add_product_to_catalog(catalog_name, product_key, catalog_branches_table, catalog_members_table, catalog_changes_table=None):
+    """Add the given product to the branch catalog"""
+    return update_catalog_member(
+        catalog_name,
+        product_key,
+        'Put',
+        catalog_branches_table,
+        catalog_members_table,
+        catalog_changes_table
+    )
+
+
+def get_product_keys_by_post_date(product_info_table, post_date_after=None, post_date_before=None, product_search_table=None):
+    """Return keys of products posted after and/or before the given dates
+
+    Queries the search index's PostDate partition if a product search table
+    is given, otherwise scans the product info table.
+    """
+    if product_search_table:
+        dynamodb_args = {
+            'KeyConditionExpression': anejocommon.get_search_key_condition(
+                'postdate',
+                post_date_after,
+                post_date_before
+            ),
+            'ProjectionExpression': 'product_key, PostDate'
+        }
+        product_keys = []
+        while True:
+            request = boto3.resource('dynamodb').Table(product_search_table).query(**dynamodb_args)
+            for dynamodb_item in request['Items']:
+                # The key condition is inclusive, the selector is not
+                if post_date_after and not dynamodb_item['PostDate'] > str(post_date_after):
+                    continue
+                if post_date_before and not dynamodb_item['PostDate'] < str(post_date_before):
+                    continue
+                product_keys.append(dynamodb_item['product_key'])
+            try:
+                dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+            except KeyError:
+                break
+        return product_keys
+
+    filter_expression = Attr('PostDate').exists()
+    if post_date_after:
+        filter_expression &= Attr('PostDate').gt(str(post_date_after))
+    if post_date_before:
+        filter_expression &= Attr('PostDate').lt(str(post_date_before))
+    dynamodb_args = {
+        'Select': 'SPECIFIC_ATTRIBUTES',
+        'ProjectionExpression': 'product_key',
+        'FilterExpression': filter_expression,
+        'ConsistentRead': True
+    }
+    product_keys = []
+    while True:
+        request = boto3.resource('dynamodb').Table(product_info_table).scan(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            product_keys.append(dynamodb_item['product_key'])
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return product_keys
+
+
+def get_bulk_product_keys(bulk_request, catalog_branches_table, catalog_members_table, product_info_table, product_search_table=None):
+    """Return the product keys selected by a bulk membership request body.
+
+    The body may list product_keys, filter on post_date_after and/or
+    post_date_before, and limit the selection to the members of a
+    source_catalog. Returns None if nothing was selected by the body.
+    Raises ValueError if product_keys is not a list.
+    """
+    if not isinstance(bulk_request, dict):
+        return None
+
+    product_keys = None
+    if 'product_keys' in bulk_request:
+        if not isinstance(bulk_request['product_keys'], list):
+            raise ValueError('product_keys must be a list')
+        product_keys = set(str(product_key) for product_key in bulk_request['product_keys'])
+    if bulk_request.get('post_date_after') or bulk_request.get('post_date_before'):
+        filtered_keys = set(get_product_keys_by_post_date(
+            product_info_table,
+            bulk_request.get('post_date_after'),
+            bulk_request.get('post_date_before'),
+            product_search_table
+        ))
+        product_keys = filtered_keys if product_keys is None else product_keys & filtered_keys
+    if bulk_request.get('source_catalog'):
+        source_catalog = boto3.resource('dynamodb').Table(catalog_branches_table).get_item(
+            Key={
+                'catalog_branch': bulk_request['source_catalog']
+            },
+            ConsistentRead=True
+        )
+        if 'Item' not in source_catalog:
+            return None
+        source_keys = set(anejocommon.get_branch_product_keys(
+            bulk_request['source_catalog'],
+            catalog_members_table
+        ))
+        product_keys = source_keys if product_keys is None else product_keys & source_keys
+    return product_keys
+
+
+def bulk_update_catalog_members(catalog_name, bulk_request, member_action, catalog_branches_table, catalog_members_table, product_info_table, product_search_table=None, catalog_changes_table=None):
+    """Add or remove many products from a branch catalog.
+
+    Only the members that actually change are written. Returns the
+    resulting diff.
+    """
     catalog = boto3.resource('dynamodb').Table(catalog_branches_table).get_item(
         Key={
             'catalog_branch': catalog_name
         },
         ConsistentRead=True
     )
-    try:
-        catalog_products = set(catalog['Item']['product_keys'])
-    except KeyError:
+    if 'Item' not in catalog:
         return anejocommon.generate_api_response(404, 'Catalog does not exist')
 
-    if product_key not in catalog_products:
-        return anejocommon.generate_api_response(200, response)
-    
-    catalog_products.remove(product_key)
-    dynamodb_args = {
-        'Key': {
+    try:
+        product_keys = get_bulk_product_keys(
+            bulk_request,
+            catalog_branches_table,
+            catalog_members_table,
+            product_info_table,
+            product_search_table
+        )
+    except ValueError as e:
+        return anejocommon.generate_api_response(400, str(e))
+    if product_keys is None:
+        return anejocommon.generate_api_response(
+            400,
+            'Request must include product_keys, post_date_after, post_date_before or an existing source_catalog'
+        )
+
+    catalog_products = set(anejocommon.get_branch_product_keys(catalog_name, catalog_members_table))
+    if member_action == 'Put':
+        changed_keys = sorted(product_keys.difference(catalog_products))
+        diff_key = 'added_product_keys'
+    else:
+        changed_keys = sorted(product_keys.intersection(catalog_products))
+        diff_key = 'removed_product_keys'
+
+    response = {
+        'branch_catalog': catalog_name,
+        diff_key: [],
+        'unchanged_product_keys': sorted(product_keys.difference(changed_keys))
+    }
+
+    written_keys, write_error = anejocommon.write_branch_members(
+        catalog_name,
+        changed_keys,
+        member_action,
+        catalog_branches_table,
+        catalog_members_table,
+        catalog_changes_table
+    )
+    response[diff_key] = written_keys or []
+    if write_error:
+        # Report the part of the diff already applied
+        response['error'] = write_error
+        response['unapplied_product_keys'] = sorted(set(changed_keys).difference(response[diff_key]))
+        response['partially_applied'] = bool(response[diff_key])
+        return anejocommon.generate_api_response(500, response)
+    return anejocommon.generate_api_response(200, response)
+
+
+def get_catalog_branch_item(catalog_name, catalog_branches_table):
+    """Return a branch catalog's item, or None if it does not exist"""
+    return boto3.resource('dynamodb').Table(catalog_branches_table).get_item(
+        Key={
             'catalog_branch': catalog_name
         },
-        'UpdateExpression': "SET product_keys = :updated_product_keys",
-        'ExpressionAttributeValues': {
-            ':updated_product_keys': list(catalog_products)
+        ConsistentRead=True
+    ).get('Item')
+
+
+def list_catalog_snapshots(catalog_name, catalog_branches_table):
+    """Return a list of a branch catalog's snapshots"""
+    catalog = get_catalog_branch_item(catalog_name, catalog_branches_table)
+    if catalog is None:
+        return anejocommon.generate_api_response(404, 'Catalog does not exist')
+    snapshot_list = []
+    for snapshot_id, snapshot in catalog.get('snapshots', {}).items():
+        snapshot = dict(
+            snapshot,
+            snapshot_id=snapshot_id,
+            product_count=int(snapshot.get('product_count', 0))
+        )
+        if 'revision' in snapshot:
+            snapshot['revision'] = int(snapshot['revision'])
+        snapshot_list.append(snapshot)
+    snapshot_list.sort(key=lambda snapshot: snapshot['created'])
+    return anejocommon.generate_api_response(200, snapshot_list)
+
+
+def create_catalog_snapshot(catalog_name, snapshot_request, catalog_branches_table, catalog_members_table, max_attempts=10):
+    """Snapshot a branch catalog's current membership
+
+    A snapshot only records the branch's membership revision. The members
+    changed after it are recorded by anejocommon.write_branch_members while
+    the branch has snapshots (copy-on-write), so taking a snapshot does not
+    depend on the size of the branch.
+    """
+    catalog_branches = boto3.resource('dynamodb').Table(catalog_branches_table)
+    for attempt in range(max_attempts):
+        catalog = get_catalog_branch_item(catalog_name, catalog_branches_table)
+        if catalog is None:
+            return anejocommon.generate_api_response(404, 'Catalog does not exist')
+
+        created = datetime.datetime.utcnow()
+        if isinstance(snapshot_request, dict) and snapshot_request.get('snapshot'):
+            snapshot_id = str(snapshot_request['snapshot'])
+        else:
+            snapshot_id = created.strftime('%Y%m%dT%H%M%SZ')
+        if snapshot_id in catalog.get('snapshots', {}):
+            return anejocommon.generate_api_response(400, 'Snapshot already exists')
+
+        # Branches written before member_count are counted once
+        member_count = catalog.get('member_count')
+        if member_count is None:
+            member_count = anejocommon.get_branch_member_count(catalog_name, catalog_members_table)
+        revision = int(catalog.get('membership_revision', 0))
+        snapshot = {
+            'revision': revision,
+            'product_count': int(member_count),
+            'created': created.strftime('%Y-%m-%d %H:%M:%S')
         }
-    }
+
+        # Bumping the revision makes member writes that read the branch
+        # before the snapshot existed retry, and so record their changes
+        if 'membership_revision' in catalog:
+            revision_condition = 'membership_revision = :revision'
+            expression_attribute_values = {':revision': revision}
+        else:
+            revision_condition = 'attribute_exists(catalog_branch) AND attribute_not_exists(membership_revision)'
+            expression_attribute_values = {}
+        expression_attribute_values[':next_revision'] = revision + 1
+        expression_attribute_values[':member_count'] = int(member_count)
+        expression_attribute_values[':snapshot'] = snapshot
+        try:
+            if 'snapshots' not in catalog:
+                catalog_branches.update_item(
+                    Key={
+                        'catalog_branch': catalog_name
+                    },
+                    UpdateExpression="SET snapshots = if_not_exists(snapshots, :empty)",
+                    ExpressionAttributeValues={
+                        ':empty': {}
+                    },
+                    ConditionExpression='attribute_exists(catalog_branch)'
+                )
+            catalog_branches.update_item(
+                Key={
+                    'catalog_branch': catalog_name
+                },
+                UpdateExpression=(
+                    "SET snapshots.#snapshot_id = :snapshot, "
+                    "membership_revision = :next_revision, "
+                    "member_count = :member_count"
+                ),
+                ExpressionAttributeNames={
+                    '#snapshot_id': snapshot_id
+                },
+                ExpressionAttributeValues=expression_attribute_values,
+                ConditionExpression=revision_condition + ' AND attribute_not_exists(snapshots.#snapshot_id)'
+            )
+        except ClientError as e:
+            # Branch changed since it was read, read it again
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                continue
+            return anejocommon.generate_api_response(500, str(e))
+        return anejocommon.generate_api_response(
+            200,
+            dict(snapshot, snapshot_id=snapshot_id, branch_catalog=catalog_name)
+        )
+    return anejocommon.generate_api_response(409, 'Snapshot could not be created')
+
+
+def delete_catalog_snapshot(catalog_name, snapshot_id, catalog_branches_table, catalog_changes_table=None):
+    """Delete a branch catalog snapshot
+
+    Recorded changes no longer needed by the remaining snapshots are
+    deleted with it.
+    """
     try:
-        boto3.resource('dynamodb').Table(catalog_branches_table).update_item(**dynamodb_args)
+        catalog = boto3.resource('dynamodb').Table(catalog_branches_table).update_item(
+            Key={
+                'catalog_branch': catalog_name
+            },
+            UpdateExpression="REMOVE snapshots.#snapshot_id",
+            ExpressionAttributeNames={
+                '#snapshot_id': snapshot_id
+            },
+            ConditionExpression='attribute_exists(snapshots.#snapshot_id)',
+            ReturnValues='ALL_NEW'
+        )['Attributes']
     except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return anejocommon.generate_api_response(404, 'Snapshot does not exist')
         return anejocommon.generate_api_response(500, str(e))
-    return anejocommon.generate_api_response(200, response)
 
+    if catalog_changes_table:
+        # Snapshots taken later start at the current revision or above
+        needed_revisions = [
+            int(snapshot['revision'])
+            for snapshot in catalog.get('snapshots', {}).values()
+            if 'revision' in snapshot
+        ]
+        needed_revisions.append(int(catalog.get('membership_revision', 0)))
+        anejocommon.delete_branch_changes(catalog_name, catalog_changes_table, min(needed_revisions))
+    return anejocommon.generate_api_response(200, snapshot_id)
+
+
+def get_snapshot_diff(catalog_name, snapshot, against_snapshot, catalog_changes_table):
+    """Return the product keys a snapshot adds and removes compared to another.
+
+    Compares with the current membership if against_snapshot is None. Only
+    the changes recorded between the two revisions are read.
+    """
+    snapshot_revision = int(snapshot['revision'])
+    against_revision = None if against_snapshot is None else int(against_snapshot['revision'])
+    if against_revision is None or snapshot_revision <= against_revision:
+        member_states = anejocommon.get_branch_member_states(
+            catalog_name,
+            catalog_changes_table,
+            snapshot_revision,
+            against_revision
+        )
+    else:
+        member_states = {
+            product_key: (snapshot_member, against_member)
+            for product_key, (against_member, snapshot_member) in anejocommon.get_branch_member_states(
+                catalog_name,
+                catalog_changes_table,
+                against_revision,
+                snapshot_revision
+            ).items()
+        }
+    added_keys = set(
+        product_key
+        for product_key, (snapshot_member, against_member) in member_states.items()
+        if snapshot_member and not against_member
+    )
+    removed_keys = set(
+        product_key
+        for product_key, (snapshot_member, against_member) in member_states.items()
+        if against_member and not snapshot_member
+    )
+    return sorted(added_keys), sorted(removed_keys)
+
+
+def diff_catalog_snapshot(catalog_name, snapshot_id, against_snapshot_id, catalog_branches_table, catalog_changes_table, if_none_match=None):
+    """Return the changes restoring a snapshot would make.
+
+    Diffs against the branch catalog's current membership, or against
+    another of its snapshots if against_snapshot_id is given. Its validator
+    is derived from the snapshots (and the membership revision), so a
+    matching If-None-Match is answered without reading any changes.
+    """
+    catalog = get_catalog_branch_item(catalog_name, catalog_branches_table)
+    if catalog is None:
+        return anejocommon.generate_api_response(404, 'Catalog does not exist')
+    snapshots = catalog.get('snapshots', {})
+    if snapshot_id not in snapshots or (against_snapshot_id and against_snapshot_id not in snapshots):
+        return anejocommon.generate_api_response(404, 'Snapshot does not exist')
+
+    validator = anejocommon.get_api_validator(
+        catalog_name,
+        snapshot_id,
+        snapshots[snapshot_id],
+        against_snapshot_id,
+        snapshots[against_snapshot_id] if against_snapshot_id else catalog.get('membership_revision', 0)
+    )
+    if anejocommon.validator_matches(validator, if_none_match or []):
+        return anejocommon.generate_validated_api_response(304, '', validator)
 
-def add_product_to_catalog(catalog_name, product_key, catalog_branches_table):
-    """Add the given product to the branch catalog"""
     response = {
         'branch_catalog': catalog_name,
-        'product_key': product_key
+        'snapshot_id': snapshot_id,
+        'against': against_snapshot_id or 'current'
     }
+    response['added_product_keys'], response['removed_product_keys'] = get_snapshot_diff(
+        catalog_name,
+        snapshots[snapshot_id],
+        snapshots[against_snapshot_id] if against_snapshot_id else None,
+        catalog_changes_table
+    )
+    return anejocommon.generate_validated_api_response(200, response, validator)
 
-    dynamodb_args = {
-        'Key': {
-            'catalog_branch': catalog_name
-        },
-        'UpdateExpression': "SET product_keys = list_append(product_keys, :new_product_key_list)",
-        'ExpressionAttributeValues': {
-            ':new_product_key': product_key,
-            ':new_product_key_list': [product_key]
-        },
-        'ConditionExpression': 'NOT contains(product_keys, :new_product_key)',
-        'ReturnValues': 'ALL_NEW'
-    }
-    try:
-        updated_catalog = boto3.resource('dynamodb').Table(catalog_branches_table).update_item(**dynamodb_args)
-    except ClientError as e:
-        # Ignore ConditionalCheckFailedExceptionother
-        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
-            return anejocommon.generate_api_response(200, response)
-        else:
-            return anejocommon.generate_api_response(500, str(e))
 
-    try:
-        updated_catalog = updated_catalog['Attributes']
-    except KeyError:
-        return anejocommon.generate_api_response(500, 'Error adding product to catalog')
-    
+def restore_catalog_snapshot(catalog_name, snapshot_id, catalog_branches_table, catalog_members_table, catalog_changes_table):
+    """Restore a branch catalog's membership from a snapshot.
+
+    Only the members changed since the snapshot are written.
+    """
+    catalog = get_catalog_branch_item(catalog_name, catalog_branches_table)
+    if catalog is None:
+        return anejocommon.generate_api_response(404, 'Catalog does not exist')
+    if snapshot_id not in catalog.get('snapshots', {}):
+        return anejocommon.generate_api_response(404, 'Snapshot does not exist')
+
+    added_keys, removed_keys = get_snapshot_diff(
+        catalog_name,
+        catalog['snapshots'][snapshot_id],
+        None,
+        catalog_changes_table
+    )
+
+    response = {
+        'branch_catalog': catalog_name,
+        'snapshot_id': snapshot_id,
+        'added_product_keys': [],
+        'removed_product_keys': []
+    }
+    restore_writes = [
+        ('added_product_keys', 'Put', added_keys),
+        ('removed_product_keys', 'Delete', removed_keys)
+    ]
+    for diff_key, member_action, changed_keys in restore_writes:
+        written_keys, write_error = anejocommon.write_branch_members(
+            catalog_name,
+            changed_keys,
+            member_action,
+            catalog_branches_table,
+            catalog_members_table,
+            catalog_changes_table
+        )
+        response[diff_key] = written_keys or []
+        if write_error:
+            response['error'] = write_error
+            response['partially_applied'] = bool(
+                response['added_product_keys'] or response['removed_product_keys']
+            )
+            return anejocommon.generate_api_response(500, response)
     return anejocommon.generate_api_response(200, response)
 
 
+def rebuild_branch_catalog(catalog_name, api_response, catalog_branches_table, write_catalog_queue_url, rebuild_delay):
+    """Queue a rebuild of a branch's published catalogs after a successful change
+
+    Changes reporting empty member diffs (nothing added or removed) are not
+    rebuilt.
+    """
+    catalog_changed = api_response['statusCode'] == 200
+    if isinstance(api_response['body'], dict):
+        if api_response['body'].get('partially_applied'):
+            catalog_changed = True
+        diff_keys = [
+            diff_key
+            for diff_key in ['added_product_keys', 'removed_product_keys']
+            if diff_key in api_response['body']
+        ]
+        if diff_keys and not any(api_response['body'][diff_key] for diff_key in diff_keys):
+            catalog_changed = False
+    if catalog_changed and write_catalog_queue_url:
+        try:
+            anejocommon.request_branch_rebuild(
+                catalog_name,
+                catalog_branches_table,
+                write_catalog_queue_url,
+                rebuild_delay
+            )
+        except ClientError as e:
+            print("ERROR: Cannot queue rebuild of branch " + catalog_name + ": " + str(e))
+    return api_response
+
+
 
 ### HANDLER FUNCTION ###
 
+@anejocommon.api_handler
 def lambda_handler(event, context):
     """Handler function for AWS Lambda."""
     # Environmental Variables
     CATALOG_BRANCHES_TABLE = anejocommon.set_env_var('CATALOG_BRANCHES_TABLE')
+    CATALOG_MEMBERS_TABLE = anejocommon.set_env_var('CATALOG_MEMBERS_TABLE')
+    CATALOG_CHANGES_TABLE = anejocommon.set_env_var('CATALOG_CHANGES_TABLE')
     PRODUCT_INFO_TABLE = anejocommon.set_env_var('PRODUCT_INFO_TABLE')
+    PRODUCT_SEARCH_TABLE = anejocommon.set_env_var('PRODUCT_SEARCH_TABLE')
     S3_BUCKET = anejocommon.set_env_var('S3_BUCKET')
+    WRITE_CATALOG_QUEUE_URL = anejocommon.set_env_var('WRITE_CATALOG_QUEUE_URL')
+    BRANCH_REBUILD_DELAY = anejocommon.set_env_var('BRANCH_REBUILD_DELAY', 30)
 
     # Event Variables
     try:
@@ -275,6 +722,19 @@ def lambda_handler(event, context):
     except KeyError:
         product_key = None
 
+    try:
+        snapshot_id = event['params']['path']['snapshot']
+    except KeyError:
+        snapshot_id = None
+
+    try:
+        against_snapshot_id = event['params']['querystring']['against']
+    except KeyError:
+        against_snapshot_id = None
+
+    # Entity tags of a conditional GET
+    if_none_match = anejocommon.get_request_validators(event)
+
     # /catalogs (GET)
     if (resource_path == '/catalogs' and http_method == 'GET'):
         return get_all_catalogs(CATALOG_BRANCHES_TABLE)
@@ -284,30 +744,138 @@ def lambda_handler(event, context):
 
         # GET
         if http_method == 'GET':
-            return get_branch_catalog(catalog_name, CATALOG_BRANCHES_TABLE)
+            return get_branch_catalog(catalog_name, CATALOG_BRANCHES_TABLE, CATALOG_MEMBERS_TABLE, if_none_match)
 
         # DELETE
         if http_method == 'DELETE':
-            return delete_branch_catalog(catalog_name, CATALOG_BRANCHES_TABLE)
+            return rebuild_branch_catalog(
+                catalog_name,
+                delete_branch_catalog(catalog_name, CATALOG_BRANCHES_TABLE, CATALOG_MEMBERS_TABLE, CATALOG_CHANGES_TABLE),
+                CATALOG_BRANCHES_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                BRANCH_REBUILD_DELAY
+            )
 
         # POST
         if http_method == 'POST':
-            return create_branch_catalog(catalog_name, CATALOG_BRANCHES_TABLE)
+            return rebuild_branch_catalog(
+                catalog_name,
+                create_branch_catalog(catalog_name, CATALOG_BRANCHES_TABLE),
+                CATALOG_BRANCHES_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                BRANCH_REBUILD_DELAY
+            )
 
     # /catalogs/{catalog}/copy/{source}
     if (resource_path == '/catalogs/{catalog}/copy/{source}' and catalog_name and source_catalog):
-        return copy_branch_catalog(catalog_name, source_catalog, CATALOG_BRANCHES_TABLE)
+        return rebuild_branch_catalog(
+            catalog_name,
+            copy_branch_catalog(catalog_name, source_catalog, CATALOG_BRANCHES_TABLE, CATALOG_MEMBERS_TABLE, CATALOG_CHANGES_TABLE),
+            CATALOG_BRANCHES_TABLE,
+            WRITE_CATALOG_QUEUE_URL,
+            BRANCH_REBUILD_DELAY
+        )
+
+    # /catalogs/{catalog}/snapshots
+    if (resource_path == '/catalogs/{catalog}/snapshots' and catalog_name):
+
+        # GET
+        if http_method == 'GET':
+            return list_catalog_snapshots(catalog_name, CATALOG_BRANCHES_TABLE)
+
+        # POST
+        # Taking a snapshot bumps the membership revision, which supersedes
+        # any rebuild still queued for the last change, so queue it again
+        if http_method == 'POST':
+            return rebuild_branch_catalog(
+                catalog_name,
+                create_catalog_snapshot(
+                    catalog_name,
+                    event_body,
+                    CATALOG_BRANCHES_TABLE,
+                    CATALOG_MEMBERS_TABLE
+                ),
+                CATALOG_BRANCHES_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                BRANCH_REBUILD_DELAY
+            )
+
+    # /catalogs/{catalog}/snapshots/{snapshot}
+    if (resource_path == '/catalogs/{catalog}/snapshots/{snapshot}' and catalog_name and snapshot_id):
+
+        # GET
+        if http_method == 'GET':
+            return diff_catalog_snapshot(
+                catalog_name,
+                snapshot_id,
+                against_snapshot_id,
+                CATALOG_BRANCHES_TABLE,
+                CATALOG_CHANGES_TABLE,
+                if_none_match
+            )
+
+        # DELETE
+        if http_method == 'DELETE':
+            return delete_catalog_snapshot(catalog_name, snapshot_id, CATALOG_BRANCHES_TABLE, CATALOG_CHANGES_TABLE)
+
+        # POST
+        if http_method == 'POST':
+            return rebuild_branch_catalog(
+                catalog_name,
+                restore_catalog_snapshot(
+                    catalog_name,
+                    snapshot_id,
+                    CATALOG_BRANCHES_TABLE,
+                    CATALOG_MEMBERS_TABLE,
+                    CATALOG_CHANGES_TABLE
+                ),
+                CATALOG_BRANCHES_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                BRANCH_REBUILD_DELAY
+            )
+
+    # /catalogs/{catalog}/products
+    if (resource_path == '/catalogs/{catalog}/products' and catalog_name):
+        if http_method in ('POST', 'DELETE'):
+            return rebuild_branch_catalog(
+                catalog_name,
+                bulk_update_catalog_members(
+                    catalog_name,
+                    event_body,
+                    'Put' if http_method == 'POST' else 'Delete',
+                    CATALOG_BRANCHES_TABLE,
+                    CATALOG_MEMBERS_TABLE,
+                    PRODUCT_INFO_TABLE,
+                    PRODUCT_SEARCH_TABLE,
+                    CATALOG_CHANGES_TABLE
+                ),
+                CATALOG_BRANCHES_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                BRANCH_REBUILD_DELAY
+            )
 
     # /catalogs/{catalog}/{product}
     if (resource_path == '/catalogs/{catalog}/{product}' and catalog_name and product_key):
 
         # DELETE
         if http_method == 'DELETE':
-            return remove_product_from_catalog(catalog_name, product_key, CATALOG_BRANCHES_TABLE)
+            return rebuild_branch_catalog(
+                catalog_name,
+                remove_product_from_catalog(catalog_name, product_key, CATALOG_BRANCHES_TABLE, CATALOG_MEMBERS_TABLE, CATALOG_CHANGES_TABLE),
+                CATALOG_BRANCHES_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                BRANCH_REBUILD_DELAY
+            )
 
         # POST
         if http_method == 'POST':
-            return add_product_to_catalog(catalog_name, product_key, CATALOG_BRANCHES_TABLE)
+            return rebuild_branch_catalog(
+                catalog_name,
+                add_product_to_catalog(catalog_name, product_key, CATALOG_BRANCHES_TABLE, CATALOG_MEMBERS_TABLE, CATALOG_CHANGES_TABLE),
+                CATALOG_BRANCHES_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                BRANCH_REBUILD_DELAY
+            )
 
     return anejocommon.generate_api_response(500, event_body)
     return anejocommon.generate_api_response(500, "Error: No matching API method found")
@@ -100,6 +100,7 @@ def set_pref_value(pref_name, pref, s3_bucket):
 
 ### HANDLER FUNCTION ###
 
+@anejocommon.api_handler
 def lambda_handler(event, context):
     """Handler function for AWS Lambda."""
     # Environmental Variables
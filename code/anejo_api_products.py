@@ -40,9 +40,15 @@ Author:  Jacob F. Grant
 Created: 03/04/19
 """
 
+import base64
+import binascii
+from concurrent.futures import ThreadPoolExecutor
+import decimal
 import json
+from time import sleep
 
 import boto3
+from boto3.dynamodb.types import TypeDeserializer
 from botocore.exceptions import ClientError
 
 import anejocommon
@@ -51,24 +57,301 @@ import anejocommon
 
 ### Functions ###
 
-def get_all_products(product_info_table):
-    """Return a dictionary of preferences"""
+def encode_cursor(last_evaluated_key):
+    """Encode a DynamoDB LastEvaluatedKey as an opaque listing cursor"""
+    return base64.urlsafe_b64encode(json.dumps(last_evaluated_key).encode('utf-8')).decode('utf-8')
+
+
+def decode_cursor(cursor, key_name='product_key'):
+    """Decode a listing cursor to a DynamoDB ExclusiveStartKey.
+
+    Raises ValueError if the cursor is not valid.
+    """
+    try:
+        exclusive_start_key = json.loads(base64.urlsafe_b64decode(cursor.encode('utf-8')).decode('utf-8'))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError('Invalid cursor')
+    if not isinstance(exclusive_start_key, dict) or key_name not in exclusive_start_key:
+        raise ValueError('Invalid cursor')
+    return exclusive_start_key
+
+
+def get_listing_projection(fields=None):
+    """Return a ProjectionExpression and ExpressionAttributeNames for listed fields"""
+    if not fields:
+        fields = ['title', 'version', 'PostDate']
+    fields = ['product_key'] + [field for field in fields if field != 'product_key']
+    expression_attribute_names = {}
+    for field in fields:
+        expression_attribute_names['#field' + str(len(expression_attribute_names))] = field
+    return ', '.join(expression_attribute_names.keys()), expression_attribute_names
+
+
+def format_product_item(dynamodb_item):
+    """Make a listed Product Info item JSON serializable"""
+    for key, value in dynamodb_item.items():
+        if isinstance(value, set):
+            dynamodb_item[key] = sorted(value)
+        elif isinstance(value, decimal.Decimal):
+            dynamodb_item[key] = int(value) if value % 1 == 0 else float(value)
+    if 'PostDate' in dynamodb_item:
+        dynamodb_item['PostDate'] = dynamodb_item['PostDate'].split(' ')[0]
+    if 'CatalogEntry' in dynamodb_item:
+        dynamodb_item['CatalogEntry'] = anejocommon.uncompress_dict(dynamodb_item['CatalogEntry'])
+    return dynamodb_item
+
+
+def get_product_info_chunk(product_keys, product_info_table, projection_expression, expression_attribute_names, consistent_read, dynamodb_client):
+    """Return Product Info items for up to 100 product keys with BatchGetItem.
+
+    Unprocessed keys are retried with exponential backoff.
+    """
+    table_request = {
+        'Keys': [{'product_key': {'S': product_key}} for product_key in product_keys],
+        'ProjectionExpression': projection_expression,
+        'ConsistentRead': consistent_read
+    }
+    if expression_attribute_names:
+        table_request['ExpressionAttributeNames'] = expression_attribute_names
+    request_items = {product_info_table: table_request}
+
+    deserializer = TypeDeserializer()
+    product_info = []
+    retries = 0
+    while request_items:
+        if retries:
+            sleep(min(0.05 * 2 ** retries, 1))
+        request = dynamodb_client.batch_get_item(RequestItems=request_items)
+        for dynamodb_item in request['Responses'].get(product_info_table, []):
+            product_info.append({
+                key: deserializer.deserialize(value)
+                for key, value in dynamodb_item.items()
+            })
+        request_items = request.get('UnprocessedKeys')
+        retries += 1
+    return product_info
+
+
+def get_product_info_items(product_keys, product_info_table, projection_expression, expression_attribute_names=None, consistent_read=True, batch_size=100, workers=8):
+    """Return Product Info items for a list of product keys.
+
+    Keys are fetched in chunks of batch_size with parallel BatchGetItem
+    calls sharing one DynamoDB client.
+    """
+    dynamodb_client = boto3.client('dynamodb')
+    product_key_chunks = [
+        product_keys[i:i + batch_size]
+        for i in range(0, len(product_keys), batch_size)
+    ]
+    product_info = []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(product_key_chunks)))) as executor:
+        for chunk_info in executor.map(
+            lambda product_key_chunk: get_product_info_chunk(
+                product_key_chunk,
+                product_info_table,
+                projection_expression,
+                expression_attribute_names,
+                consistent_read,
+                dynamodb_client
+            ),
+            product_key_chunks
+        ):
+            product_info.extend(chunk_info)
+    return product_info
+
+
+def get_batch_products(batch_request, product_info_table, max_keys=500):
+    """Return info for a list of products, listing any not found"""
+    product_keys = batch_request.get('product_keys') if isinstance(batch_request, dict) else None
+    if not isinstance(product_keys, list) or not all(isinstance(product_key, str) for product_key in product_keys):
+        return anejocommon.generate_api_response(400, 'Request must include a list of product_keys')
+    # Limit the request as sent, before removing duplicates
+    if len(product_keys) > max_keys:
+        return anejocommon.generate_api_response(400, 'Request is limited to ' + str(max_keys) + ' product_keys')
+    product_keys = list(dict.fromkeys(product_keys))
+
+    fields = batch_request.get('fields')
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(',') if field.strip()]
+    projection_expression, expression_attribute_names = get_listing_projection(fields)
+    product_info = get_product_info_items(
+        product_keys,
+        product_info_table,
+        projection_expression,
+        expression_attribute_names,
+        batch_request.get('consistent', False)
+    )
+    product_info = [format_product_item(dynamodb_item) for dynamodb_item in product_info]
+    key_positions = {product_key: position for position, product_key in enumerate(product_keys)}
+    product_info.sort(key=lambda dynamodb_item: key_positions[dynamodb_item['product_key']])
+
+    found_keys = set(dynamodb_item['product_key'] for dynamodb_item in product_info)
+    return anejocommon.generate_api_response(
+        200,
+        {
+            'products': product_info,
+            'missing_product_keys': [
+                product_key for product_key in product_keys
+                if product_key not in found_keys
+            ]
+        }
+    )
+
+
+def generate_listing_response(product_info, last_evaluated_key, paginated):
+    """Return a products listing API response.
+
+    Paginated listings are wrapped with the cursor of the next page (None
+    on the last page); unpaginated listings are a plain list.
+    """
+    if not paginated:
+        return anejocommon.generate_api_response(200, product_info)
+    next_cursor = None
+    if last_evaluated_key:
+        next_cursor = encode_cursor(last_evaluated_key)
+    return anejocommon.generate_api_response(
+        200,
+        {
+            'products': product_info,
+            'next_cursor': next_cursor
+        }
+    )
+
+
+def get_catalog_products(apple_catalog, product_info_table, apple_catalog_products_table, limit=None, cursor=None, fields=None, consistent=False):
+    """Return a list of the products in an Apple catalog"""
+    projection_expression, expression_attribute_names = get_listing_projection(fields)
+    dynamodb_args = {
+        'KeyConditionExpression': 'apple_catalog = :apple_catalog',
+        'ExpressionAttributeValues': {
+            ':apple_catalog': apple_catalog
+        },
+        'ProjectionExpression': 'apple_catalog, product_key'
+    }
+    if cursor:
+        dynamodb_args['ExclusiveStartKey'] = dict(decode_cursor(cursor), apple_catalog=apple_catalog)
+    paginated = limit is not None
+
+    product_keys = []
+    while True:
+        if paginated:
+            dynamodb_args['Limit'] = limit - len(product_keys)
+        request = boto3.resource('dynamodb').Table(apple_catalog_products_table).query(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            product_keys.append(dynamodb_item['product_key'])
+        last_evaluated_key = request.get('LastEvaluatedKey')
+        if not last_evaluated_key or (paginated and len(product_keys) >= limit):
+            break
+        dynamodb_args['ExclusiveStartKey'] = last_evaluated_key
+
+    product_info = get_product_info_items(
+        product_keys,
+        product_info_table,
+        projection_expression,
+        expression_attribute_names,
+        consistent
+    )
+    product_info = [format_product_item(dynamodb_item) for dynamodb_item in product_info]
+    product_info.sort(key=lambda dynamodb_item: dynamodb_item['product_key'])
+    return generate_listing_response(product_info, last_evaluated_key, paginated)
+
+
+def search_products(search_args, product_search_table, limit, cursor=None):
+    """Return a page of products matching a search, newest first.
+
+    search_args may hold q (words or word prefixes in the title, or words
+    in the description), version, since and until (PostDate range) and
+    deprecated. One search index partition is paged through; the others
+    narrow its results.
+    """
+    index_keys = []
+    if search_args.get('deprecated'):
+        index_keys.append('deprecated')
+    # Longer tokens are usually rarer, so page through those first
+    for token in sorted(anejocommon.get_search_tokens(search_args.get('q')), key=len, reverse=True):
+        index_keys.append('token#' + token)
+    if search_args.get('version'):
+        index_keys.append('version#' + search_args['version'].lower())
+    if not index_keys:
+        index_keys.append('postdate')
+
+    since = search_args.get('since')
+    until = search_args.get('until')
+    dynamodb_args = {
+        'KeyConditionExpression': anejocommon.get_search_key_condition(index_keys[0], since, until),
+        'ScanIndexForward': False
+    }
+    if cursor:
+        dynamodb_args['ExclusiveStartKey'] = dict(decode_cursor(cursor, 'sort_key'), index_key=index_keys[0])
+    filter_keys = [
+        anejocommon.get_search_index_keys(index_key, product_search_table, since, until)
+        for index_key in index_keys[1:]
+    ]
+
+    product_info = []
+    while True:
+        dynamodb_args['Limit'] = limit - len(product_info)
+        request = boto3.resource('dynamodb').Table(product_search_table).query(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            if all(dynamodb_item['product_key'] in product_keys for product_keys in filter_keys):
+                product_info.append(format_product_item({
+                    metadata_key: dynamodb_item[metadata_key]
+                    for metadata_key in ['product_key', 'title', 'version', 'PostDate']
+                    if metadata_key in dynamodb_item
+                }))
+        last_evaluated_key = request.get('LastEvaluatedKey')
+        if not last_evaluated_key or len(product_info) >= limit:
+            break
+        dynamodb_args['ExclusiveStartKey'] = last_evaluated_key
+    return generate_listing_response(product_info, last_evaluated_key, True)
+
+
+def get_listed_products(s3_bucket, product_info_table, if_none_match=None):
+    """Return the product listing snapshot, falling back to a table scan
+
+    Its validator is the snapshot's recorded SHA-256, so a matching
+    If-None-Match is answered without reading the snapshot.
+    """
+    listing_sha256 = anejocommon.get_product_listing_sha256(s3_bucket)
+    if listing_sha256 is None:
+        return get_all_products(product_info_table)
+    validator = anejocommon.get_api_validator('product-listing', listing_sha256)
+    if anejocommon.validator_matches(validator, if_none_match or []):
+        return anejocommon.generate_validated_api_response(304, '', validator)
+
+    product_listing = anejocommon.read_product_listing(s3_bucket)
+    if product_listing is None:
+        return get_all_products(product_info_table)
+    return anejocommon.generate_validated_api_response(200, product_listing, validator)
+
+
+def get_all_products(product_info_table, limit=100, cursor=None, fields=None, consistent=False):
+    """Return one page of up to limit products and the cursor of the next page.
+
+    The full listing is served from the product listing snapshot instead
+    (see get_listed_products).
+    """
+    projection_expression, expression_attribute_names = get_listing_projection(fields)
     dynamodb_args = {
         'Select': 'SPECIFIC_ATTRIBUTES',
-        'ProjectionExpression': 'product_key, title, version, PostDate',
-        'ConsistentRead': True
+        'ProjectionExpression': projection_expression,
+        'ExpressionAttributeNames': expression_attribute_names,
+        'ConsistentRead': consistent
     }
+    if cursor:
+        dynamodb_args['ExclusiveStartKey'] = decode_cursor(cursor)
+
     product_info = []
     while True:
+        dynamodb_args['Limit'] = limit - len(product_info)
         request = boto3.resource('dynamodb').Table(product_info_table).scan(**dynamodb_args)
         for dynamodb_item in request['Items']:
-            dynamodb_item['PostDate'] = dynamodb_item['PostDate'].split(' ')[0]
-            product_info.append(dynamodb_item)
-        try:
-            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
-        except KeyError:
+            product_info.append(format_product_item(dynamodb_item))
+        last_evaluated_key = request.get('LastEvaluatedKey')
+        if not last_evaluated_key or len(product_info) >= limit:
             break
-    return anejocommon.generate_api_response(200, product_info)
+        dynamodb_args['ExclusiveStartKey'] = last_evaluated_key
+    return generate_listing_response(product_info, last_evaluated_key, True)
 
 
 def get_product_info(product_key, product_info_table):
@@ -85,6 +368,8 @@ def get_product_info(product_key, product_info_table):
         product_info['CatalogEntry'] = anejocommon.uncompress_dict(product_info['CatalogEntry'])
         product_info['AppleCatalogs'] = list(product_info['AppleCatalogs'])
         product_info['OriginalAppleCatalogs'] = list(product_info['OriginalAppleCatalogs'])
+        product_info.pop('search_signature', None)
+        product_info.pop('search_index', None)
         response_code = 200
     except KeyError:
         product_info = 'Product not found'
@@ -102,14 +387,64 @@ def get_product_info(product_key, product_info_table):
 
 
 
-def purge_product(product_key, product_info_table, s3_bucket):
-    """Purge product from Anejo"""
+def get_product_catalogs(product_key, catalog_members_table):
+    """Return the branch catalogs containing a product"""
+    catalog_branches = anejocommon.get_product_catalog_branches(product_key, catalog_members_table)
+    return anejocommon.generate_api_response(200, sorted(catalog_branches))
+
+
+def remove_product_from_branches(product_key, catalog_branches, catalog_members_table, catalog_branches_table, write_catalog_queue_url, rebuild_delay, catalog_changes_table=None):
+    """Remove a product from branch catalogs and queue their rebuilds"""
+    for catalog_branch in catalog_branches:
+        written_keys, write_error = anejocommon.write_branch_members(
+            catalog_branch,
+            [product_key],
+            'Delete',
+            catalog_branches_table,
+            catalog_members_table,
+            catalog_changes_table
+        )
+        if write_error and written_keys is not None:
+            print("ERROR: Cannot remove product from branch " + catalog_branch + ": " + write_error)
+    if write_catalog_queue_url:
+        for catalog_branch in catalog_branches:
+            try:
+                anejocommon.request_branch_rebuild(
+                    catalog_branch,
+                    catalog_branches_table,
+                    write_catalog_queue_url,
+                    rebuild_delay
+                )
+            except ClientError as e:
+                print("ERROR: Cannot queue rebuild of branch " + catalog_branch + ": " + str(e))
+    return catalog_branches
+
+
+def purge_product(product_key, product_info_table, s3_bucket, catalog_members_table=None, catalog_branches_table=None, write_catalog_queue_url=None, rebuild_delay=30, force=False, product_search_table=None, catalog_changes_table=None):
+    """Purge product from Anejo.
+
+    Refuses to purge a product still in branch catalogs unless forced, in
+    which case it is also removed from those branch catalogs. Branch
+    membership is checked with consistent reads, so a product added to a
+    branch just before is not purged.
+    """
     response = {
             'product_key': product_key,
             'product_info': None,
             'deleted_objects': None
         }
 
+    catalog_branches = []
+    if catalog_members_table:
+        catalog_branches = anejocommon.get_product_catalog_branches(
+            product_key,
+            catalog_members_table,
+            catalog_branches_table
+        )
+        response['catalog_branches'] = sorted(catalog_branches)
+        if catalog_branches and not force:
+            return anejocommon.generate_api_response(409, response)
+
     # Get product info, return if product not found
     dynamodb_args = {
         'Key': {
@@ -123,6 +458,8 @@ def purge_product(product_key, product_info_table, s3_bucket):
         product_info['CatalogEntry'] = anejocommon.uncompress_dict(product_info['CatalogEntry'])
         product_info['AppleCatalogs'] = list(product_info['AppleCatalogs'])
         product_info['OriginalAppleCatalogs'] = list(product_info['OriginalAppleCatalogs'])
+        product_info.pop('search_signature', None)
+        search_index = product_info.pop('search_index', [])
     except KeyError:
         return anejocommon.generate_api_response(200, response)
 
@@ -189,22 +526,55 @@ def purge_product(product_key, product_info_table, s3_bucket):
         product = boto3.resource('dynamodb').Table(product_info_table).delete_item(**dynamodb_args)
     except ClientError as e:
         return anejocommon.generate_api_response(500, str(e))
+
+    if product_search_table:
+        try:
+            anejocommon.delete_product_search_entries(search_index, product_search_table)
+        except ClientError as e:
+            print("ERROR: Cannot delete search index entries: " + str(e))
+
+    if write_catalog_queue_url:
+        try:
+            anejocommon.request_product_listing_update(write_catalog_queue_url)
+        except ClientError as e:
+            print("ERROR: Cannot queue product listing update: " + str(e))
+
+    if catalog_branches:
+        remove_product_from_branches(
+            product_key,
+            catalog_branches,
+            catalog_members_table,
+            catalog_branches_table,
+            write_catalog_queue_url,
+            rebuild_delay,
+            catalog_changes_table
+        )
     return anejocommon.generate_api_response(200, response)
 
 
 
 ### HANDLER FUNCTION ###
 
+@anejocommon.api_handler
 def lambda_handler(event, context):
     """Handler function for AWS Lambda."""
     # Environmental Variables
     CATALOG_BRANCHES_TABLE = anejocommon.set_env_var('CATALOG_BRANCHES_TABLE')
+    CATALOG_MEMBERS_TABLE = anejocommon.set_env_var('CATALOG_MEMBERS_TABLE')
+    CATALOG_CHANGES_TABLE = anejocommon.set_env_var('CATALOG_CHANGES_TABLE')
+    APPLE_CATALOG_PRODUCTS_TABLE = anejocommon.set_env_var('APPLE_CATALOG_PRODUCTS_TABLE')
+    PRODUCT_SEARCH_TABLE = anejocommon.set_env_var('PRODUCT_SEARCH_TABLE')
     PRODUCT_INFO_TABLE = anejocommon.set_env_var('PRODUCT_INFO_TABLE')
     S3_BUCKET = anejocommon.set_env_var('S3_BUCKET')
+    WRITE_CATALOG_QUEUE_URL = anejocommon.set_env_var('WRITE_CATALOG_QUEUE_URL')
+    BRANCH_REBUILD_DELAY = anejocommon.set_env_var('BRANCH_REBUILD_DELAY', 30)
+    MAX_LISTING_LIMIT = int(anejocommon.set_env_var('MAX_LISTING_LIMIT', 1000))
+    DEFAULT_LISTING_LIMIT = int(anejocommon.set_env_var('DEFAULT_LISTING_LIMIT', 100))
+    MAX_BATCH_KEYS = int(anejocommon.set_env_var('MAX_BATCH_KEYS', 500))
 
     # Event Variables
     try:
-        event_body = event['body']
+        event_body = event['body-json']
     except KeyError:
         event_body = event
 
@@ -221,9 +591,65 @@ def lambda_handler(event, context):
     except KeyError:
         product_key = None
 
+    try:
+        querystring = event['params']['querystring']
+    except KeyError:
+        querystring = {}
+    apple_catalog = querystring.get('catalog')
+    force = querystring.get('force', '').lower() == 'true'
+
     # /products (GET)
     if (resource_path == '/products' and http_method == 'GET'):
-        return get_all_products(PRODUCT_INFO_TABLE)
+        listing_args = {
+            'cursor': querystring.get('cursor') or None,
+            'fields': [field.strip() for field in querystring.get('fields', '').split(',') if field.strip()],
+            'consistent': querystring.get('consistent', '').lower() == 'true'
+        }
+        search_args = {
+            'q': querystring.get('q'),
+            'version': querystring.get('version'),
+            'since': querystring.get('since'),
+            'until': querystring.get('until'),
+            'deprecated': querystring.get('deprecated', '').lower() == 'true'
+        }
+        try:
+            if querystring.get('limit') or listing_args['cursor']:
+                listing_args['limit'] = min(max(int(querystring.get('limit') or MAX_LISTING_LIMIT), 1), MAX_LISTING_LIMIT)
+
+            if any(search_args.values()):
+                # Filters are not ignored without a search index to apply them
+                if not PRODUCT_SEARCH_TABLE:
+                    return anejocommon.generate_api_response(501, 'Product search is not configured')
+                return search_products(
+                    search_args,
+                    PRODUCT_SEARCH_TABLE,
+                    listing_args.get('limit', MAX_LISTING_LIMIT),
+                    listing_args['cursor']
+                )
+
+            if querystring.get('snapshot', '').lower() == 'true':
+                return get_listed_products(
+                    S3_BUCKET,
+                    PRODUCT_INFO_TABLE,
+                    anejocommon.get_request_validators(event)
+                )
+
+            if apple_catalog and APPLE_CATALOG_PRODUCTS_TABLE:
+                return get_catalog_products(
+                    apple_catalog,
+                    PRODUCT_INFO_TABLE,
+                    APPLE_CATALOG_PRODUCTS_TABLE,
+                    **listing_args
+                )
+            # Listing every product is paginated; the full listing is the snapshot
+            listing_args.setdefault('limit', min(DEFAULT_LISTING_LIMIT, MAX_LISTING_LIMIT))
+            return get_all_products(PRODUCT_INFO_TABLE, **listing_args)
+        except ValueError as e:
+            return anejocommon.generate_api_response(400, str(e))
+
+    # /products/batch (POST)
+    if (resource_path == '/products/batch' and http_method == 'POST'):
+        return get_batch_products(event_body, PRODUCT_INFO_TABLE, MAX_BATCH_KEYS)
 
     # /products/{product}
     if (resource_path == '/products/{product}' and product_key):
@@ -234,7 +660,24 @@ def lambda_handler(event, context):
 
         # DELETE
         if http_method == 'DELETE':
-            return purge_product(product_key, PRODUCT_INFO_TABLE, S3_BUCKET)
+            return purge_product(
+                product_key,
+                PRODUCT_INFO_TABLE,
+                S3_BUCKET,
+                CATALOG_MEMBERS_TABLE,
+                CATALOG_BRANCHES_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                BRANCH_REBUILD_DELAY,
+                force,
+                PRODUCT_SEARCH_TABLE,
+                CATALOG_CHANGES_TABLE
+            )
+
+    # /products/{product}/catalogs (GET)
+    if (resource_path == '/products/{product}/catalogs' and product_key and http_method == 'GET'):
+        return get_product_catalogs(product_key, CATALOG_MEMBERS_TABLE)
+
+    return anejocommon.generate_api_response(404, "Error: No matching API method found")
 
 
 if __name__ == "__main__":
@@ -49,12 +49,30 @@ import anejocommon
 
 
 
+### Functions ###
+
+def get_download_lane_stats(download_lanes):
+    """Return queue depth and oldest message age for each download lane."""
+    lane_stats = {}
+    for download_lane, queue_url in download_lanes.items():
+        try:
+            lane_stats[download_lane] = anejocommon.get_queue_stats(queue_url)
+        except ClientError as e:
+            print("Error getting stats for " + download_lane + " lane: " + str(e))
+            return anejocommon.generate_api_response(500, str(e))
+    return anejocommon.generate_api_response(200, {'download_lanes': lane_stats})
+
+
+
 ### HANDLER FUNCTION ###
 
+@anejocommon.api_handler
 def lambda_handler(event, context):
     """Handler function for AWS Lambda."""
     # Environmental Variables
     REPO_SYNC_FUNCTION = anejocommon.set_env_var('REPO_SYNC_FUNCTION')
+    PRODUCT_DOWNLOAD_QUEUE_URL = anejocommon.set_env_var('PRODUCT_DOWNLOAD_QUEUE_URL')
+    PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL = anejocommon.set_env_var('PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL')
 
     # Event Variables
     try:
@@ -62,6 +80,22 @@ def lambda_handler(event, context):
     except KeyError:
         event_body = event
 
+    try:
+        event_context = event['context']
+    except KeyError:
+        event_context = {}
+    finally:
+        http_method = event_context.get('http-method', '')
+
+    # /sync (GET)
+    if http_method == 'GET':
+        return get_download_lane_stats(
+            {
+                'priority': PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL,
+                'standard': PRODUCT_DOWNLOAD_QUEUE_URL
+            }
+        )
+
     repo_sync_parameters = {}
     try:
         repo_sync_parameters['download_packages'] = event_body['download_packages']
@@ -73,6 +107,21 @@ def lambda_handler(event, context):
     except KeyError:
         pass
 
+    try:
+        repo_sync_parameters['verify_scan'] = event_body['verify_scan']
+    except KeyError:
+        pass
+
+    try:
+        repo_sync_parameters['two_phase_sync'] = event_body['two_phase_sync']
+    except KeyError:
+        pass
+
+    try:
+        repo_sync_parameters['lazy_packages'] = event_body['lazy_packages']
+    except KeyError:
+        pass
+
     try:
         lambda_call = boto3.client('lambda').invoke(
             FunctionName=REPO_SYNC_FUNCTION,
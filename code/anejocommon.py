@@ -40,14 +40,24 @@ Created: 01/06/19
 """
 
 import base64
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import decimal
+import functools
+import gzip
+import hashlib
 import json
 import os
 import plistlib
+import re
+import time
 import urllib3
 from urllib.parse import urlparse
+from xml.etree import ElementTree
 import zlib
 
 import boto3
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 
 
@@ -56,10 +66,108 @@ class ProvisionedThroughputExceededError(Exception):
     pass
 
 
+class IntegrityError(Exception):
+    """Exception for replicated files failing size or digest verification"""
+    pass
+
+
+class MigrationError(Exception):
+    """Exception for catalog branches not yet migrated to the members table"""
+    pass
+
+
+class HashingReader(object):
+    """File-like object that hashes and counts bytes as they are read.
+
+    Verifies the expected size and digest (SHA-1 or SHA-256, as found in Apple
+    catalogs) once the underlying stream is exhausted, raising IntegrityError
+    on mismatch so that the upload reading from it fails.
+    """
+
+    def __init__(self, fileobj, expected_size=None, expected_digest=None):
+        self.fileobj = fileobj
+        self.expected_size = expected_size
+        self.expected_digest = expected_digest.lower() if expected_digest else None
+        self.sha1 = hashlib.sha1()
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def read(self, amt=None):
+        data = self.fileobj.read(amt)
+        if data:
+            self.sha1.update(data)
+            self.sha256.update(data)
+            self.size += len(data)
+        if not data or amt is None:
+            self.verify()
+        return data
+
+    def verify(self):
+        if self.expected_size is not None and self.size != int(self.expected_size):
+            raise IntegrityError(
+                "Size mismatch: expected " + str(self.expected_size) + " bytes, got " + str(self.size)
+            )
+        if self.expected_digest:
+            if len(self.expected_digest) == 64:
+                digest = self.sha256.hexdigest()
+            else:
+                digest = self.sha1.hexdigest()
+            if digest != self.expected_digest:
+                raise IntegrityError(
+                    "Digest mismatch: expected " + self.expected_digest + ", got " + digest
+                )
+
+    def digests(self):
+        return {
+            'Size': self.size,
+            'sha1': self.sha1.hexdigest(),
+            'sha256': self.sha256.hexdigest()
+        }
+
+
+class CatalogCacheWriter(object):
+    """Writes a parsed catalog cache to a file one product at a time.
+
+    Products are serialized and compressed as they are added, so memory is
+    bounded by the largest product. The catalog header and SHA-256, only
+    known once the whole catalog is parsed, are written by close().
+    """
+
+    def __init__(self, cache_file):
+        self.cache_file = cache_file
+        self.compressor = zlib.compressobj()
+        self.product_count = 0
+        self.write('{"Products":{')
+
+    def write(self, text):
+        self.cache_file.write(self.compressor.compress(text.encode('utf-8')))
+
+    def add(self, product_key, product):
+        if self.product_count:
+            self.write(',')
+        self.write(json.dumps(product_key) + ':' + dump_catalog_product(product))
+        self.product_count += 1
+
+    def close(self, catalog_header, catalog_sha256):
+        self.write(
+            '},"IndexDate":' + dump_catalog_product(catalog_header.get('IndexDate')) +
+            ',"sha256":' + json.dumps(catalog_sha256) +
+            ',"header":' + dump_catalog_product(catalog_header) +
+            '}'
+        )
+        self.cache_file.write(self.compressor.flush())
+
+
 # Disable urllib3 warnings
 urllib3.disable_warnings()
 
 
+# Lambda /tmp cache (kept by warm containers between invocations)
+TMP_CACHE_DIR = '/tmp/anejo-cache'
+TMP_CACHE_MAX_BYTES = int(os.environ.get('TMP_CACHE_MAX_BYTES', 268435456))
+tmp_cache_stats = {'hits': 0, 'misses': 0}
+
+
 ###################
 #### Functions ####
 ###################
@@ -77,6 +185,171 @@ def generate_api_response(response_code, body):
     }
 
 
+def encode_api_json(value):
+    """JSON encoder default for API response bodies (DynamoDB and plist types)."""
+    if isinstance(value, decimal.Decimal):
+        return int(value) if value % 1 == 0 else float(value)
+    if isinstance(value, (set, frozenset)):
+        return sorted(value)
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('utf-8')
+    return str(value)
+
+
+def normalize_api_event(event):
+    """Convert an API Gateway proxy integration event to the format of the
+    non-proxy request template (body-json, params, context).
+
+    Other events are returned unchanged.
+    """
+    if 'httpMethod' not in event:
+        return event
+    event_body = event.get('body') or {}
+    if event.get('isBase64Encoded') and event_body:
+        event_body = base64.b64decode(event_body).decode('utf-8')
+    try:
+        event_body = json.loads(event_body)
+    except (TypeError, ValueError):
+        pass
+    return {
+        'body-json': event_body,
+        'params': {
+            'path': event.get('pathParameters') or {},
+            'querystring': event.get('queryStringParameters') or {},
+            'header': event.get('headers') or {}
+        },
+        'context': {
+            'http-method': event['httpMethod'],
+            'resource-path': event.get('resource', '')
+        },
+        'proxy': True
+    }
+
+
+def get_api_validator(*validator_parts):
+    """Return a strong ETag derived from the given values."""
+    validator_body = json.dumps(validator_parts, default=encode_api_json, sort_keys=True)
+    return '"' + hashlib.sha256(validator_body.encode('utf-8')).hexdigest() + '"'
+
+
+def get_request_validators(api_event):
+    """Return the entity tags of a request's If-None-Match header."""
+    try:
+        request_headers = {
+            header.lower(): value
+            for header, value in (api_event['params']['header'] or {}).items()
+        }
+    except (KeyError, TypeError):
+        return []
+    return [
+        validator.strip()
+        for validator in request_headers.get('if-none-match', '').split(',')
+        if validator.strip()
+    ]
+
+
+def validator_matches(validator, request_validators):
+    """Check if a validator matches any of a request's If-None-Match entity tags."""
+    return validator in request_validators or '*' in request_validators
+
+
+def generate_validated_api_response(response_code, body, validator):
+    """Return an API response carrying an ETag validator.
+
+    Handlers that can derive a validator cheaply (e.g. from a version
+    number) check it before reading the response body, and answer a
+    matching If-None-Match with a 304 response.
+    """
+    api_response = generate_api_response(response_code, body)
+    api_response['headers']['ETag'] = validator
+    return api_response
+
+
+def generate_proxy_response(api_event, api_response, max_age=30):
+    """Return an API response in the proxy integration format.
+
+    The body is the API response itself, as returned by non-proxy
+    integrations (with HTTP status 200). Successful GET responses get a
+    strong ETag (the handler's validator, or a hash of the body) and a
+    Cache-Control header; a matching If-None-Match is answered with an
+    empty 304.
+    """
+    headers = {'Content-Type': 'application/json'}
+    validator = (api_response.get('headers') or {}).get('ETag')
+    cache_control = 'max-age=' + str(max_age) + ', must-revalidate'
+
+    if api_response['statusCode'] == 304:
+        return {
+            "isBase64Encoded": False,
+            "statusCode": 304,
+            "headers": {
+                'ETag': validator,
+                'Cache-Control': cache_control
+            },
+            "body": ''
+        }
+
+    body = json.dumps(api_response, default=encode_api_json, sort_keys=True)
+    if api_event['context']['http-method'] == 'GET' and api_response['statusCode'] == 200:
+        if not validator:
+            validator = '"' + hashlib.sha256(body.encode('utf-8')).hexdigest() + '"'
+        headers['ETag'] = validator
+        headers['Cache-Control'] = cache_control
+        if validator_matches(validator, get_request_validators(api_event)):
+            return {
+                "isBase64Encoded": False,
+                "statusCode": 304,
+                "headers": {
+                    'ETag': validator,
+                    'Cache-Control': cache_control
+                },
+                "body": ''
+            }
+
+    return {
+        "isBase64Encoded": False,
+        "statusCode": 200,
+        "headers": headers,
+        "body": body
+    }
+
+
+def api_handler(lambda_handler):
+    """Decorator letting an API Lambda handler serve proxy integrations.
+
+    The handler always sees the request template's event format; responses
+    to proxy requests are encoded by generate_proxy_response. Requests the
+    handler has no route for are answered with a 404, and errors with a 500
+    like the non-proxy integrations' error response.
+    """
+    @functools.wraps(lambda_handler)
+    def api_lambda_handler(event, context):
+        api_event = normalize_api_event(event)
+        if not api_event.get('proxy'):
+            return lambda_handler(api_event, context)
+        try:
+            api_response = lambda_handler(api_event, context)
+            if api_response is None:
+                api_response = generate_api_response(404, "Error: No matching API method found")
+            return generate_proxy_response(
+                api_event,
+                api_response,
+                int(set_env_var('API_CACHE_MAX_AGE', 30))
+            )
+        except Exception as e:
+            print("ERROR: " + repr(e))
+            return {
+                "isBase64Encoded": False,
+                "statusCode": 500,
+                "headers": {'Content-Type': 'application/json'},
+                "body": json.dumps({
+                    'errorMessage': str(e),
+                    'errorType': type(e).__name__
+                })
+            }
+    return api_lambda_handler
+
+
 ### AWS Utility Functions ###
 
 def set_env_var(name, default=''):
@@ -90,8 +363,14 @@ def set_env_var(name, default=''):
     return env_var
 
 
-def s3_file_exists(file_path, bucket_name):
-    """Check if file path exists in an S3 bucket."""
+def s3_file_exists(file_path, bucket_name, s3_key_index=None):
+    """Check if file path exists in an S3 bucket.
+
+    If an S3 key index covering the file path is given, it is used instead of
+    a HEAD request.
+    """
+    if s3_key_index is not None:
+        return file_path in s3_key_index
     try:
         boto3.client('s3').head_object(Bucket=bucket_name, Key=file_path)
     except ClientError:
@@ -100,9 +379,62 @@ def s3_file_exists(file_path, bucket_name):
     return True
 
 
-def write_plist_s3(plist, s3_file_path, s3_bucket):
+def list_s3_prefix(s3_bucket, prefix, s3_client=None):
+    """Return a dictionary of keys (with size and ETag) under a prefix in an S3 bucket."""
+    if s3_client is None:
+        s3_client = boto3.client('s3')
+    s3_args = {
+        'Bucket': s3_bucket,
+        'Prefix': prefix
+    }
+    s3_keys = {}
+    while True:
+        request = s3_client.list_objects_v2(**s3_args)
+        for s3_obj in request.get('Contents', []):
+            s3_keys[s3_obj['Key']] = {
+                'Size': s3_obj['Size'],
+                'ETag': s3_obj['ETag']
+            }
+        # Continue if response is truncated
+        try:
+            s3_args['ContinuationToken'] = request['NextContinuationToken']
+        except KeyError:
+            break
+    return s3_keys
+
+
+def build_s3_key_index(s3_bucket, prefixes, max_workers=8):
+    """Build an index of the keys under the given prefixes in an S3 bucket.
+
+    Each prefix is listed once (prefixes nested in another are skipped), with
+    the prefixes listed in parallel.
+    """
+    unique_prefixes = []
+    for prefix in sorted(set(prefixes)):
+        if unique_prefixes and prefix.startswith(unique_prefixes[-1]):
+            continue
+        unique_prefixes.append(prefix)
+
+    s3_key_index = {}
+    if not unique_prefixes:
+        return s3_key_index
+
+    # Clients (unlike sessions) are safe to share between threads
+    s3_client = boto3.client('s3')
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(unique_prefixes))) as executor:
+        for s3_keys in executor.map(
+            lambda prefix: list_s3_prefix(s3_bucket, prefix, s3_client),
+            unique_prefixes
+        ):
+            s3_key_index.update(s3_keys)
+    return s3_key_index
+
+
+def write_plist_s3(plist, s3_file_path, s3_bucket, s3_client=None):
     """Write a plist to an S3 bucket."""
-    boto3.client('s3').put_object(
+    if s3_client is None:
+        s3_client = boto3.client('s3')
+    s3_client.put_object(
         Body=plistlib.dumps(plist),
         Bucket=s3_bucket,
         Key=s3_file_path
@@ -113,12 +445,7 @@ def write_plist_s3(plist, s3_file_path, s3_bucket):
 def read_plist_s3(s3_file_path, s3_bucket):
     """Read a plist from an S3 bucket."""
     try:
-        return plistlib.loads(
-            boto3.client('s3').get_object(
-                Bucket=s3_bucket,
-                Key=s3_file_path
-            )['Body'].read()
-        )
+        return plistlib.loads(read_s3_cached(s3_file_path, s3_bucket))
     except boto3.client('s3').exceptions.NoSuchKey:
         print("WARNING: '" + os.path.join(s3_bucket, s3_file_path) + "' does not exist (NoSuchKey)")
         return {}
@@ -133,6 +460,191 @@ def send_to_queue(queue_message, queue_url, delay=0):
     )
 
 
+def send_to_queue_batch(queue_messages, queue_url):
+    """Send up to 10 messages to an SQS queue in one request.
+
+    Messages the batch request fails to send are sent one at a time.
+    """
+    entries = [
+        {
+            'Id': str(i),
+            'MessageBody': json.dumps(queue_message, default=str)
+        }
+        for i, queue_message in enumerate(queue_messages)
+    ]
+    if not entries:
+        return
+    response = boto3.client('sqs').send_message_batch(
+        QueueUrl=queue_url,
+        Entries=entries
+    )
+    for failed_entry in response.get('Failed', []):
+        send_to_queue(queue_messages[int(failed_entry['Id'])], queue_url)
+
+
+def get_queue_stats(queue_url):
+    """Return the depth and age of the oldest message of an SQS queue."""
+    attributes = boto3.client('sqs').get_queue_attributes(
+        QueueUrl=queue_url,
+        AttributeNames=[
+            'ApproximateNumberOfMessages',
+            'ApproximateNumberOfMessagesNotVisible',
+            'ApproximateNumberOfMessagesDelayed'
+        ]
+    )['Attributes']
+    queue_stats = {
+        'queued': int(attributes.get('ApproximateNumberOfMessages', 0)),
+        'in_flight': int(attributes.get('ApproximateNumberOfMessagesNotVisible', 0)),
+        'delayed': int(attributes.get('ApproximateNumberOfMessagesDelayed', 0)),
+        'oldest_message_age': None
+    }
+
+    # SQS only reports message age through CloudWatch
+    end_time = datetime.datetime.utcnow()
+    datapoints = boto3.client('cloudwatch').get_metric_statistics(
+        Namespace='AWS/SQS',
+        MetricName='ApproximateAgeOfOldestMessage',
+        Dimensions=[
+            {
+                'Name': 'QueueName',
+                'Value': queue_url.rstrip('/').split('/')[-1]
+            }
+        ],
+        StartTime=end_time - datetime.timedelta(minutes=10),
+        EndTime=end_time,
+        Period=60,
+        Statistics=['Maximum']
+    )['Datapoints']
+    if datapoints:
+        latest = max(datapoints, key=lambda datapoint: datapoint['Timestamp'])
+        queue_stats['oldest_message_age'] = int(latest['Maximum'])
+    return queue_stats
+
+
+
+### Lambda /tmp Cache ###
+
+def get_tmp_cache_path(cache_key, cache_dir=TMP_CACHE_DIR):
+    """Return the /tmp cache file path for a cache key."""
+    return os.path.join(cache_dir, hashlib.sha256(cache_key.encode('utf-8')).hexdigest())
+
+
+def tmp_cache_get(cache_key, cache_dir=TMP_CACHE_DIR):
+    """Return the cached bytes and validators of a cache key.
+
+    Returns (None, {}) if the key is not cached.
+    """
+    cache_path = get_tmp_cache_path(cache_key, cache_dir)
+    try:
+        with open(cache_path + '.validators') as validators_file:
+            validators = json.load(validators_file)
+        with open(cache_path, 'rb') as cache_file:
+            data = cache_file.read()
+        # Mark as recently used
+        os.utime(cache_path)
+    except (OSError, ValueError):
+        return None, {}
+    return data, validators
+
+
+def tmp_cache_put(cache_key, data, validators=None, cache_dir=TMP_CACHE_DIR, max_bytes=TMP_CACHE_MAX_BYTES):
+    """Cache bytes (and their validators) in /tmp, evicting least recently used entries."""
+    if len(data) > max_bytes:
+        return
+    cache_path = get_tmp_cache_path(cache_key, cache_dir)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path + '.tmp', 'wb') as cache_file:
+            cache_file.write(data)
+        with open(cache_path + '.validators', 'w') as validators_file:
+            json.dump(validators or {}, validators_file)
+        os.replace(cache_path + '.tmp', cache_path)
+    except OSError as e:
+        print("WARNING: Cannot write to /tmp cache: " + str(e))
+        return
+    evict_tmp_cache(cache_dir, max_bytes)
+
+
+def evict_tmp_cache(cache_dir=TMP_CACHE_DIR, max_bytes=TMP_CACHE_MAX_BYTES):
+    """Remove least recently used /tmp cache entries until under max_bytes."""
+    cache_entries = []
+    for file_name in os.listdir(cache_dir):
+        if '.' in file_name:
+            continue
+        cache_path = os.path.join(cache_dir, file_name)
+        try:
+            cache_entries.append((os.path.getmtime(cache_path), os.path.getsize(cache_path), cache_path))
+        except OSError:
+            continue
+
+    cache_size = sum([cache_entry[1] for cache_entry in cache_entries])
+    for last_used, size, cache_path in sorted(cache_entries):
+        if cache_size <= max_bytes:
+            break
+        for path in [cache_path, cache_path + '.validators']:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        cache_size -= size
+
+
+def get_tmp_cache_stats():
+    """Return the /tmp cache hits, misses, and hit ratio of this container."""
+    lookups = tmp_cache_stats['hits'] + tmp_cache_stats['misses']
+    return {
+        'hits': tmp_cache_stats['hits'],
+        'misses': tmp_cache_stats['misses'],
+        'hit_ratio': float(tmp_cache_stats['hits']) / lookups if lookups else 0.0
+    }
+
+
+def read_s3_cached(s3_file_path, s3_bucket):
+    """Read a file from S3, revalidating a /tmp cached copy by ETag."""
+    cache_key = 's3://' + os.path.join(s3_bucket, s3_file_path)
+    data, validators = tmp_cache_get(cache_key)
+    request_args = {}
+    if data is not None and 'ETag' in validators:
+        request_args['IfNoneMatch'] = validators['ETag']
+
+    try:
+        response = boto3.client('s3').get_object(
+            Bucket=s3_bucket,
+            Key=s3_file_path,
+            **request_args
+        )
+    except ClientError as e:
+        if data is not None and e.response['Error']['Code'] in ['304', 'NotModified']:
+            tmp_cache_stats['hits'] += 1
+            return data
+        raise
+
+    tmp_cache_stats['misses'] += 1
+    data = response['Body'].read()
+    tmp_cache_put(cache_key, data, {'ETag': response['ETag']})
+    return data
+
+
+def retrieve_url_cached(url):
+    """Retrieve URL as bytes, revalidating a /tmp cached copy with conditional GET."""
+    data, validators = tmp_cache_get(url)
+    headers = None
+    if data is not None:
+        headers = get_conditional_headers(validators)
+
+    response = retrieve_url(url, headers)
+    if data is not None and response.status == 304:
+        response.release_conn()
+        tmp_cache_stats['hits'] += 1
+        return data
+
+    tmp_cache_stats['misses'] += 1
+    data = response.data
+    if response.status == 200:
+        tmp_cache_put(url, data, get_upstream_validators(response))
+    return data
+
+
 
 ### Metadata Functions ###
 
@@ -146,7 +658,7 @@ def get_download_status(s3_bucket, download_status_path='metadata/DownloadStatus
     while True:
         request = boto3.client('s3').list_objects_v2(**s3_args)
         # Add the base name (key) to list
-        for s3_obj in request['Contents']:
+        for s3_obj in request.get('Contents', []):
             key = os.path.basename(s3_obj['Key'])
             if key:
                 download_status.append(key)
@@ -158,8 +670,359 @@ def get_download_status(s3_bucket, download_status_path='metadata/DownloadStatus
     return download_status
 
 
-def get_catalog_branches(catalog_branches_table, names_only=False):
-    """Get list of catalog branches from DynamoDB metadata table."""
+def get_branch_product_keys(catalog_branch, catalog_members_table):
+    """Return the product keys of a branch from the DynamoDB members table."""
+    dynamodb_args = {
+        'KeyConditionExpression': 'catalog_branch = :catalog_branch',
+        'ExpressionAttributeValues': {
+            ':catalog_branch': catalog_branch
+        },
+        'ProjectionExpression': 'product_key',
+        'ConsistentRead': True
+    }
+    product_keys = []
+    while True:
+        request = boto3.resource('dynamodb').Table(catalog_members_table).query(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            product_keys.append(dynamodb_item['product_key'])
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return product_keys
+
+
+def get_product_catalog_branches(product_key, catalog_members_table, catalog_branches_table=None):
+    """Return the branches containing a product from the members table's product_key index.
+
+    The index is eventually consistent. If the branches table is given, each
+    branch's member item is read with a consistent read instead.
+    """
+    if catalog_branches_table:
+        member_keys = [
+            {
+                'catalog_branch': {'S': catalog_branch['catalog_branch']},
+                'product_key': {'S': product_key}
+            }
+            for catalog_branch in get_catalog_branches(catalog_branches_table, names_only=True)
+        ]
+        catalog_branches = []
+        dynamodb_client = boto3.client('dynamodb')
+        for i in range(0, len(member_keys), 100):
+            request_items = {catalog_members_table: {'Keys': member_keys[i:i + 100], 'ConsistentRead': True}}
+            while request_items:
+                request = dynamodb_client.batch_get_item(RequestItems=request_items)
+                for member_item in request['Responses'].get(catalog_members_table, []):
+                    catalog_branches.append(member_item['catalog_branch']['S'])
+                request_items = request.get('UnprocessedKeys')
+        return catalog_branches
+
+    dynamodb_args = {
+        'IndexName': 'product_key-index',
+        'KeyConditionExpression': 'product_key = :product_key',
+        'ExpressionAttributeValues': {
+            ':product_key': product_key
+        },
+        'ProjectionExpression': 'catalog_branch'
+    }
+    catalog_branches = []
+    while True:
+        request = boto3.resource('dynamodb').Table(catalog_members_table).query(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            catalog_branches.append(dynamodb_item['catalog_branch'])
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return catalog_branches
+
+def get_branch_member_count(catalog_branch, catalog_members_table):
+    """Count the members of a branch in the DynamoDB members table."""
+    dynamodb_args = {
+        'KeyConditionExpression': Key('catalog_branch').eq(catalog_branch),
+        'Select': 'COUNT',
+        'ConsistentRead': True
+    }
+    member_count = 0
+    while True:
+        request = boto3.resource('dynamodb').Table(catalog_members_table).query(**dynamodb_args)
+        member_count += request['Count']
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return member_count
+
+
+def get_branch_revision_condition(catalog_branch_item):
+    """Return a condition (and its values) that a branch's membership_revision is unchanged."""
+    if 'membership_revision' not in catalog_branch_item:
+        return 'attribute_exists(catalog_branch) AND attribute_not_exists(membership_revision)', {}
+    revision = int(catalog_branch_item['membership_revision'])
+    return 'membership_revision = :revision', {':revision': {'N': str(revision)}}
+
+
+def has_revision_snapshots(catalog_branch_item):
+    """Check if a branch has snapshots that need its changes recorded."""
+    return any('revision' in snapshot for snapshot in catalog_branch_item.get('snapshots', {}).values())
+
+
+def write_branch_members(catalog_branch, product_keys, member_action, catalog_branches_table, catalog_members_table, catalog_changes_table=None, transaction_size=98, max_attempts=10):
+    """Put or delete branch members in revisioned transactions.
+
+    Each transaction writes the members of a chunk that actually change,
+    bumps the branch's membership_revision and member_count, and (if the
+    branch has snapshots) records the change in the changes table for
+    get_branch_member_states. A transaction only commits if the revision
+    is unchanged since the members were read, and is retried otherwise.
+
+    Returns the keys written and an error message (None if all were
+    written). The keys written are None if the branch does not exist.
+    Branches not yet migrated to the members table are not written.
+    """
+    dynamodb_client = boto3.client('dynamodb')
+    catalog_branches = boto3.resource('dynamodb').Table(catalog_branches_table)
+    written_keys = []
+    product_keys = list(product_keys)
+    attempts = 0
+    i = 0
+    while i < len(product_keys):
+        transaction_keys = product_keys[i:i + transaction_size]
+        catalog_branch_item = catalog_branches.get_item(
+            Key={
+                'catalog_branch': catalog_branch
+            },
+            ConsistentRead=True
+        ).get('Item')
+        if not catalog_branch_item:
+            if not written_keys:
+                return None, 'Catalog does not exist'
+            return written_keys, 'Catalog does not exist'
+        if not is_branch_migrated(catalog_branch_item):
+            return written_keys, 'Catalog has not been migrated to the members table'
+
+        # Only write the members whose state changes
+        member_keys = [
+            {
+                'catalog_branch': {'S': catalog_branch},
+                'product_key': {'S': product_key}
+            }
+            for product_key in transaction_keys
+        ]
+        current_keys = set()
+        request_items = {catalog_members_table: {'Keys': member_keys, 'ConsistentRead': True}}
+        while request_items:
+            request = dynamodb_client.batch_get_item(RequestItems=request_items)
+            for member_item in request['Responses'].get(catalog_members_table, []):
+                current_keys.add(member_item['product_key']['S'])
+            request_items = request.get('UnprocessedKeys')
+        if member_action == 'Put':
+            changed_keys = [product_key for product_key in transaction_keys if product_key not in current_keys]
+        else:
+            changed_keys = [product_key for product_key in transaction_keys if product_key in current_keys]
+        if not changed_keys:
+            i += transaction_size
+            continue
+
+        # Count existing members once for branches written before member_count
+        member_count = catalog_branch_item.get('member_count')
+        if member_count is None:
+            member_count = get_branch_member_count(catalog_branch, catalog_members_table)
+        member_delta = len(changed_keys) if member_action == 'Put' else -len(changed_keys)
+
+        revision = int(catalog_branch_item.get('membership_revision', 0)) + 1
+        condition_expression, expression_attribute_values = get_branch_revision_condition(catalog_branch_item)
+        expression_attribute_values[':next_revision'] = {'N': str(revision)}
+        expression_attribute_values[':member_count'] = {'N': str(int(member_count) + member_delta)}
+        transact_items = [
+            {
+                'Update': {
+                    'TableName': catalog_branches_table,
+                    'Key': {
+                        'catalog_branch': {'S': catalog_branch}
+                    },
+                    'UpdateExpression': 'SET membership_revision = :next_revision, member_count = :member_count',
+                    'ConditionExpression': condition_expression,
+                    'ExpressionAttributeValues': expression_attribute_values
+                }
+            }
+        ]
+        if catalog_changes_table and has_revision_snapshots(catalog_branch_item):
+            change_diff_key = 'added' if member_action == 'Put' else 'removed'
+            transact_items.append({
+                'Put': {
+                    'TableName': catalog_changes_table,
+                    'Item': {
+                        'catalog_branch': {'S': catalog_branch},
+                        'revision': {'N': str(revision)},
+                        change_diff_key: {'SS': changed_keys}
+                    }
+                }
+            })
+        for product_key in changed_keys:
+            member_key = {
+                'catalog_branch': {'S': catalog_branch},
+                'product_key': {'S': product_key}
+            }
+            if member_action == 'Put':
+                transact_items.append({'Put': {'TableName': catalog_members_table, 'Item': member_key}})
+            else:
+                transact_items.append({'Delete': {'TableName': catalog_members_table, 'Key': member_key}})
+
+        try:
+            dynamodb_client.transact_write_items(TransactItems=transact_items)
+        except ClientError as e:
+            # Branch changed since it was read, read it again
+            attempts += 1
+            if e.response['Error']['Code'] == 'TransactionCanceledException' and attempts < max_attempts:
+                continue
+            return written_keys, str(e)
+        written_keys.extend(changed_keys)
+        i += transaction_size
+    return written_keys, None
+
+
+def get_branch_member_states(catalog_branch, catalog_changes_table, from_revision, to_revision=None):
+    """Return the members of a branch changed between two revisions.
+
+    Replays the changes recorded after from_revision (up to to_revision) by
+    write_branch_members. Returns a dictionary mapping each changed product
+    key to whether it was a member at from_revision and at to_revision.
+    """
+    key_condition = Key('catalog_branch').eq(catalog_branch)
+    if to_revision is None:
+        key_condition &= Key('revision').gt(int(from_revision))
+    else:
+        key_condition &= Key('revision').between(int(from_revision) + 1, int(to_revision))
+    dynamodb_args = {
+        'KeyConditionExpression': key_condition,
+        'ConsistentRead': True
+    }
+    member_states = {}
+    while True:
+        request = boto3.resource('dynamodb').Table(catalog_changes_table).query(**dynamodb_args)
+        for change in request['Items']:
+            for product_key in change.get('added', []):
+                member_states.setdefault(product_key, [False, True])[1] = True
+            for product_key in change.get('removed', []):
+                member_states.setdefault(product_key, [True, False])[1] = False
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return {
+        product_key: tuple(states)
+        for product_key, states in member_states.items()
+    }
+
+
+def delete_branch_changes(catalog_branch, catalog_changes_table, until_revision=None):
+    """Delete a branch's recorded changes (up to until_revision, or all)."""
+    key_condition = Key('catalog_branch').eq(catalog_branch)
+    if until_revision is not None:
+        key_condition &= Key('revision').lte(int(until_revision))
+    dynamodb_args = {
+        'KeyConditionExpression': key_condition,
+        'ProjectionExpression': 'catalog_branch, revision'
+    }
+    deleted_changes = 0
+    with boto3.resource('dynamodb').Table(catalog_changes_table).batch_writer() as batch:
+        while True:
+            request = boto3.resource('dynamodb').Table(catalog_changes_table).query(**dynamodb_args)
+            for change in request['Items']:
+                batch.delete_item(Key=change)
+                deleted_changes += 1
+            try:
+                dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+            except KeyError:
+                break
+    return deleted_changes
+
+
+def get_apple_catalog_product_keys(apple_catalog, apple_catalog_products_table):
+    """Return the product keys of an Apple catalog from the DynamoDB catalog products table."""
+    dynamodb_args = {
+        'KeyConditionExpression': 'apple_catalog = :apple_catalog',
+        'ExpressionAttributeValues': {
+            ':apple_catalog': apple_catalog
+        },
+        'ProjectionExpression': 'product_key'
+    }
+    product_keys = []
+    while True:
+        request = boto3.resource('dynamodb').Table(apple_catalog_products_table).query(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            product_keys.append(dynamodb_item['product_key'])
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return product_keys
+
+
+def get_product_apple_catalogs(product_key, apple_catalog_products_table):
+    """Return the Apple catalogs containing a product from the catalog products table's product_key index."""
+    dynamodb_args = {
+        'IndexName': 'product_key-index',
+        'KeyConditionExpression': 'product_key = :product_key',
+        'ExpressionAttributeValues': {
+            ':product_key': product_key
+        },
+        'ProjectionExpression': 'apple_catalog'
+    }
+    apple_catalogs = []
+    while True:
+        request = boto3.resource('dynamodb').Table(apple_catalog_products_table).query(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            apple_catalogs.append(dynamodb_item['apple_catalog'])
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return apple_catalogs
+
+
+def prune_apple_catalog_products(apple_catalog, product_keys, apple_catalog_products_table):
+    """Remove products no longer in an Apple catalog from the catalog products table."""
+    stale_keys = set(get_apple_catalog_product_keys(apple_catalog, apple_catalog_products_table))
+    stale_keys.difference_update(product_keys)
+    with boto3.resource('dynamodb').Table(apple_catalog_products_table).batch_writer() as batch:
+        for product_key in stale_keys:
+            batch.delete_item(
+                Key={
+                    'apple_catalog': apple_catalog,
+                    'product_key': product_key
+                }
+            )
+    return sorted(stale_keys)
+
+
+def is_branch_migrated(catalog_branch_item):
+    """Check that a branch no longer holds the legacy product_keys list.
+
+    migrate_catalog_branches moves the list to the members table, and must
+    run before the members table is used for the branch.
+    """
+    return 'product_keys' not in catalog_branch_item
+
+
+def check_branch_migrated(catalog_branch_item):
+    """Raise MigrationError if a branch has not been migrated to the members table."""
+    if not is_branch_migrated(catalog_branch_item):
+        raise MigrationError(
+            "Branch " +
+            catalog_branch_item['catalog_branch'] +
+            " still holds a product_keys list; run migrate_catalog_branches first"
+        )
+
+
+def get_catalog_branches(catalog_branches_table, names_only=False, catalog_members_table=None):
+    """Get list of catalog branches from DynamoDB metadata table.
+
+    Unless names_only, each branch's product_keys are read from the members
+    table if one is given, raising MigrationError for branches that have not
+    been migrated to it. Otherwise the branch items are returned as stored.
+    """
     dynamodb_args = {'ConsistentRead': True}
     if names_only:
         dynamodb_args['Select'] = 'SPECIFIC_ATTRIBUTES'
@@ -176,6 +1039,14 @@ def get_catalog_branches(catalog_branches_table, names_only=False):
             dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
         except KeyError:
             break
+
+    if catalog_members_table and not names_only:
+        for catalog_branch in catalog_branches:
+            check_branch_migrated(catalog_branch)
+            catalog_branch['product_keys'] = get_branch_product_keys(
+                catalog_branch['catalog_branch'],
+                catalog_members_table
+            )
     return catalog_branches
 
 
@@ -215,20 +1086,24 @@ def get_default_prefs():
              'snowleopard-leopard.merged-1.sucatalog'),
         ],
         'PreferredLocalizations': ['English', 'en'],
-        'LocalCatalogURLBase': ''
+        'LocalCatalogURLBase': '',
+        'PriorityBranches': ['production', 'testing'],
+        'PriorityPostDateDays': 30,
+        'PinnedProducts': [],
+        'LocalizationPruning': ''
     }
 
 
+def get_prefs(s3_bucket, prefs_path='metadata/Preferences.plist'):
+    """Return all preferences from the preference plist in S3, with defaults."""
+    prefs = get_default_prefs()
+    prefs.update(read_plist_s3(prefs_path, s3_bucket))
+    return prefs
+
+
 def get_pref(pref_name, s3_bucket, prefs_path='metadata/Preferences.plist'):
     """Return a preference from the preference plist in S3."""
-    default_prefs = get_default_prefs()
-    prefs = read_plist_s3(prefs_path, s3_bucket)
-    if pref_name in prefs:
-        return prefs[pref_name]
-    elif pref_name in default_prefs:
-        return default_prefs[pref_name]
-    else:
-        return None
+    return get_prefs(s3_bucket, prefs_path).get(pref_name)
 
 
 def delete_pref(pref_name, s3_bucket, prefs_path='metadata/Preferences.plist'):
@@ -246,6 +1121,236 @@ def write_pref(pref_name, pref, s3_bucket, prefs_path='metadata/Preferences.plis
 
 
 
+### Product Listing ###
+
+def get_product_listing(product_info_table):
+    """Scan the product fields listed by GET /products, sorted by product key."""
+    dynamodb_args = {
+        'Select': 'SPECIFIC_ATTRIBUTES',
+        'ProjectionExpression': 'product_key, title, version, PostDate'
+    }
+    product_listing = []
+    while True:
+        request = boto3.resource('dynamodb').Table(product_info_table).scan(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            dynamodb_item['PostDate'] = dynamodb_item['PostDate'].split(' ')[0]
+            product_listing.append(dynamodb_item)
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    product_listing.sort(key=lambda dynamodb_item: dynamodb_item['product_key'])
+    return product_listing
+
+
+def write_product_listing(product_info_table, s3_bucket, listing_path='html/anejo/products.json'):
+    """Write the product listing snapshot to S3 as gzipped JSON.
+
+    The object is only replaced when the listing has changed, so its ETag
+    (and any copy cached by CloudFront or clients) stays valid otherwise.
+    Returns True if the snapshot was written.
+    """
+    listing_body = json.dumps(
+        get_product_listing(product_info_table),
+        separators=(',', ':')
+    ).encode('utf-8')
+    listing_sha256 = hashlib.sha256(listing_body).hexdigest()
+    if get_product_listing_sha256(s3_bucket, listing_path) == listing_sha256:
+        return False
+
+    boto3.client('s3').put_object(
+        Body=gzip.compress(listing_body, mtime=0),
+        Bucket=s3_bucket,
+        Key=listing_path,
+        ContentType='application/json',
+        ContentEncoding='gzip',
+        CacheControl='max-age=300',
+        Metadata={
+            'listing-sha256': listing_sha256
+        }
+    )
+    return True
+
+
+def get_product_listing_sha256(s3_bucket, listing_path='html/anejo/products.json'):
+    """Return the SHA-256 of the product listing snapshot (None if it does not exist)."""
+    try:
+        return boto3.client('s3').head_object(
+            Bucket=s3_bucket,
+            Key=listing_path
+        )['Metadata'].get('listing-sha256')
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+            return None
+        raise
+
+
+def read_product_listing(s3_bucket, listing_path='html/anejo/products.json'):
+    """Read the product listing snapshot from S3 (None if it does not exist)."""
+    try:
+        listing_data = read_s3_cached(listing_path, s3_bucket)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ['404', 'NoSuchKey', 'NotFound']:
+            return None
+        raise
+    return json.loads(gzip.decompress(listing_data).decode('utf-8'))
+
+
+def request_product_listing_update(queue_url, delay=0, replication_ledger_table=None):
+    """Ask write_local_catalog to rewrite the product listing snapshot.
+
+    With a replication ledger, requests made within delay of each other are
+    coalesced into one rewrite (see request_coalesced_update).
+    """
+    if replication_ledger_table:
+        return request_coalesced_update(
+            'product-listing',
+            {'product_listing': True},
+            replication_ledger_table,
+            queue_url,
+            delay
+        )
+    return send_to_queue({'product_listing': True}, queue_url, delay)
+
+
+
+### Product Search ###
+
+def get_search_tokens(text, max_tokens=None):
+    """Return the lowercase alphanumeric tokens of a text (HTML tags removed)."""
+    tokens = []
+    for token in re.findall(r'[a-z0-9]+', re.sub(r'<[^>]*>', ' ', str(text or '')).lower()):
+        if len(token) > 1 and token not in tokens:
+            tokens.append(token)
+    return tokens[:max_tokens]
+
+
+def get_product_search_entries(product_key, product_info, deprecated=False, min_prefix_length=3, max_description_tokens=100):
+    """Return a product's search index entries, keyed by 'index_key|sort_key'.
+
+    Title tokens are also indexed by their prefixes (so partial words
+    match), description tokens only whole. Every entry sorts by PostDate.
+    """
+    post_date = str(product_info.get('PostDate', ''))
+    index_keys = ['postdate']
+    if product_info.get('version'):
+        index_keys.append('version#' + str(product_info['version']).lower())
+    if deprecated:
+        index_keys.append('deprecated')
+    for token in get_search_tokens(product_info.get('title')):
+        for prefix_length in range(min(min_prefix_length, len(token)), len(token) + 1):
+            index_keys.append('token#' + token[:prefix_length])
+    for token in get_search_tokens(product_info.get('description'), max_description_tokens):
+        index_keys.append('token#' + token)
+
+    search_entries = {}
+    for index_key in index_keys:
+        search_entry = {
+            'index_key': index_key,
+            'sort_key': post_date + '#' + product_key,
+            'product_key': product_key,
+            'PostDate': post_date
+        }
+        for metadata_key in ['title', 'version']:
+            if product_info.get(metadata_key):
+                search_entry[metadata_key] = product_info[metadata_key]
+        search_entries[index_key + '|' + search_entry['sort_key']] = search_entry
+    return search_entries
+
+
+def delete_product_search_entries(search_index, product_search_table):
+    """Delete search index entries by their 'index_key|sort_key' IDs."""
+    with boto3.resource('dynamodb').Table(product_search_table).batch_writer() as batch:
+        for search_entry_id in search_index:
+            index_key, sort_key = search_entry_id.split('|', 1)
+            batch.delete_item(
+                Key={
+                    'index_key': index_key,
+                    'sort_key': sort_key
+                }
+            )
+
+
+def update_product_search_index(product_key, product_info_table, product_search_table, deprecated=False):
+    """Bring a product's search index entries up to date with its metadata.
+
+    Nothing is written unless the indexed metadata (or deprecation) has
+    changed since the last update. Returns True if the index was updated.
+    """
+    product_info = boto3.resource('dynamodb').Table(product_info_table).get_item(
+        Key={
+            'product_key': product_key
+        },
+        ProjectionExpression='title, version, description, PostDate, search_index, search_signature'
+    ).get('Item')
+    if not product_info:
+        return False
+
+    search_signature = hashlib.sha256(json.dumps(
+        [
+            product_info.get(metadata_key)
+            for metadata_key in ['title', 'version', 'description', 'PostDate']
+        ] + [deprecated],
+        default=str
+    ).encode('utf-8')).hexdigest()
+    if product_info.get('search_signature') == search_signature:
+        return False
+
+    search_entries = get_product_search_entries(product_key, product_info, deprecated)
+    delete_product_search_entries(
+        set(product_info.get('search_index', [])).difference(search_entries),
+        product_search_table
+    )
+    with boto3.resource('dynamodb').Table(product_search_table).batch_writer() as batch:
+        for search_entry in search_entries.values():
+            batch.put_item(Item=search_entry)
+
+    boto3.resource('dynamodb').Table(product_info_table).update_item(
+        Key={
+            'product_key': product_key
+        },
+        UpdateExpression="SET search_index = :search_index, search_signature = :search_signature",
+        ExpressionAttributeValues={
+            ':search_index': sorted(search_entries),
+            ':search_signature': search_signature
+        }
+    )
+    return True
+
+
+def get_search_index_keys(index_key, product_search_table, since=None, until=None):
+    """Return the set of product keys in a search index partition."""
+    dynamodb_args = {
+        'KeyConditionExpression': get_search_key_condition(index_key, since, until),
+        'ProjectionExpression': 'product_key'
+    }
+    product_keys = set()
+    while True:
+        request = boto3.resource('dynamodb').Table(product_search_table).query(**dynamodb_args)
+        for dynamodb_item in request['Items']:
+            product_keys.add(dynamodb_item['product_key'])
+        try:
+            dynamodb_args['ExclusiveStartKey'] = request['LastEvaluatedKey']
+        except KeyError:
+            break
+    return product_keys
+
+
+def get_search_key_condition(index_key, since=None, until=None):
+    """Return a search index KeyConditionExpression for a PostDate range."""
+    key_condition = Key('index_key').eq(index_key)
+    sort_key = Key('sort_key')
+    # Sort keys start with the PostDate ('YYYY-MM-DD HH:MM:SS#product_key')
+    if since and until:
+        return key_condition & sort_key.between(str(since), str(until) + '~')
+    if since:
+        return key_condition & sort_key.gte(str(since))
+    if until:
+        return key_condition & sort_key.lte(str(until) + '~')
+    return key_condition
+
+
+
 ### Compression Utilities ###
 
 def compress_dict(original_dict, string=False):
@@ -276,6 +1381,183 @@ def uncompress_dict(original_dict):
 
 
 
+### Catalog Parsing ###
+
+def plist_element_to_value(element):
+    """Convert a parsed XML plist element to a Python value."""
+    if element.tag == 'dict':
+        children = list(element)
+        return {
+            key.text or '': plist_element_to_value(value)
+            for key, value in zip(children[0::2], children[1::2])
+        }
+    elif element.tag == 'array':
+        return [plist_element_to_value(child) for child in element]
+    elif element.tag == 'string':
+        return element.text or ''
+    elif element.tag == 'integer':
+        return int(element.text)
+    elif element.tag == 'real':
+        return float(element.text)
+    elif element.tag == 'true':
+        return True
+    elif element.tag == 'false':
+        return False
+    elif element.tag == 'date':
+        return datetime.datetime.strptime(element.text, '%Y-%m-%dT%H:%M:%SZ')
+    elif element.tag == 'data':
+        return base64.b64decode(''.join((element.text or '').split()))
+    raise plistlib.InvalidFileException("Unsupported plist element: " + element.tag)
+
+
+def iter_catalog_products(chunks, catalog_header=None):
+    """Incrementally parse an Apple catalog plist from chunks of bytes.
+
+    Yields (product_key, product) pairs as each product finishes parsing,
+    discarding its XML once converted, so memory is bounded by the largest
+    product rather than the whole catalog. Top-level keys other than
+    Products are added to the catalog_header dictionary if one is given.
+    """
+    if catalog_header is None:
+        catalog_header = {}
+    parser = ElementTree.XMLPullParser(events=('start', 'end'))
+    depth = 0
+    top_level_key = None
+    products_element = None
+    product_key = None
+
+    try:
+        for chunk in chunks:
+            parser.feed(chunk)
+            for event, element in parser.read_events():
+                if event == 'start':
+                    depth += 1
+                    if depth == 3 and top_level_key == 'Products':
+                        products_element = element
+                    continue
+                depth -= 1
+
+                # <plist><dict> (depth 2) holds the header keys and Products
+                if depth == 2:
+                    if element.tag == 'key':
+                        top_level_key = element.text
+                    elif top_level_key != 'Products':
+                        catalog_header[top_level_key] = plist_element_to_value(element)
+                        element.clear()
+
+                # Products <dict> (depth 3) holds product_key/product pairs
+                elif depth == 3 and top_level_key == 'Products':
+                    if element.tag == 'key':
+                        product_key = element.text
+                    else:
+                        yield product_key, plist_element_to_value(element)
+                        products_element.clear()
+        parser.close()
+    except ElementTree.ParseError as e:
+        raise plistlib.InvalidFileException(str(e))
+
+
+def iter_hashed_chunks(chunks, hash_object, spool_file=None):
+    """Pass through chunks of bytes, adding each one to a hash object.
+
+    The chunks are also written to spool_file, if given.
+    """
+    for chunk in chunks:
+        hash_object.update(chunk)
+        if spool_file is not None:
+            spool_file.write(chunk)
+        yield chunk
+
+
+def encode_plist_value(value):
+    """Encode plist dates and data for JSON (json.dumps default hook)."""
+    if isinstance(value, datetime.datetime):
+        return {'$date': value.strftime('%Y-%m-%dT%H:%M:%SZ')}
+    elif isinstance(value, bytes):
+        return {'$data': base64.b64encode(value).decode('utf-8')}
+    raise TypeError("Cannot encode " + type(value).__name__ + " as JSON")
+
+
+def decode_plist_value(json_object):
+    """Decode plist dates and data from JSON (json.loads object hook)."""
+    if len(json_object) == 1:
+        if '$date' in json_object:
+            return datetime.datetime.strptime(json_object['$date'], '%Y-%m-%dT%H:%M:%SZ')
+        elif '$data' in json_object:
+            return base64.b64decode(json_object['$data'])
+    return json_object
+
+
+def dump_catalog_product(product):
+    """Serialize a parsed catalog product to compact JSON."""
+    return json.dumps(product, default=encode_plist_value, separators=(',', ':'))
+
+
+def write_catalog_cache(apple_catalog_path, catalog_header, cache_file, catalog_sha256, s3_bucket):
+    """Upload a parsed catalog next to its .apple snapshot in S3.
+
+    cache_file holds the cache written by a closed CatalogCacheWriter. The
+    cache is keyed by the catalog's IndexDate and the SHA-256 of the XML
+    stored as the .apple snapshot.
+    """
+    cache_file.seek(0)
+    boto3.client('s3').upload_fileobj(
+        cache_file,
+        s3_bucket,
+        apple_catalog_path + '.cache',
+        ExtraArgs={
+            'Metadata': {
+                'catalog-index-date': dump_catalog_product(catalog_header.get('IndexDate')),
+                'catalog-sha256': catalog_sha256
+            }
+        }
+    )
+    return apple_catalog_path + '.cache'
+
+
+def get_catalog_cache_key(apple_catalog_path, s3_bucket):
+    """Return the IndexDate and SHA-256 of the catalog cache in S3.
+
+    Returns (None, None) if the catalog has no cache.
+    """
+    try:
+        cache_metadata = boto3.client('s3').head_object(
+            Bucket=s3_bucket,
+            Key=apple_catalog_path + '.cache'
+        )['Metadata']
+    except ClientError:
+        return None, None
+    return cache_metadata.get('catalog-index-date'), cache_metadata.get('catalog-sha256')
+
+
+def read_catalog_cache(apple_catalog_path, index_date, catalog_sha256, s3_bucket):
+    """Return a parsed catalog (IndexDate, sha256, header, Products) from cache.
+
+    Checks /tmp first, then the cache next to the .apple snapshot in S3.
+    Returns None if there is no cache for this IndexDate and SHA-256.
+    """
+    # Keyed by content hash, so a cached copy never needs revalidating
+    catalog_cache, validators = tmp_cache_get('catalog-cache:' + catalog_sha256)
+    if catalog_cache is not None:
+        tmp_cache_stats['hits'] += 1
+    else:
+        tmp_cache_stats['misses'] += 1
+        try:
+            catalog_cache = boto3.client('s3').get_object(
+                Bucket=s3_bucket,
+                Key=apple_catalog_path + '.cache'
+            )['Body'].read()
+        except ClientError:
+            return None
+        tmp_cache_put('catalog-cache:' + catalog_sha256, catalog_cache)
+
+    catalog = json.loads(zlib.decompress(catalog_cache).decode('utf-8'), object_hook=decode_plist_value)
+    if catalog['sha256'] != catalog_sha256 or dump_catalog_product(catalog['IndexDate']) != index_date:
+        return None
+    return catalog
+
+
+
 ### URL Utilities ###
 
 def get_path_from_url(url, root_dir, append_to_path=''):
@@ -285,33 +1567,381 @@ def get_path_from_url(url, root_dir, append_to_path=''):
     return os.path.join(root_dir, relative_path) + append_to_path
 
 
-def retrieve_url(url):
+def retrieve_url(url, headers=None):
     """Retrieve URL as bytes."""
     return urllib3.PoolManager().request(
         'GET',
         url,
+        headers=headers,
         preload_content=False
     )
 
 
-def replicate_url_to_bucket(url, s3_bucket, root_dir='html', append_to_path='', copy_only_if_missing=False):
+def get_upstream_validators(response):
+    """Return the upstream validators of a URL response as S3 object metadata."""
+    upstream_validators = {}
+    for header, metadata_key in [
+        ('ETag', 'upstream-etag'),
+        ('Last-Modified', 'upstream-last-modified'),
+        ('Content-Length', 'upstream-content-length')
+    ]:
+        if response.headers.get(header):
+            upstream_validators[metadata_key] = response.headers[header]
+    return upstream_validators
+
+
+def get_conditional_headers(s3_metadata):
+    """Return conditional request headers from the upstream validators in S3 object metadata."""
+    headers = {}
+    if 'upstream-etag' in s3_metadata:
+        headers['If-None-Match'] = s3_metadata['upstream-etag']
+    if 'upstream-last-modified' in s3_metadata:
+        headers['If-Modified-Since'] = s3_metadata['upstream-last-modified']
+    return headers
+
+
+def upstream_changed(response, s3_object):
+    """Check if an upstream URL response differs from the replicated S3 object.
+
+    Error responses are not changes, so the replicated object is kept.
+    """
+    if response.status != 200:
+        return False
+    s3_metadata = s3_object.get('Metadata', {})
+    upstream_validators = get_upstream_validators(response)
+    if 'upstream-etag' in s3_metadata and 'upstream-etag' in upstream_validators:
+        return s3_metadata['upstream-etag'] != upstream_validators['upstream-etag']
+    if 'upstream-last-modified' in s3_metadata and 'upstream-last-modified' in upstream_validators:
+        return (
+            s3_metadata['upstream-last-modified'] != upstream_validators['upstream-last-modified'] or
+            s3_metadata.get('upstream-content-length') != upstream_validators.get('upstream-content-length')
+        )
+    # Objects replicated without validators can only be compared by size
+    return str(s3_object.get('ContentLength')) != upstream_validators.get('upstream-content-length')
+
+
+def store_object_digests(s3_file_path, s3_bucket, digests):
+    """Add the SHA-1 and SHA-256 of a replicated file to its S3 metadata.
+
+    Metadata cannot be changed in place, so the file is copied onto itself
+    (a managed copy, for files over the 5 GB single copy limit).
+    """
+    s3_client = boto3.client('s3')
+    s3_metadata = s3_client.head_object(Bucket=s3_bucket, Key=s3_file_path)['Metadata']
+    s3_metadata['sha1'] = digests['sha1']
+    s3_metadata['sha256'] = digests['sha256']
+    s3_client.copy(
+        {'Bucket': s3_bucket, 'Key': s3_file_path},
+        s3_bucket,
+        s3_file_path,
+        ExtraArgs={
+            'Metadata': s3_metadata,
+            'MetadataDirective': 'REPLACE'
+        }
+    )
+
+
+def replicate_url_to_bucket(url, s3_bucket, root_dir='html', append_to_path='', copy_only_if_missing=False, s3_key_index=None, verify=False, expected_size=None, expected_digest=None, verified_digests=None):
     """Retrieve a URL and stores it in the same relative path in an S3 Bucket.
 
+    If an S3 key index is given, it answers the existence check for
+    copy_only_if_missing. With verify, existing files are only transferred
+    again if the upstream validators (ETag, Last-Modified, Content-Length)
+    recorded at upload have changed.
+
+    The size and digest are checked while the file streams through; a
+    mismatch with the expected size or digest raises IntegrityError and
+    nothing is stored. The digest is stored in the file's metadata: the
+    expected digest if given, else the computed SHA-1 and SHA-256. If a
+    verified_digests dictionary is given, the size and digests of each
+    transferred file are added to it under its S3 path.
     Returns a path to the replicated file.
     """
     s3_file_path = get_path_from_url(url, 'html', append_to_path=append_to_path)
 
-    if copy_only_if_missing and s3_file_exists(s3_file_path, s3_bucket):
-        return s3_file_path
+    s3_object = None
+    if (copy_only_if_missing or verify) and s3_file_exists(s3_file_path, s3_bucket, s3_key_index):
+        if not verify:
+            return s3_file_path
+        s3_object = boto3.client('s3').head_object(Bucket=s3_bucket, Key=s3_file_path)
+
+    if s3_object is not None:
+        # Conditional request against the validators recorded at upload
+        response = retrieve_url(url, get_conditional_headers(s3_object.get('Metadata', {})))
+        if response.status not in [200, 304]:
+            print(
+                "WARNING: Cannot verify " +
+                url +
+                " (HTTP " +
+                str(response.status) +
+                "), keeping replicated file"
+            )
+        if not upstream_changed(response, s3_object):
+            response.release_conn()
+            return s3_file_path
     else:
-        print("Replicating " + url + " to " + s3_file_path)
+        response = retrieve_url(url)
+
+    s3_metadata = get_upstream_validators(response)
+    if expected_size is not None:
+        s3_metadata['verified-size'] = str(expected_size)
+    if expected_digest:
+        s3_metadata['verified-digest'] = expected_digest.lower()
+        # Only stored if the transferred file matches it
+        s3_metadata['sha256' if len(expected_digest) == 64 else 'sha1'] = expected_digest.lower()
+
+    print("Replicating " + url + " to " + s3_file_path)
+    hashing_reader = HashingReader(response, expected_size, expected_digest)
+    try:
         boto3.client('s3').upload_fileobj(
-            retrieve_url(url),
+            hashing_reader,
             s3_bucket,
-            s3_file_path
+            s3_file_path,
+            ExtraArgs={
+                'Metadata': s3_metadata
+            }
+        )
+    except IntegrityError as e:
+        print("ERROR: " + url + " failed verification: " + str(e))
+        response.release_conn()
+        raise
+
+    if not expected_digest:
+        store_object_digests(s3_file_path, s3_bucket, hashing_reader.digests())
+    if verified_digests is not None:
+        verified_digests[s3_file_path] = hashing_reader.digests()
+    return s3_file_path
+
+
+def replicate_url_range(url, s3_bucket, upload_id, byte_range, part_size):
+    """Replicate a byte range of a URL as parts of an S3 multipart upload.
+
+    The range starts on a part boundary, and each part_size block of it is
+    uploaded as the part numbered by its offset in the file, so the ranges
+    of a file can be replicated by separate workers in any order. The
+    assembled file is checked against its size and digest once every part
+    is uploaded. Returns the number of bytes replicated.
+    """
+    s3_file_path = get_path_from_url(url, 'html')
+    start, end = [int(offset) for offset in byte_range]
+    response = retrieve_url(url, {'Range': 'bytes=' + str(start) + '-' + str(end - 1)})
+    if response.status != 206:
+        response.release_conn()
+        raise IntegrityError(
+            "Range request for " + url + " answered with HTTP " + str(response.status)
+        )
+
+    print("Replicating bytes " + str(start) + "-" + str(end - 1) + " of " + url + " to " + s3_file_path)
+    offset = start
+    try:
+        while offset < end:
+            data = response.read(min(part_size, end - offset))
+            if len(data) != min(part_size, end - offset):
+                raise IntegrityError(
+                    "Size mismatch: expected bytes " + str(offset) + "-" + str(end - 1) + ", got " + str(len(data))
+                )
+            boto3.client('s3').upload_part(
+                Bucket=s3_bucket,
+                Key=s3_file_path,
+                UploadId=upload_id,
+                PartNumber=offset // part_size + 1,
+                Body=data
+            )
+            offset += len(data)
+    finally:
+        response.release_conn()
+    return end - start
+
+
+def get_mirrored_localizations(distributions, preferred_localizations):
+    """Return the distribution localizations to mirror.
+
+    Only the preferred localizations present in a product are mirrored,
+    falling back on English. Returns None (mirror all localizations) if
+    none of them are available.
+    """
+    languages = list(preferred_localizations or []) + ['English', 'en']
+    localizations = set(
+        [language for language in languages if language in distributions]
+    )
+    if not localizations:
+        return None
+    return localizations
+
+
+def claim_url_replication(url, run_time, replication_ledger_table, lease_seconds=900):
+    """Claim the replication of a URL for a sync run in the replication ledger.
+
+    Returns the claim's timestamp if this caller won the claim, otherwise
+    None. Claims left by a worker that died mid-transfer expire after
+    lease_seconds.
+    """
+    now = int(time.time())
+    try:
+        boto3.resource('dynamodb').Table(replication_ledger_table).put_item(
+            Item={
+                'source_url': url,
+                'run_time': run_time,
+                'replication_status': 'replicating',
+                'claimed_at': now,
+                'expiration': now + 86400
+            },
+            ConditionExpression=(
+                'attribute_not_exists(source_url) OR '
+                'run_time <> :run_time OR '
+                '(replication_status = :replicating AND claimed_at < :lease_expired)'
+            ),
+            ExpressionAttributeValues={
+                ':run_time': run_time,
+                ':replicating': 'replicating',
+                ':lease_expired': now - int(lease_seconds)
+            }
+        )
+        return now
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return None
+
+
+def release_url_replication(url, run_time, claimed_at, replication_ledger_table):
+    """Release a failed replication claim, unless another worker has claimed the URL since."""
+    try:
+        boto3.resource('dynamodb').Table(replication_ledger_table).delete_item(
+            Key={
+                'source_url': url
+            },
+            ConditionExpression='run_time = :run_time AND claimed_at = :claimed_at',
+            ExpressionAttributeValues={
+                ':run_time': run_time,
+                ':claimed_at': claimed_at
+            }
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+
+def record_avoided_duplicate(run_time, replication_ledger_table):
+    """Count a replication avoided by the ledger in the run's stats item."""
+    boto3.resource('dynamodb').Table(replication_ledger_table).update_item(
+        Key={
+            'source_url': 'run-stats/' + str(run_time)
+        },
+        UpdateExpression="ADD duplicates_avoided :one SET expiration = :expiration",
+        ExpressionAttributeValues={
+            ':one': 1,
+            ':expiration': int(time.time()) + 86400
+        }
+    )
+
+
+def replicate_url_once(url, s3_bucket, run_time, replication_ledger_table, lease_seconds=900, **replicate_args):
+    """Replicate a URL to S3 at most once per sync run.
+
+    The first worker to claim the URL in the replication ledger replicates
+    it; other workers skip the URL. A URL is only replicated again once its
+    claim is released (its worker failed) or its lease expires (its worker
+    died), by the worker that claims it next.
+
+    Returns a path to the replicated file, or None if another worker is
+    still replicating it (callers retry later instead of waiting on it).
+    """
+    claimed_at = claim_url_replication(url, run_time, replication_ledger_table, lease_seconds)
+    ledger = boto3.resource('dynamodb').Table(replication_ledger_table)
+    if claimed_at:
+        try:
+            s3_file_path = replicate_url_to_bucket(url, s3_bucket, **replicate_args)
+        except Exception:
+            # Release the claim so another worker can retry it
+            release_url_replication(url, run_time, claimed_at, replication_ledger_table)
+            raise
+        ledger.update_item(
+            Key={
+                'source_url': url
+            },
+            UpdateExpression="SET replication_status = :replicated",
+            ExpressionAttributeValues={
+                ':replicated': 'replicated'
+            }
         )
         return s3_file_path
 
+    item = ledger.get_item(
+        Key={
+            'source_url': url
+        },
+        ConsistentRead=True
+    ).get('Item', {})
+    if item.get('run_time') == run_time and item.get('replication_status') == 'replicated':
+        record_avoided_duplicate(run_time, replication_ledger_table)
+        return get_path_from_url(
+            url,
+            replicate_args.get('root_dir', 'html'),
+            replicate_args.get('append_to_path', '')
+        )
+    # Still being replicated by another worker
+    return None
+
+
+def get_product_urls(product, localizations=None):
+    """Return all replicable URLs (metadata, packages, distributions) of a product.
+
+    If a set of localizations is given, only those distributions are included.
+    """
+    urls = []
+    if 'ServerMetadataURL' in product:
+        urls.append(product['ServerMetadataURL'])
+    for package in product.get('Packages', []):
+        if 'URL' in package:
+            urls.append(package['URL'])
+        if 'MetadataURL' in package:
+            urls.append(package['MetadataURL'])
+    for dist_lang, dist_url in product.get('Distributions', {}).items():
+        if localizations is None or dist_lang in localizations:
+            urls.append(dist_url)
+    return urls
+
+
+def plan_url_replication(urls, s3_bucket):
+    """Index the S3 keys under the directories of the given URLs.
+
+    Lists each directory once instead of checking each file individually.
+    """
+    prefixes = [
+        os.path.dirname(get_path_from_url(url, 'html')) + '/'
+        for url in urls
+    ]
+    return build_s3_key_index(s3_bucket, prefixes)
+
+
+def register_lazy_url(url, package_fetch_table, expected_size=None, expected_digest=None):
+    """Register a URL to be replicated to S3 the first time it is requested.
+
+    The expected size and digest (from the catalog) are stored with it, so
+    the replication can be verified.
+    """
+    s3_file_path = get_path_from_url(url, 'html')
+    update_expression = "SET source_url = :source_url, fetch_status = if_not_exists(fetch_status, :pending)"
+    expression_attribute_values = {
+        ':source_url': url,
+        ':pending': 'pending'
+    }
+    if expected_size is not None:
+        update_expression += ", expected_size = :expected_size"
+        expression_attribute_values[':expected_size'] = int(expected_size)
+    if expected_digest:
+        update_expression += ", expected_digest = :expected_digest"
+        expression_attribute_values[':expected_digest'] = expected_digest.lower()
+    boto3.resource('dynamodb').Table(package_fetch_table).update_item(
+        Key={
+            's3_file_path': s3_file_path
+        },
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=expression_attribute_values
+    )
+    return s3_file_path
+
 
 
 ### Rewrite URLs ###
@@ -325,8 +1955,12 @@ def rewrite_url(full_url, local_catalog_url_base):
         return full_url
 
 
-def rewrite_product_urls(product, local_catalog_url_base):
-    """Rewrites all URLs for a given product."""
+def rewrite_product_urls(product, local_catalog_url_base, localizations=None, drop_pruned=False):
+    """Rewrites all URLs for a given product.
+
+    If a set of localizations is given, distributions for other (pruned)
+    localizations keep pointing to Apple, or are removed if drop_pruned.
+    """
     if 'ServerMetadataURL' in product:
         product['ServerMetadataURL'] = rewrite_url(
             product['ServerMetadataURL'],
@@ -348,7 +1982,11 @@ def rewrite_product_urls(product, local_catalog_url_base):
             del package['Digest']
 
     distributions = product['Distributions']
-    for dist_lang in distributions.keys():
+    for dist_lang in list(distributions.keys()):
+        if localizations is not None and dist_lang not in localizations:
+            if drop_pruned:
+                del distributions[dist_lang]
+            continue
         distributions[dist_lang] = rewrite_url(
             distributions[dist_lang],
             local_catalog_url_base
@@ -369,88 +2007,226 @@ def rewrite_catalog_urls(catalog_plist, local_catalog_url_base):
 
 ### Branch Catalogs ###
 
-def write_branch_catalogs(local_catalog_path, s3_bucket, catalog_branches_table, product_info_table):
-    """Write out branch catalogs."""
-    catalog_plist = read_plist_s3(local_catalog_path, s3_bucket)
-    downloaded_products = catalog_plist['Products']
-    #product_info = getProductInfo()
-    #
-    local_catalog_name = os.path.basename(local_catalog_path)
-    local_catalog_url_base = get_pref('LocalCatalogURLBase', s3_bucket)
+def request_branch_rebuild(catalog_branch, catalog_branches_table, queue_url, delay=0):
+    """Queue a rebuild of a branch's catalogs after its membership changed.
+
+    Sends the branch's membership_revision (bumped by every member write)
+    with the (delayed) message, so a burst of changes is coalesced into the
+    rebuild of the last one. Deleted branches are sent without a revision.
+    """
+    branch = boto3.resource('dynamodb').Table(catalog_branches_table).get_item(
+        Key={
+            'catalog_branch': catalog_branch
+        },
+        ConsistentRead=True
+    ).get('Item')
+    membership_revision = None
+    if branch:
+        membership_revision = int(branch.get('membership_revision', 0))
+
+    event_data = {
+        'catalog_branch': catalog_branch,
+        'membership_revision': membership_revision
+    }
+    return send_to_queue(event_data, queue_url, delay)
+
+
+def get_branch_catalog_path(local_catalog_path, catalog_branch):
+    """Return the path of a branch catalog of a local catalog."""
     # now strip the '.sucatalog' bit from the name
     # so we can use it to construct our branch catalog names
     if local_catalog_path.endswith('.sucatalog'):
         local_catalog_path = local_catalog_path[0:-10]
-    #
-    # now write filtered catalogs (branches)
-    catalog_branches = get_catalog_branches(catalog_branches_table)
-    for branch in catalog_branches:
-        branch_catalog_path = local_catalog_path + '_' + branch['catalog_branch'] + '.sucatalog'
-        print("Building " + os.path.basename(branch_catalog_path) + "...")
-        # embed branch catalog name into the catalog for troubleshooting
-        # and validation
-        catalog_plist['_CatalogName'] = os.path.basename(branch_catalog_path)
-        catalog_plist['Products'] = {}
-        for product_key in branch['product_keys']:
-            if product_key in downloaded_products.keys():
-                # add the product to the Products dict for this catalog
-                catalog_plist['Products'][product_key] = downloaded_products[product_key]
-            #elif get_pref('LocalCatalogURLBase') and product_key in product_info:
-            elif local_catalog_url_base:
-                try:
-                    product_info = boto3.resource('dynamodb').Table(product_info_table).get_item(
-                        Key={
-                            'product_key': product_key
-                        }
-                    )['Item']
-                except KeyError:
-                    # Product not in ProductInfo
-                    continue
-                #
-                # Product might have been deprecated by Apple,
-                # so we check cached product info
-                # Check to see if this product was ever in this
-                # catalog
-                original_catalogs = list(product_info.get('OriginalAppleCatalogs', []))
-                for original_catalog in original_catalogs:
-                    if original_catalog.endswith(local_catalog_name):
-                        # this item was originally in this catalog, so
-                        # we can add it to the branch
-                        catalog_entry = uncompress_dict(product_info.get('CatalogEntry'))
-                        title = product_info.get('title')
-                        version = product_info.get('version')
-                        if catalog_entry:
-                            print(
-                                "WARNING: Product " +
-                                product_key +
-                                " (" +
-                                title +
-                                "-" +
-                                version +
-                                " in branch " +
-                                branch +
-                                " has been deprecated. Will used cached info and packages"
-                            )
-                            rewrite_product_urls(catalog_entry, local_catalog_url_base)
-                            catalog_plist['Products'][product_key] = catalog_entry
-                            continue
-            else:
-                # Item not in catalog or cache - skip it
-                pass
-        #
-        write_plist_s3(catalog_plist, branch_catalog_path, s3_bucket)
+    return local_catalog_path + '_' + catalog_branch + '.sucatalog'
 
 
+def load_catalog_build_state(s3_bucket, catalog_branches_table, catalog_members_table, branch_workers=8, catalog_branches=None):
+    """Load the state shared by every local and branch catalog build.
 
-### Local Catalogs ###
+    Lets a build of several catalogs list the download status, scan the
+    branches, and read preferences once instead of once per catalog.
+    branch_workers sets how many branch catalogs are written concurrently.
+    Only the given catalog branches are built, if any are given.
+
+    Branch membership is read from the members table, which is required.
+    """
+    if not catalog_members_table:
+        raise ValueError("A catalog members table is required to build branch catalogs")
+    if catalog_branches is None:
+        catalog_branches = get_catalog_branches(
+            catalog_branches_table,
+            catalog_members_table=catalog_members_table
+        )
+    prefs = get_prefs(s3_bucket)
+    return {
+        'branch_workers': int(branch_workers),
+        's3_client': boto3.client('s3'),
+        'local_catalog_url_base': prefs['LocalCatalogURLBase'],
+        'localization_pruning': prefs['LocalizationPruning'],
+        'preferred_localizations': prefs['PreferredLocalizations'],
+        'downloaded_products': set(get_download_status(s3_bucket)),
+        'pending_products': set(get_download_status(s3_bucket, 'metadata/PendingDownload')),
+        'catalog_branches': catalog_branches,
+        'product_info': {}
+    }
 
-def write_local_catalogs(apple_catalog_path, catalog_plist, s3_bucket, catalog_branches_table, product_info_table):
-    """Write local catalogs to S3 based on the Apple catalog."""
-    # Rewrite catalog URLs to point to local servers (instead of Apple's) 
-    rewrite_catalog_urls(
+
+def rewrite_catalog_product_urls(product, build_state):
+    """Rewrites a product's URLs following the build's localization pruning.
+
+    Returns the number of pruned localizations.
+    """
+    localizations = None
+    if build_state['localization_pruning']:
+        localizations = get_mirrored_localizations(
+            product.get('Distributions', {}),
+            build_state['preferred_localizations']
+        )
+    rewrite_product_urls(
+        product,
+        build_state['local_catalog_url_base'],
+        localizations,
+        build_state['localization_pruning'] == 'drop'
+    )
+    if localizations is None:
+        return 0
+    return len(product.get('Distributions', {})) - len(localizations)
+
+
+def get_cached_product_info(product_key, product_info_table, build_state):
+    """Return a product's info from DynamoDB, cached for the rest of the build."""
+    if product_key not in build_state['product_info']:
+        build_state['product_info'][product_key] = boto3.resource('dynamodb').Table(product_info_table).get_item(
+            Key={
+                'product_key': product_key
+            },
+            ProjectionExpression='OriginalAppleCatalogs, CatalogEntry, title, version'
+        ).get('Item')
+    return build_state['product_info'][product_key]
+
+
+def build_branch_catalog(branch, catalog_plist, local_catalog_name, product_info_table, build_state):
+    """Return a branch catalog built from a local catalog.
+
+    The local catalog is not modified, so branches can be built concurrently.
+    """
+    downloaded_products = catalog_plist['Products']
+    branch_products = {}
+    for product_key in branch.get('product_keys', []):
+        if product_key in downloaded_products:
+            # add the product to the Products dict for this catalog
+            branch_products[product_key] = downloaded_products[product_key]
+        elif build_state['local_catalog_url_base']:
+            product_info = get_cached_product_info(product_key, product_info_table, build_state)
+            if not product_info:
+                # Product not in ProductInfo
+                continue
+            #
+            # Product might have been deprecated by Apple,
+            # so we check cached product info
+            # Check to see if this product was ever in this
+            # catalog
+            original_catalogs = list(product_info.get('OriginalAppleCatalogs', []))
+            for original_catalog in original_catalogs:
+                if original_catalog.endswith(local_catalog_name):
+                    # this item was originally in this catalog, so
+                    # we can add it to the branch
+                    catalog_entry = uncompress_dict(product_info.get('CatalogEntry'))
+                    title = product_info.get('title')
+                    version = product_info.get('version')
+                    if catalog_entry:
+                        print(
+                            "WARNING: Product " +
+                            product_key +
+                            " (" +
+                            str(title) +
+                            "-" +
+                            str(version) +
+                            ") in branch " +
+                            branch['catalog_branch'] +
+                            " has been deprecated. Will used cached info and packages"
+                        )
+                        rewrite_catalog_product_urls(catalog_entry, build_state)
+                        branch_products[product_key] = catalog_entry
+                        break
+        else:
+            # Item not in catalog or cache - skip it
+            pass
+
+    branch_catalog_plist = dict(catalog_plist)
+    branch_catalog_plist['Products'] = branch_products
+    return branch_catalog_plist
+
+
+def write_branch_catalog(branch, catalog_plist, local_catalog_path, s3_bucket, product_info_table, build_state):
+    """Build and write one branch catalog to S3."""
+    branch_catalog_path = get_branch_catalog_path(local_catalog_path, branch['catalog_branch'])
+    print("Building " + os.path.basename(branch_catalog_path) + "...")
+
+    branch_catalog_plist = build_branch_catalog(
+        branch,
         catalog_plist,
-        get_pref('LocalCatalogURLBase', s3_bucket)
+        os.path.basename(local_catalog_path),
+        product_info_table,
+        build_state
     )
+    # embed branch catalog name into the catalog for troubleshooting
+    # and validation
+    branch_catalog_plist['_CatalogName'] = os.path.basename(branch_catalog_path)
+    return write_plist_s3(
+        branch_catalog_plist,
+        branch_catalog_path,
+        s3_bucket,
+        build_state['s3_client']
+    )
+
+
+def write_branch_catalogs(local_catalog_path, s3_bucket, catalog_branches_table, product_info_table, catalog_plist=None, build_state=None, catalog_members_table=None):
+    """Write out branch catalogs.
+
+    Branches are built and uploaded concurrently by a pool of
+    build_state['branch_workers'] threads. Uses the given local catalog and
+    build state if already loaded; loading the build state requires the
+    members table.
+    """
+    if catalog_plist is None:
+        catalog_plist = read_plist_s3(local_catalog_path, s3_bucket)
+    if build_state is None:
+        build_state = load_catalog_build_state(s3_bucket, catalog_branches_table, catalog_members_table)
+
+    with ThreadPoolExecutor(max_workers=max(1, build_state['branch_workers'])) as executor:
+        branch_writes = [
+            executor.submit(
+                write_branch_catalog,
+                branch,
+                catalog_plist,
+                local_catalog_path,
+                s3_bucket,
+                product_info_table,
+                build_state
+            )
+            for branch in build_state['catalog_branches']
+        ]
+    # Raise any error from the branch writes
+    return [branch_write.result() for branch_write in branch_writes]
+
+
+
+### Local Catalogs ###
+
+def write_local_catalogs(apple_catalog_path, catalog_plist, s3_bucket, catalog_branches_table, product_info_table, catalog_products=None, build_state=None, catalog_members_table=None):
+    """Write local catalogs to S3 based on the Apple catalog.
+
+    Products are read from catalog_products, an iterable of
+    (product_key, product) pairs such as iter_catalog_products(), if given.
+    Otherwise they are read from the catalog's Products dictionary. A build
+    state from load_catalog_build_state() can be shared between catalogs;
+    loading one here requires the members table.
+    """
+    if build_state is None:
+        build_state = load_catalog_build_state(s3_bucket, catalog_branches_table, catalog_members_table)
+    localization_pruning = build_state['localization_pruning']
+    pruned_dists = 0
 
     # Remove the '.apple' from the end of the catalog path
     if apple_catalog_path.endswith('.apple'):
@@ -460,15 +2236,30 @@ def write_local_catalogs(apple_catalog_path, catalog_plist, s3_bucket, catalog_b
 
     print("Building " + local_catalog_path + "...")
     catalog_plist['_CatalogName'] = os.path.basename(local_catalog_path)
-    downloaded_products_list = get_download_status(s3_bucket)
+    downloaded_products_list = build_state['downloaded_products']
+    pending_products_list = build_state['pending_products']
     downloaded_products = {}
 
-    product_keys = list(catalog_plist['Products'].keys())
+    if catalog_products is None:
+        catalog_products = list(catalog_plist.get('Products', {}).items())
 
     # Remove products that haven't been downloaded
-    for product_key in product_keys:
+    for product_key, product in catalog_products:
         if product_key in downloaded_products_list:
-            downloaded_products[product_key] = catalog_plist['Products'][product_key]
+            # Rewrite product URLs to point to local servers (instead of Apple's)
+            if build_state['local_catalog_url_base'] is not None:
+                pruned_dists += rewrite_catalog_product_urls(product, build_state)
+            downloaded_products[product_key] = product
+        elif product_key in pending_products_list:
+            # Publish products still being back-filled with Apple's URLs
+            print(
+                "WARNING: Product " +
+                product_key +
+                " added to catalog " +
+                apple_catalog_path +
+                " with Apple URLs because its packages are still downloading."
+            )
+            downloaded_products[product_key] = product
         else:
             print(
                 "WARNING: Did not add product " +
@@ -479,11 +2270,19 @@ def write_local_catalogs(apple_catalog_path, catalog_plist, s3_bucket, catalog_b
             )
     catalog_plist['Products'] = downloaded_products
 
+    if pruned_dists:
+        if localization_pruning == 'drop':
+            pruned_action = "Dropped "
+        else:
+            pruned_action = "Kept upstream URLs for "
+        print(pruned_action + str(pruned_dists) + " pruned localizations in " + local_catalog_path)
+
     # Write raw catalog with all downloaded Apple updates enabled
     write_plist_s3(
         catalog_plist,
         local_catalog_path,
-        s3_bucket
+        s3_bucket,
+        build_state['s3_client']
     )
 
     # Write filtered catalogs (branches) based on this catalog
@@ -491,8 +2290,95 @@ def write_local_catalogs(apple_catalog_path, catalog_plist, s3_bucket, catalog_b
         local_catalog_path,
         s3_bucket,
         catalog_branches_table,
-        product_info_table
+        product_info_table,
+        catalog_plist,
+        build_state
     )
+    return local_catalog_path
+
+
+def request_coalesced_update(update_key, event_data, replication_ledger_table, queue_url, delay=0):
+    """Queue a delayed write_local_catalog update, coalescing bursts of requests.
+
+    Bumps the update's version in the replication ledger and sends it with
+    the message, so only the message of the last request in a burst is acted
+    on (see is_latest_update).
+    """
+    update_version = boto3.resource('dynamodb').Table(replication_ledger_table).update_item(
+        Key={
+            'source_url': 'update/' + update_key
+        },
+        UpdateExpression="ADD update_version :one SET expiration = :expiration",
+        ExpressionAttributeValues={
+            ':one': 1,
+            ':expiration': int(time.time()) + 86400
+        },
+        ReturnValues='UPDATED_NEW'
+    )['Attributes']['update_version']
+
+    event_data = dict(event_data)
+    event_data['update_key'] = update_key
+    event_data['update_version'] = int(update_version)
+    return send_to_queue(event_data, queue_url, delay)
+
+
+def start_catalog_sync_run(run_time, catalog_urls, replication_ledger_table):
+    """Record the catalogs a repo sync run is syncing in the replication ledger.
+
+    See complete_catalog_sync_run.
+    """
+    boto3.resource('dynamodb').Table(replication_ledger_table).put_item(
+        Item={
+            'source_url': 'catalog-sync/' + str(run_time),
+            'catalog_urls': list(catalog_urls),
+            'pending_catalogs': set(catalog_urls),
+            'expiration': int(time.time()) + 86400
+        }
+    )
+
+
+def complete_catalog_sync_run(run_time, catalog_url, replication_ledger_table):
+    """Mark a catalog of a repo sync run as synced in the replication ledger.
+
+    Returns the run's catalog URLs if it was the last of them to finish, so
+    that only the last catalog_sync requests the run's catalog build.
+    Otherwise (or if it was already marked, e.g. for a redelivered message)
+    returns None.
+    """
+    try:
+        ledger_item = boto3.resource('dynamodb').Table(replication_ledger_table).update_item(
+            Key={
+                'source_url': 'catalog-sync/' + str(run_time)
+            },
+            UpdateExpression="DELETE pending_catalogs :catalog_url",
+            ExpressionAttributeValues={
+                ':catalog_url': set([catalog_url]),
+                ':catalog_url_str': catalog_url
+            },
+            ConditionExpression='contains(pending_catalogs, :catalog_url_str)',
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return None
+        raise
+    if ledger_item.get('pending_catalogs'):
+        return None
+    return ledger_item['catalog_urls']
+
+
+def is_latest_update(update_key, update_version, replication_ledger_table):
+    """Check if a coalesced update message is the latest one requested.
+
+    Updates whose ledger item has expired are treated as the latest.
+    """
+    ledger_item = boto3.resource('dynamodb').Table(replication_ledger_table).get_item(
+        Key={
+            'source_url': 'update/' + update_key
+        },
+        ConsistentRead=True
+    ).get('Item', {})
+    return int(ledger_item.get('update_version', update_version)) == int(update_version)
 
 
 
@@ -43,9 +43,11 @@ Author:  Jacob F. Grant
 Created: 01/06/19
 """
 
+import hashlib
 import json
 import os
 import plistlib
+import tempfile
 
 import boto3
 from botocore.exceptions import ClientError
@@ -56,8 +58,8 @@ import anejocommon
 
 ### Functions ###
 
-def archive_catalog(catalog_path, catalog_url, s3_bucket, index_date):
-    """Make an archive copy of a catalog in S3."""
+def archive_catalog(catalog_path, s3_bucket, index_date):
+    """Make an archive copy of a catalog in S3 (copied from its .apple snapshot)."""
     archiver_dir = os.path.join(os.path.dirname(catalog_path), 'archive')
     catalog_name = os.path.basename(catalog_path)
 
@@ -69,8 +71,11 @@ def archive_catalog(catalog_path, catalog_url, s3_bucket, index_date):
     archive_path = os.path.join(archiver_dir, catalog_name)
     if not anejocommon.s3_file_exists(archive_path, s3_bucket):
         try:
-            boto3.client('s3').upload_fileobj(
-                anejocommon.retrieve_url(catalog_url),
+            boto3.client('s3').copy(
+                {
+                    'Bucket': s3_bucket,
+                    'Key': catalog_path
+                },
                 s3_bucket,
                 archive_path
             )
@@ -82,25 +87,45 @@ def archive_catalog(catalog_path, catalog_url, s3_bucket, index_date):
     return archive_path
 
 
-def product_sync(catalog_url, run_time, product_key, product_info, download_packages, fast_scan, queue_url):
-    """Send event data to product_sync queue."""
-    event_data = {
+def product_sync(catalog_url, run_time, product_key, product_info, download_packages, fast_scan, verify_scan, two_phase_sync, lazy_packages):
+    """Return event data for the product_sync queue."""
+    return {
         'catalog_url': catalog_url,
         'run_time': run_time,
         'product_key': product_key,
         'product_info': product_info,
         'download_packages': download_packages,
-        'fast_scan': fast_scan
+        'fast_scan': fast_scan,
+        'verify_scan': verify_scan,
+        'two_phase_sync': two_phase_sync,
+        'lazy_packages': lazy_packages
     }
-    return anejocommon.send_to_queue(event_data, queue_url)
 
 
-def write_catalog(catalog_url, queue_url, delay=0):
+def write_catalog(catalog_url, queue_url, delay=0, index_date=None, catalog_sha256=None):
     """Send event data to write_local_catalog queue."""
     event_data = {'catalog_url': catalog_url}
+    if catalog_sha256:
+        event_data['index_date'] = index_date
+        event_data['catalog_sha256'] = catalog_sha256
     return anejocommon.send_to_queue(event_data, queue_url, delay)
 
 
+def complete_catalog_sync(catalog_sync_info, replication_ledger_table, queue_url, delay=0):
+    """Write all of a repo sync run's catalogs in one build once its last catalog is synced."""
+    if not (catalog_sync_info.get('write_catalogs') and replication_ledger_table):
+        return None
+    catalog_urls = anejocommon.complete_catalog_sync_run(
+        catalog_sync_info['run_time'],
+        catalog_sync_info['catalog_url'],
+        replication_ledger_table
+    )
+    if not catalog_urls:
+        return None
+    print("Last catalog of the run synced, writing all local catalogs")
+    return anejocommon.send_to_queue({'catalog_urls': catalog_urls}, queue_url, delay)
+
+
 
 ### HANDLER FUNCTION ###
 
@@ -109,9 +134,12 @@ def lambda_handler(event, context):
     # Environmental Variables
     S3_BUCKET = anejocommon.set_env_var('S3_BUCKET')
     PRODUCT_QUEUE_URL = anejocommon.set_env_var('PRODUCT_QUEUE_URL')
-    PRODUCT_DOWNLOAD_QUEUE_URL = anejocommon.set_env_var('PRODUCT_DOWNLOAD_QUEUE_URL')
     WRITE_CATALOG_QUEUE_URL = anejocommon.set_env_var('WRITE_CATALOG_QUEUE_URL')
     WRITE_CATALOG_DELAY = anejocommon.set_env_var('WRITE_CATALOG_DELAY', 300)
+    APPLE_CATALOG_PRODUCTS_TABLE = anejocommon.set_env_var('APPLE_CATALOG_PRODUCTS_TABLE')
+    PRODUCT_INFO_TABLE = anejocommon.set_env_var('PRODUCT_INFO_TABLE')
+    PRODUCT_SEARCH_TABLE = anejocommon.set_env_var('PRODUCT_SEARCH_TABLE')
+    REPLICATION_LEDGER_TABLE = anejocommon.set_env_var('REPLICATION_LEDGER_TABLE')
 
     # Loop through event records
     try:
@@ -130,6 +158,9 @@ def lambda_handler(event, context):
         run_time = catalog_sync_info['run_time']
         download_packages = catalog_sync_info.get('download_packages', False)
         fast_scan = catalog_sync_info.get('fast_scan', True)
+        verify_scan = catalog_sync_info.get('verify_scan', False)
+        two_phase_sync = catalog_sync_info.get('two_phase_sync', False)
+        lazy_packages = catalog_sync_info.get('lazy_packages', False)
 
         bucket_catalog_path = anejocommon.get_path_from_url(
             catalog_url,
@@ -137,62 +168,147 @@ def lambda_handler(event, context):
             append_to_path='.apple'
         )
 
+        # Single pass over the catalog stream: hash and spool its bytes (for the
+        # .apple snapshot), write the parsed catalog cache, and send each batch
+        # of products to the product_sync queue as soon as it is parsed.
+        # Packages are split into download tasks by product_sync, and recent
+        # products are downloaded from its priority lane.
         catalog = anejocommon.retrieve_url(catalog_url)
-        try:
-            catalog_plist = plistlib.readPlistFromBytes(catalog.data)
-        except plistlib.InvalidFileException:
-            print("ERROR: Cannot read catalog plist")
-            return
-
-        # Archive catalog if it already exists
-        if anejocommon.s3_file_exists(bucket_catalog_path, S3_BUCKET):
-            archive_catalog(
-                bucket_catalog_path,
-                catalog_url,
-                S3_BUCKET,
-                catalog_plist['IndexDate']
-            )
-
-        try:
-            anejocommon.replicate_url_to_bucket(
-                catalog_url,
-                S3_BUCKET,
-                root_dir='html',
-                append_to_path='.apple'
-            )
-        except ClientError as e:
-            print("ERROR: Cannot upload catalog to S3")
-            print(str(e))
-            return
-
-        if 'Products' in catalog_plist:
-            products = catalog_plist['Products']
-            product_keys = list(products.keys())
-
-            # Choose correct queue for product_sync
-            if download_packages:
-                queue_url = PRODUCT_DOWNLOAD_QUEUE_URL
-            else:
-                queue_url = PRODUCT_QUEUE_URL
+        catalog_hash = hashlib.sha256()
+        catalog_plist = {}
+        product_keys = []
+        product_batch = []
+        with tempfile.TemporaryFile() as catalog_file, tempfile.TemporaryFile() as cache_file:
+            cache_writer = anejocommon.CatalogCacheWriter(cache_file)
+            try:
+                for product_key, product in anejocommon.iter_catalog_products(
+                    anejocommon.iter_hashed_chunks(catalog.stream(65536), catalog_hash, catalog_file),
+                    catalog_plist
+                ):
+                    product_keys.append(product_key)
+                    cache_writer.add(product_key, product)
+                    product_batch.append(
+                        product_sync(
+                            catalog_url,
+                            run_time,
+                            product_key,
+                            anejocommon.compress_dict(product, True),
+                            download_packages,
+                            fast_scan,
+                            verify_scan,
+                            two_phase_sync,
+                            lazy_packages
+                        )
+                    )
+                    if len(product_batch) == 10:
+                        anejocommon.send_to_queue_batch(product_batch, PRODUCT_QUEUE_URL)
+                        product_batch = []
+                anejocommon.send_to_queue_batch(product_batch, PRODUCT_QUEUE_URL)
+            except plistlib.InvalidFileException:
+                print("ERROR: Cannot read catalog plist")
+                complete_catalog_sync(
+                    catalog_sync_info,
+                    REPLICATION_LEDGER_TABLE,
+                    WRITE_CATALOG_QUEUE_URL,
+                    WRITE_CATALOG_DELAY
+                )
+                return
+            finally:
+                catalog.release_conn()
+
+            # Store the bytes parsed above as the .apple snapshot, archiving
+            # it if there already was one
+            catalog_sha256 = catalog_hash.hexdigest()
+            catalog_metadata = anejocommon.get_upstream_validators(catalog)
+            catalog_metadata['catalog-sha256'] = catalog_sha256
+            archive = anejocommon.s3_file_exists(bucket_catalog_path, S3_BUCKET)
+            catalog_file.seek(0)
+            try:
+                boto3.client('s3').upload_fileobj(
+                    catalog_file,
+                    S3_BUCKET,
+                    bucket_catalog_path,
+                    ExtraArgs={
+                        'Metadata': catalog_metadata
+                    }
+                )
+            except ClientError as e:
+                print("ERROR: Cannot upload catalog to S3")
+                print(str(e))
+                complete_catalog_sync(
+                    catalog_sync_info,
+                    REPLICATION_LEDGER_TABLE,
+                    WRITE_CATALOG_QUEUE_URL,
+                    WRITE_CATALOG_DELAY
+                )
+                return
+            if archive:
+                archive_catalog(
+                    bucket_catalog_path,
+                    S3_BUCKET,
+                    catalog_plist['IndexDate']
+                )
 
-            # Send to product_sync queue
-            for product_key in product_keys:
-                product_info = anejocommon.compress_dict(products[product_key], True)
-                product_sync(
+            # Cache the parsed catalog for write_local_catalog, keyed by the
+            # SHA-256 of the stored snapshot
+            index_date = anejocommon.dump_catalog_product(catalog_plist.get('IndexDate'))
+            cache_writer.close(catalog_plist, catalog_sha256)
+            try:
+                anejocommon.write_catalog_cache(
+                    bucket_catalog_path,
+                    catalog_plist,
+                    cache_file,
+                    catalog_sha256,
+                    S3_BUCKET
+                )
+            except ClientError as e:
+                print("WARNING: Cannot write catalog cache to S3")
+                print(str(e))
+
+        # Drop products Apple removed from this catalog from the catalog
+        # products table (product_sync adds the current ones)
+        if APPLE_CATALOG_PRODUCTS_TABLE:
+            try:
+                removed_products = anejocommon.prune_apple_catalog_products(
                     catalog_url,
-                    run_time,
-                    product_key,
-                    product_info,
-                    download_packages,
-                    fast_scan,
-                    queue_url
+                    product_keys,
+                    APPLE_CATALOG_PRODUCTS_TABLE
                 )
-
-        # Write our local (filtered) catalogs
+                if removed_products:
+                    print("Removed from " + catalog_url + ": " + ', '.join(removed_products))
+
+                # Products in no Apple catalog are deprecated
+                for product_key in removed_products:
+                    if PRODUCT_SEARCH_TABLE and not anejocommon.get_product_apple_catalogs(
+                        product_key,
+                        APPLE_CATALOG_PRODUCTS_TABLE
+                    ):
+                        anejocommon.update_product_search_index(
+                            product_key,
+                            PRODUCT_INFO_TABLE,
+                            PRODUCT_SEARCH_TABLE,
+                            deprecated=True
+                        )
+            except ClientError as e:
+                print("WARNING: Cannot prune catalog products or search tables")
+                print(str(e))
+
+        # Write our local (filtered) catalogs, unless they are written with
+        # the rest of the repo sync run's catalogs in one build
+        if not catalog_sync_info.get('write_catalog', True):
+            complete_catalog_sync(
+                catalog_sync_info,
+                REPLICATION_LEDGER_TABLE,
+                WRITE_CATALOG_QUEUE_URL,
+                WRITE_CATALOG_DELAY
+            )
+            continue
         write_catalog(
             catalog_url,
             WRITE_CATALOG_QUEUE_URL,
-            WRITE_CATALOG_DELAY
+            WRITE_CATALOG_DELAY,
+            index_date,
+            catalog_sha256
         )
 
 
@@ -0,0 +1,112 @@
+# BSD 3-Clause License
+#
+# Copyright 2011 Disney Enterprises, Inc.
+# Copyright (c) 2019, Jacob F. Grant
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders, including the names "Disney",
+# "Walt Disney Pictures", "Walt Disney Animation Studios", nor the names of
+# their contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Migrate Catalog Branches
+
+AWS Lambda function that moves branch catalog membership out of the legacy
+product_keys list attribute on each branch item and into the catalog branch
+members table (one item per branch and product).
+
+Safe to run more than once: members are written before the product_keys
+attribute is removed from the branch item.
+
+Run it before deploying the catalogs and products API and the
+write_local_catalog function that read the members table. They refuse to
+build or change branches that still hold a product_keys list (raising
+anejocommon.MigrationError), since their members table would be empty.
+
+
+Author:  Jacob F. Grant
+Created: 10/19/26
+"""
+
+import boto3
+
+import anejocommon
+
+
+
+### Functions ###
+
+def migrate_catalog_branch(catalog_branch, catalog_branches_table, catalog_members_table):
+    """Write a branch's product_keys to the members table and drop the list"""
+    product_keys = catalog_branch.get('product_keys', [])
+    with boto3.resource('dynamodb').Table(catalog_members_table).batch_writer() as batch:
+        for product_key in product_keys:
+            batch.put_item(
+                Item={
+                    'catalog_branch': catalog_branch['catalog_branch'],
+                    'product_key': product_key
+                }
+            )
+
+    boto3.resource('dynamodb').Table(catalog_branches_table).update_item(
+        Key={
+            'catalog_branch': catalog_branch['catalog_branch']
+        },
+        UpdateExpression="REMOVE product_keys ADD membership_revision :one",
+        ExpressionAttributeValues={
+            ':one': 1
+        }
+    )
+    return len(product_keys)
+
+
+
+### Lambda Function ###
+
+def lambda_handler(event, context):
+    """Handler function for AWS Lambda"""
+    CATALOG_BRANCHES_TABLE = anejocommon.set_env_var('CATALOG_BRANCHES_TABLE')
+    CATALOG_MEMBERS_TABLE = anejocommon.set_env_var('CATALOG_MEMBERS_TABLE')
+
+    migration_stats = {
+        'migrated_branches': 0,
+        'migrated_members': 0
+    }
+    for catalog_branch in anejocommon.get_catalog_branches(CATALOG_BRANCHES_TABLE):
+        if 'product_keys' not in catalog_branch:
+            continue
+        migration_stats['migrated_members'] += migrate_catalog_branch(
+            catalog_branch,
+            CATALOG_BRANCHES_TABLE,
+            CATALOG_MEMBERS_TABLE
+        )
+        migration_stats['migrated_branches'] += 1
+
+    print(migration_stats)
+    return migration_stats
+
+
+
+if __name__ == "__main__":
+    pass
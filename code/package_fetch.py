@@ -0,0 +1,217 @@
+# BSD 3-Clause License
+#
+# Copyright 2011 Disney Enterprises, Inc.
+# Copyright (c) 2019, Jacob F. Grant
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#
+# * Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+#
+# * Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+#
+# * Neither the name of the copyright holders, including the names "Disney",
+# "Walt Disney Pictures", "Walt Disney Animation Studios", nor the names of
+# their contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE
+# FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY,
+# OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""
+Package Fetch
+
+AWS Lambda function that lazily mirrors packages to an S3 bucket the first time
+a client requests them.
+
+Answers CloudFront origin failover requests for packages missing from the S3
+bucket by redirecting the client to Apple's URL, while a single replication of
+the package into the S3 bucket is queued. Also processes that queue, copying
+each package to the same path used by replicate_url_to_bucket.
+
+
+Author:  Jacob F. Grant
+Created: 10/19/26
+"""
+
+import json
+import os
+from time import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+import anejocommon
+
+
+
+### Functions ###
+
+def claim_package_fetch(s3_file_path, package_fetch_table, lease_seconds):
+    """Claim the replication of a package (single-flight guard).
+
+    Returns whether this caller won the claim and the package's item (empty
+    if the package was never registered).
+    """
+    now = int(time())
+    try:
+        item = boto3.resource('dynamodb').Table(package_fetch_table).update_item(
+            Key={
+                's3_file_path': s3_file_path
+            },
+            UpdateExpression="SET fetch_status = :fetching, fetch_started = :now",
+            ExpressionAttributeValues={
+                ':fetching': 'fetching',
+                ':pending': 'pending',
+                ':now': now,
+                ':lease_expired': now - int(lease_seconds)
+            },
+            ConditionExpression=(
+                'attribute_exists(source_url) AND '
+                '(fetch_status = :pending OR '
+                '(fetch_status = :fetching AND fetch_started < :lease_expired))'
+            ),
+            ReturnValues='ALL_NEW'
+        )['Attributes']
+        return True, item
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+
+    # Already claimed by another request (or never registered)
+    item = boto3.resource('dynamodb').Table(package_fetch_table).get_item(
+        Key={
+            's3_file_path': s3_file_path
+        }
+    ).get('Item', {})
+    return False, item
+
+
+def set_fetch_status(s3_file_path, fetch_status, package_fetch_table):
+    """Set the fetch status of a package."""
+    boto3.resource('dynamodb').Table(package_fetch_table).update_item(
+        Key={
+            's3_file_path': s3_file_path
+        },
+        UpdateExpression="SET fetch_status = :fetch_status",
+        ExpressionAttributeValues={
+            ':fetch_status': fetch_status
+        }
+    )
+
+
+def handle_package_miss(s3_file_path, package_fetch_table, package_fetch_queue_url, lease_seconds):
+    """Redirect a package request to its source and queue a single replication."""
+    claimed, package = claim_package_fetch(s3_file_path, package_fetch_table, lease_seconds)
+    source_url = package.get('source_url')
+    if not source_url:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'text/plain'},
+            'body': 'Not Found'
+        }
+    if claimed:
+        print("Queueing replication of " + source_url + " to " + s3_file_path)
+        anejocommon.send_to_queue(
+            {
+                's3_file_path': s3_file_path,
+                'source_url': source_url,
+                'expected_size': package.get('expected_size'),
+                'expected_digest': package.get('expected_digest')
+            },
+            package_fetch_queue_url
+        )
+
+    # Serve this request from the source while the package is replicated
+    return {
+        'statusCode': 302,
+        'headers': {
+            'Location': source_url,
+            'Cache-Control': 'no-store'
+        },
+        'body': ''
+    }
+
+
+def fetch_package(s3_file_path, source_url, s3_bucket, package_fetch_table, expected_size=None, expected_digest=None):
+    """Replicate a package to the S3 bucket and mark it mirrored.
+
+    The package is verified against its expected size and digest, if known.
+    """
+    if expected_size is not None:
+        expected_size = int(expected_size)
+    try:
+        anejocommon.replicate_url_to_bucket(
+            source_url,
+            s3_bucket,
+            expected_size=expected_size,
+            expected_digest=expected_digest
+        )
+    except Exception:
+        # Release the claim so the next request can retry
+        set_fetch_status(s3_file_path, 'pending', package_fetch_table)
+        raise
+    set_fetch_status(s3_file_path, 'mirrored', package_fetch_table)
+
+
+
+### HANDLER FUNCTION ###
+
+def lambda_handler(event, context):
+    """Handler function for AWS Lambda."""
+    # Environmental Variables
+    PACKAGE_FETCH_TABLE = anejocommon.set_env_var('PACKAGE_FETCH_TABLE')
+    PACKAGE_FETCH_QUEUE_URL = anejocommon.set_env_var('PACKAGE_FETCH_QUEUE_URL')
+    PACKAGE_FETCH_LEASE = anejocommon.set_env_var('PACKAGE_FETCH_LEASE', 900)
+    S3_BUCKET = anejocommon.set_env_var('S3_BUCKET')
+
+    # Package miss (API Gateway proxy request from CloudFront)
+    if 'pathParameters' in event:
+        try:
+            package_path = event['pathParameters']['proxy']
+        except (KeyError, TypeError):
+            package_path = event.get('path', '')
+        s3_file_path = os.path.join('html', package_path.lstrip('/'))
+        return handle_package_miss(
+            s3_file_path,
+            PACKAGE_FETCH_TABLE,
+            PACKAGE_FETCH_QUEUE_URL,
+            PACKAGE_FETCH_LEASE
+        )
+
+    # Loop through event records
+    try:
+        event_records = event['Records']
+    except KeyError:
+        event_records = [{'body': event}]
+
+    for record in event_records:
+        try:
+            package_fetch_info = json.loads(record['body'])
+        except TypeError:
+            package_fetch_info = record['body']
+
+        fetch_package(
+            package_fetch_info['s3_file_path'],
+            package_fetch_info['source_url'],
+            S3_BUCKET,
+            PACKAGE_FETCH_TABLE,
+            package_fetch_info.get('expected_size'),
+            package_fetch_info.get('expected_digest')
+        )
+
+
+
+if __name__ == "__main__":
+    pass
@@ -43,6 +43,7 @@ Author:  Jacob F. Grant
 Created: 01/06/19
 """
 
+import datetime
 import json
 import os
 import re
@@ -58,9 +59,9 @@ import anejocommon
 
 ### Functions ###
 
-def get_preferred_localization(list_of_localizations, s3_bucket):
+def get_preferred_localization(list_of_localizations, prefs):
     """Get the preferred localization."""
-    languages = anejocommon.get_pref('PreferredLocalizations', s3_bucket)
+    languages = prefs.get('PreferredLocalizations')
     if not languages:
         languages = ['English', 'en']
 
@@ -217,10 +218,22 @@ def parse_software_update_dist(dist_data, debug=False):
     return dist
 
 
-def update_apple_catalogs(product_key, run_time, product_catalog, dynamodb_table):
-    """Create/update product AppleCatalogs metadata in DynamoDB."""
+def update_apple_catalogs(product_key, run_time, product_catalog, dynamodb_table, apple_catalog_products_table=None):
+    """Create/update product AppleCatalogs metadata in DynamoDB.
+
+    Also records the product in the catalog products table, which indexes
+    products by Apple catalog (and Apple catalogs by product).
+    """
     dynamodb_table = boto3.resource('dynamodb').Table(dynamodb_table)
     try:
+        if apple_catalog_products_table:
+            boto3.resource('dynamodb').Table(apple_catalog_products_table).put_item(
+                Item={
+                    'apple_catalog': product_catalog,
+                    'product_key': product_key,
+                    'run_time': run_time
+                }
+            )
         try:
             try:
                 # If this is the first time this item has been updated for the
@@ -346,6 +359,579 @@ def update_product_metadata(product_key, product, dynamodb_table):
 
 
 
+def get_product_downloads(catalog_entry, localizations=None):
+    """Return the files (URL, and Size/Digest where known) to download for a product."""
+    packages = {}
+    for package in catalog_entry.get('Packages', []):
+        if 'URL' in package:
+            packages[package['URL']] = package
+
+    downloads = []
+    for url in anejocommon.get_product_urls(catalog_entry, localizations):
+        download = {'url': url}
+        if url in packages:
+            for key in ['Size', 'Digest']:
+                if key in packages[url]:
+                    download[key] = packages[url][key]
+        downloads.append(download)
+    return downloads
+
+
+def estimate_download_seconds(download, throughput, request_overhead):
+    """Estimate the time (in seconds) needed to replicate a file."""
+    return float(request_overhead) + float(download.get('Size', 0)) / float(throughput)
+
+
+def split_download(download, max_task_seconds, throughput, request_overhead, part_size):
+    """Split a file too large for one download task into byte ranges.
+
+    Each range is a whole number of multipart upload parts (of part_size
+    bytes) estimated to fit in a task. Returns a list of
+    (estimated_seconds, download) tuples, one per range.
+    """
+    file_size = int(download['Size'])
+    range_parts = max(1, int((float(max_task_seconds) - float(request_overhead)) * float(throughput)) // part_size)
+    range_size = range_parts * part_size
+
+    ranged_downloads = []
+    for start in range(0, file_size, range_size):
+        end = min(file_size, start + range_size)
+        ranged_downloads.append((
+            float(request_overhead) + float(end - start) / float(throughput),
+            dict(download, Range=[start, end], PartSize=part_size)
+        ))
+    return ranged_downloads
+
+
+def plan_download_tasks(downloads, max_task_seconds, throughput, request_overhead, part_size=67108864):
+    """Split downloads into tasks that each fit within one Lambda invocation.
+
+    Uses the catalog Size of each file to estimate its transfer time. Files
+    too large for a single task are split into byte ranges replicated as
+    parts of a multipart upload. Files are then bin-packed first-fit
+    decreasing, so large packages get a task of their own and small files
+    are grouped together. Returns a list of (estimated_seconds, downloads)
+    tuples.
+    """
+    estimated_downloads = []
+    for download in downloads:
+        estimated_seconds = estimate_download_seconds(download, throughput, request_overhead)
+        if estimated_seconds > max_task_seconds and download.get('Size'):
+            estimated_downloads.extend(
+                split_download(download, max_task_seconds, throughput, request_overhead, part_size)
+            )
+        else:
+            estimated_downloads.append((estimated_seconds, download))
+    estimated_downloads.sort(key=lambda estimated_download: estimated_download[0], reverse=True)
+
+    tasks = []
+    for estimated_seconds, download in estimated_downloads:
+        if estimated_seconds > max_task_seconds:
+            print(
+                "WARNING: " +
+                download['url'] +
+                " is estimated to take " +
+                str(int(estimated_seconds)) +
+                " seconds, longer than a single download task"
+            )
+        for task in tasks:
+            if task[0] + estimated_seconds <= max_task_seconds:
+                task[0] += estimated_seconds
+                task[1].append(download)
+                break
+        else:
+            tasks.append([estimated_seconds, [download]])
+
+    return [(task[0], task[1]) for task in tasks]
+
+
+def package_is_verified(download, verified_package, s3_object):
+    """Check if a package was already verified against its catalog Size and Digest."""
+    if not ('Size' in download and verified_package and s3_object):
+        return False
+    if verified_package.get('Size') != download['Size'] or s3_object['Size'] != download['Size']:
+        return False
+    digest = download.get('Digest', '').lower()
+    return not digest or digest in (verified_package.get('sha1'), verified_package.get('sha256'))
+
+
+def get_replicated_digests(s3_file_path, s3_bucket):
+    """Return the size and digests stored in a replicated file's S3 metadata.
+
+    Returns None for files replicated without a digest.
+    """
+    s3_object = boto3.client('s3').head_object(Bucket=s3_bucket, Key=s3_file_path)
+    digests = {
+        algorithm: s3_object['Metadata'][algorithm]
+        for algorithm in ('sha1', 'sha256')
+        if algorithm in s3_object['Metadata']
+    }
+    if not digests:
+        return None
+    digests['Size'] = s3_object['ContentLength']
+    return digests
+
+
+def find_verified_package(download, verified_packages, s3_key_index, s3_bucket):
+    """Return the size and digests of a package already verified, or None.
+
+    Packages without a record in ProductInfo (e.g. mirrored on demand by
+    package_fetch) are checked against the digests in their S3 metadata.
+    """
+    s3_file_path = anejocommon.get_path_from_url(download['url'], 'html')
+    s3_object = s3_key_index.get(s3_file_path)
+    verified_package = verified_packages.get(s3_file_path)
+    if verified_package is None and 'Size' in download and s3_object:
+        verified_package = get_replicated_digests(s3_file_path, s3_bucket)
+    if package_is_verified(download, verified_package, s3_object):
+        return verified_package
+    return None
+
+
+def replicate_url(url, s3_bucket, run_time=None, replication_ledger_table=None, **replicate_args):
+    """Replicate a URL to S3, once per run if a replication ledger is given.
+
+    Returns None if another worker is still replicating the URL.
+    """
+    if replication_ledger_table and run_time:
+        return anejocommon.replicate_url_once(
+            url,
+            s3_bucket,
+            run_time,
+            replication_ledger_table,
+            **replicate_args
+        )
+    return anejocommon.replicate_url_to_bucket(url, s3_bucket, **replicate_args)
+
+
+def replicate_downloads(downloads, s3_bucket, fast_scan, verify_scan=False, verified_packages=None, run_time=None, replication_ledger_table=None):
+    """Replicate files (metadata, packages, distributions) to S3.
+
+    Packages are checked against their catalog Size and Digest as they
+    transfer, and packages previously verified against the same Size and
+    Digest are skipped. URLs shared with other products are replicated
+    once per run through the replication ledger. Returns the newly verified
+    packages by S3 path, and the downloads deferred because another worker
+    is still replicating them.
+    """
+    if verified_packages is None:
+        verified_packages = {}
+
+    # List the S3 directories once instead of a HEAD per file
+    s3_key_index = anejocommon.plan_url_replication(
+        [download['url'] for download in downloads],
+        s3_bucket
+    )
+
+    verified_digests = {}
+    deferred_downloads = []
+    for download in downloads:
+        s3_file_path = anejocommon.get_path_from_url(download['url'], 'html')
+        verified_package = find_verified_package(download, verified_packages, s3_key_index, s3_bucket)
+        if verified_package is not None:
+            if s3_file_path not in verified_packages:
+                verified_digests[s3_file_path] = verified_package
+            continue
+        replicated_path = replicate_url(
+            download['url'],
+            s3_bucket,
+            run_time,
+            replication_ledger_table,
+            copy_only_if_missing=fast_scan,
+            s3_key_index=s3_key_index,
+            verify=verify_scan,
+            expected_size=download.get('Size'),
+            expected_digest=download.get('Digest'),
+            verified_digests=verified_digests if 'Size' in download else None
+        )
+        if replicated_path is None:
+            deferred_downloads.append(download)
+
+    return verified_digests, deferred_downloads
+
+
+def get_multipart_upload(product_key, download, s3_bucket, dynamodb_table):
+    """Return the ID of the multipart upload replicating a file in ranges.
+
+    The first download task to reach the file starts the upload and records
+    it on the product, with the file's catalog Size and Digest; tasks
+    replicating its other ranges upload their parts to the same upload.
+    """
+    s3_file_path = anejocommon.get_path_from_url(download['url'], 'html')
+    dynamodb_table = boto3.resource('dynamodb').Table(dynamodb_table)
+    multipart_uploads = dynamodb_table.get_item(
+        Key={
+            'product_key': product_key
+        },
+        ProjectionExpression='multipart_uploads',
+        ConsistentRead=True
+    ).get('Item', {}).get('multipart_uploads', {})
+    if s3_file_path in multipart_uploads:
+        return multipart_uploads[s3_file_path]['upload_id']
+
+    s3_metadata = {'verified-size': str(download['Size'])}
+    if download.get('Digest'):
+        s3_metadata['verified-digest'] = download['Digest'].lower()
+        s3_metadata['sha256' if len(download['Digest']) == 64 else 'sha1'] = download['Digest'].lower()
+    upload_id = boto3.client('s3').create_multipart_upload(
+        Bucket=s3_bucket,
+        Key=s3_file_path,
+        Metadata=s3_metadata
+    )['UploadId']
+    multipart_upload = {
+        'upload_id': upload_id,
+        'url': download['url'],
+        'expected_size': int(download['Size']),
+        'part_count': (int(download['Size']) + int(download['PartSize']) - 1) // int(download['PartSize'])
+    }
+    if download.get('Digest'):
+        multipart_upload['expected_digest'] = download['Digest']
+    try:
+        dynamodb_table.update_item(
+            Key={
+                'product_key': product_key
+            },
+            UpdateExpression="SET multipart_uploads = if_not_exists(multipart_uploads, :empty_map)",
+            ExpressionAttributeValues={
+                ':empty_map': {}
+            }
+        )
+        dynamodb_table.update_item(
+            Key={
+                'product_key': product_key
+            },
+            UpdateExpression="SET multipart_uploads.#path = :multipart_upload",
+            ExpressionAttributeNames={
+                '#path': s3_file_path
+            },
+            ExpressionAttributeValues={
+                ':multipart_upload': multipart_upload
+            },
+            ConditionExpression='attribute_not_exists(multipart_uploads.#path)'
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # Another task started the upload first, use that one
+        boto3.client('s3').abort_multipart_upload(Bucket=s3_bucket, Key=s3_file_path, UploadId=upload_id)
+        return get_multipart_upload(product_key, download, s3_bucket, dynamodb_table.name)
+    return upload_id
+
+
+def replicate_download_ranges(product_key, downloads, s3_bucket, fast_scan, verified_packages, dynamodb_table):
+    """Replicate byte ranges of files split across download tasks.
+
+    Ranges of files already verified (or, with fast_scan, already mirrored)
+    are skipped.
+    """
+    s3_key_index = anejocommon.plan_url_replication(
+        [download['url'] for download in downloads],
+        s3_bucket
+    )
+    for download in downloads:
+        s3_file_path = anejocommon.get_path_from_url(download['url'], 'html')
+        if find_verified_package(download, verified_packages, s3_key_index, s3_bucket) is not None:
+            continue
+        if fast_scan and s3_file_path in s3_key_index:
+            continue
+        anejocommon.replicate_url_range(
+            download['url'],
+            s3_bucket,
+            get_multipart_upload(product_key, download, s3_bucket, dynamodb_table),
+            download['Range'],
+            int(download['PartSize'])
+        )
+
+
+def complete_multipart_replications(product_key, s3_bucket, dynamodb_table):
+    """Complete the multipart uploads of a product's files replicated in ranges.
+
+    Run once every download task of the product is done. Each assembled
+    file is read back and checked against its catalog Size and Digest;
+    files with missing parts or that fail verification are removed, to be
+    replicated again by the next sync. Returns the verified files by S3
+    path.
+    """
+    dynamodb_table = boto3.resource('dynamodb').Table(dynamodb_table)
+    multipart_uploads = dynamodb_table.get_item(
+        Key={
+            'product_key': product_key
+        },
+        ProjectionExpression='multipart_uploads',
+        ConsistentRead=True
+    ).get('Item', {}).get('multipart_uploads', {})
+
+    verified_digests = {}
+    for s3_file_path, multipart_upload in multipart_uploads.items():
+        s3_client = boto3.client('s3')
+        parts = []
+        for page in s3_client.get_paginator('list_parts').paginate(
+                Bucket=s3_bucket,
+                Key=s3_file_path,
+                UploadId=multipart_upload['upload_id']):
+            parts.extend(
+                {'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+                for part in page.get('Parts', [])
+            )
+        if len(parts) != int(multipart_upload['part_count']):
+            print(
+                "ERROR: " +
+                multipart_upload['url'] +
+                " is missing parts: expected " +
+                str(multipart_upload['part_count']) +
+                ", got " +
+                str(len(parts))
+            )
+            s3_client.abort_multipart_upload(
+                Bucket=s3_bucket,
+                Key=s3_file_path,
+                UploadId=multipart_upload['upload_id']
+            )
+        else:
+            s3_client.complete_multipart_upload(
+                Bucket=s3_bucket,
+                Key=s3_file_path,
+                UploadId=multipart_upload['upload_id'],
+                MultipartUpload={
+                    'Parts': sorted(parts, key=lambda part: part['PartNumber'])
+                }
+            )
+            hashing_reader = anejocommon.HashingReader(
+                s3_client.get_object(Bucket=s3_bucket, Key=s3_file_path)['Body'],
+                multipart_upload['expected_size'],
+                multipart_upload.get('expected_digest')
+            )
+            try:
+                while hashing_reader.read(8388608):
+                    pass
+                if not multipart_upload.get('expected_digest'):
+                    anejocommon.store_object_digests(s3_file_path, s3_bucket, hashing_reader.digests())
+                verified_digests[s3_file_path] = hashing_reader.digests()
+            except anejocommon.IntegrityError as e:
+                print("ERROR: " + multipart_upload['url'] + " failed verification: " + str(e))
+                s3_client.delete_object(Bucket=s3_bucket, Key=s3_file_path)
+        dynamodb_table.update_item(
+            Key={
+                'product_key': product_key
+            },
+            UpdateExpression="REMOVE multipart_uploads.#path",
+            ExpressionAttributeNames={
+                '#path': s3_file_path
+            }
+        )
+    return verified_digests
+
+
+def get_verified_packages(product_key, dynamodb_table):
+    """Return the verified packages of a product from DynamoDB."""
+    try:
+        return boto3.resource('dynamodb').Table(dynamodb_table).get_item(
+            Key={
+                'product_key': product_key
+            },
+            ProjectionExpression='verified_packages'
+        )['Item'].get('verified_packages', {})
+    except (ClientError, KeyError):
+        return {}
+
+
+def update_verified_packages(product_key, verified_packages, dynamodb_table):
+    """Record newly verified packages of a product in DynamoDB.
+
+    Each package is set individually, so concurrent download tasks of the
+    same product do not overwrite each other.
+    """
+    if not verified_packages:
+        return
+    dynamodb_table = boto3.resource('dynamodb').Table(dynamodb_table)
+    try:
+        dynamodb_table.update_item(
+            Key={
+                'product_key': product_key
+            },
+            UpdateExpression="SET verified_packages = if_not_exists(verified_packages, :empty_map)",
+            ExpressionAttributeValues={
+                ':empty_map': {}
+            }
+        )
+        update_expression = []
+        expression_attribute_names = {}
+        expression_attribute_values = {}
+        for i, s3_file_path in enumerate(verified_packages.keys()):
+            update_expression.append('verified_packages.#p' + str(i) + ' = :p' + str(i))
+            expression_attribute_names['#p' + str(i)] = s3_file_path
+            expression_attribute_values[':p' + str(i)] = verified_packages[s3_file_path]
+        dynamodb_table.update_item(
+            Key={
+                'product_key': product_key
+            },
+            UpdateExpression='SET ' + ', '.join(update_expression),
+            ExpressionAttributeNames=expression_attribute_names,
+            ExpressionAttributeValues=expression_attribute_values
+        )
+    except ClientError as e:
+        print("ERROR: Could not update verified packages")
+        print(str(e))
+
+
+def get_pruned_localizations(catalog_entry, prefs):
+    """Return the localizations to mirror, or None to mirror all of them."""
+    if not prefs.get('LocalizationPruning'):
+        return None
+    return anejocommon.get_mirrored_localizations(
+        catalog_entry.get('Distributions', {}),
+        prefs.get('PreferredLocalizations')
+    )
+
+
+def register_lazy_product(catalog_entry, package_fetch_table, localizations=None):
+    """Register a product's URLs (with Size/Digest) to be mirrored on first client request."""
+    for download in get_product_downloads(catalog_entry, localizations):
+        anejocommon.register_lazy_url(
+            download['url'],
+            package_fetch_table,
+            download.get('Size'),
+            download.get('Digest')
+        )
+
+
+def write_product_status(product_key, s3_bucket, status_path='metadata/DownloadStatus'):
+    """Write a product status marker to an S3 bucket."""
+    boto3.client('s3').put_object(
+        Body='',
+        Bucket=s3_bucket,
+        Key=os.path.join(status_path, product_key)
+    )
+
+
+def delete_product_status(product_key, s3_bucket, status_path='metadata/PendingDownload'):
+    """Delete a product status marker from an S3 bucket."""
+    boto3.client('s3').delete_object(
+        Bucket=s3_bucket,
+        Key=os.path.join(status_path, product_key)
+    )
+
+
+def get_download_lane(product_key, post_date, prefs, catalog_members_table):
+    """Return the download lane ('priority' or 'standard') for a product.
+
+    Products pinned by an operator, in a priority branch, or recently posted
+    by Apple are downloaded from the priority lane.
+    """
+    if product_key in (prefs.get('PinnedProducts') or []):
+        return 'priority'
+
+    try:
+        post_date = datetime.datetime.strptime(str(post_date)[0:19], '%Y-%m-%d %H:%M:%S')
+        recent_days = int(prefs.get('PriorityPostDateDays') or 0)
+        if datetime.datetime.utcnow() - post_date <= datetime.timedelta(days=recent_days):
+            return 'priority'
+    except ValueError:
+        pass
+
+    for catalog_branch in prefs.get('PriorityBranches') or []:
+        branch_member = boto3.resource('dynamodb').Table(catalog_members_table).get_item(
+            Key={
+                'catalog_branch': catalog_branch,
+                'product_key': product_key
+            }
+        )
+        if 'Item' in branch_member:
+            return 'priority'
+
+    return 'standard'
+
+
+def send_download_tasks(product_key, run_time, tasks, product_sync_info, download_lane, dynamodb_table, queue_url):
+    """Register a product's pending download tasks and send them to the download queue."""
+    task_ids = [str(run_time) + '-' + str(i) for i in range(len(tasks))]
+    boto3.resource('dynamodb').Table(dynamodb_table).update_item(
+        Key={
+            'product_key': product_key
+        },
+        UpdateExpression="SET pending_download_tasks = :task_ids",
+        ExpressionAttributeValues={
+            ':task_ids': set(task_ids)
+        }
+    )
+
+    for task_id, (estimated_seconds, downloads) in zip(task_ids, tasks):
+        event_data = {
+            'download_task': task_id,
+            'product_key': product_key,
+            'run_time': run_time,
+            'downloads': downloads,
+            'estimated_seconds': int(estimated_seconds),
+            'download_lane': download_lane,
+            'fast_scan': product_sync_info.get('fast_scan', True),
+            'verify_scan': product_sync_info.get('verify_scan', False),
+            'two_phase_sync': product_sync_info.get('two_phase_sync', False)
+        }
+        anejocommon.send_to_queue(event_data, queue_url)
+    return task_ids
+
+
+def complete_download_task(product_key, task_id, dynamodb_table):
+    """Mark a download task done; return True if it was the product's last one."""
+    try:
+        request = boto3.resource('dynamodb').Table(dynamodb_table).update_item(
+            Key={
+                'product_key': product_key
+            },
+            UpdateExpression="DELETE pending_download_tasks :task_id",
+            ExpressionAttributeValues={
+                ':task_id': set([task_id]),
+                ':task_id_str': task_id
+            },
+            ConditionExpression='contains(pending_download_tasks, :task_id_str)',
+            ReturnValues='UPDATED_NEW'
+        )
+    except ClientError as e:
+        # Task already completed (e.g. redelivered message)
+        if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+            return False
+        raise
+    return not request.get('Attributes', {}).get('pending_download_tasks')
+
+
+def complete_product_download(product_key, s3_bucket, product_info_table, write_catalog_queue_url, rebuild_catalogs=False, replication_ledger_table=None, rebuild_delay=0):
+    """Mark a product as downloaded, optionally rebuilding affected catalogs.
+
+    Only the catalogs the product currently belongs to are rewritten. With a
+    replication ledger, rebuilds requested by products finishing within
+    rebuild_delay of each other are coalesced into one per catalog.
+    """
+    write_product_status(product_key, s3_bucket)
+    delete_product_status(product_key, s3_bucket)
+    if not rebuild_catalogs:
+        return
+
+    try:
+        product_info = boto3.resource('dynamodb').Table(product_info_table).get_item(
+            Key={
+                'product_key': product_key
+            },
+            ProjectionExpression='AppleCatalogs'
+        )['Item']
+    except (ClientError, KeyError) as e:
+        print("ERROR: Cannot retrieve catalogs for product " + product_key)
+        print(str(e))
+        return
+
+    for catalog_url in product_info.get('AppleCatalogs', []):
+        if replication_ledger_table:
+            anejocommon.request_coalesced_update(
+                'catalog/' + catalog_url,
+                {'catalog_url': catalog_url},
+                replication_ledger_table,
+                write_catalog_queue_url,
+                rebuild_delay
+            )
+        else:
+            anejocommon.send_to_queue({'catalog_url': catalog_url}, write_catalog_queue_url)
+
+
+
 ### HANDLER FUNCTION ###
 
 def lambda_handler(event, context):
@@ -353,6 +939,20 @@ def lambda_handler(event, context):
     # Environmental Variables
     PRODUCT_INFO_TABLE = anejocommon.set_env_var('PRODUCT_INFO_TABLE')
     S3_BUCKET = anejocommon.set_env_var('S3_BUCKET')
+    PRODUCT_DOWNLOAD_QUEUE_URL = anejocommon.set_env_var('PRODUCT_DOWNLOAD_QUEUE_URL')
+    PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL = anejocommon.set_env_var('PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL')
+    CATALOG_MEMBERS_TABLE = anejocommon.set_env_var('CATALOG_MEMBERS_TABLE')
+    APPLE_CATALOG_PRODUCTS_TABLE = anejocommon.set_env_var('APPLE_CATALOG_PRODUCTS_TABLE')
+    PRODUCT_SEARCH_TABLE = anejocommon.set_env_var('PRODUCT_SEARCH_TABLE')
+    WRITE_CATALOG_QUEUE_URL = anejocommon.set_env_var('WRITE_CATALOG_QUEUE_URL')
+    PACKAGE_FETCH_TABLE = anejocommon.set_env_var('PACKAGE_FETCH_TABLE')
+    REPLICATION_LEDGER_TABLE = anejocommon.set_env_var('REPLICATION_LEDGER_TABLE')
+    CATALOG_REBUILD_DELAY = anejocommon.set_env_var('CATALOG_REBUILD_DELAY', 60)
+    REPLICATION_RETRY_DELAY = anejocommon.set_env_var('REPLICATION_RETRY_DELAY', 60)
+    LISTING_UPDATE_DELAY = anejocommon.set_env_var('LISTING_UPDATE_DELAY', 300)
+    DOWNLOAD_TASK_SECONDS = float(anejocommon.set_env_var('DOWNLOAD_TASK_SECONDS', 600))
+    DOWNLOAD_THROUGHPUT = float(anejocommon.set_env_var('DOWNLOAD_THROUGHPUT', 20971520))
+    DOWNLOAD_REQUEST_OVERHEAD = float(anejocommon.set_env_var('DOWNLOAD_REQUEST_OVERHEAD', 1))
 
     # Loop through event records
     try:
@@ -360,17 +960,97 @@ def lambda_handler(event, context):
     except KeyError:
         event_records = [{'body': event}]
 
+    # Read preferences once for every record of the invocation
+    prefs = None
+
     for record in event_records:
         try:
             product_sync_info = json.loads(record['body'])
         except TypeError:
             product_sync_info = record['body']
 
+        # Download task (part of a product's files)
+        if 'download_task' in product_sync_info:
+            product_key = product_sync_info['product_key']
+            task_id = product_sync_info['download_task']
+            print(
+                "Running download task " +
+                task_id +
+                " for product " +
+                product_key +
+                " (" +
+                product_sync_info.get('download_lane', 'standard') +
+                " lane, estimated " +
+                str(product_sync_info.get('estimated_seconds')) +
+                " seconds)"
+            )
+            previously_verified_packages = get_verified_packages(product_key, PRODUCT_INFO_TABLE)
+            verified_packages, deferred_downloads = replicate_downloads(
+                [download for download in product_sync_info['downloads'] if 'Range' not in download],
+                S3_BUCKET,
+                product_sync_info.get('fast_scan', True),
+                product_sync_info.get('verify_scan', False),
+                previously_verified_packages,
+                product_sync_info.get('run_time'),
+                REPLICATION_LEDGER_TABLE
+            )
+            update_verified_packages(product_key, verified_packages, PRODUCT_INFO_TABLE)
+            # Ranges of files split across tasks
+            replicate_download_ranges(
+                product_key,
+                [download for download in product_sync_info['downloads'] if 'Range' in download],
+                S3_BUCKET,
+                product_sync_info.get('fast_scan', True),
+                previously_verified_packages,
+                PRODUCT_INFO_TABLE
+            )
+            if deferred_downloads:
+                # Retry files other workers are replicating once they are done,
+                # instead of waiting on their transfers
+                print(
+                    "Deferring " +
+                    str(len(deferred_downloads)) +
+                    " files of task " +
+                    task_id +
+                    " being replicated by another worker"
+                )
+                if product_sync_info.get('download_lane') == 'priority':
+                    retry_queue_url = PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL
+                else:
+                    retry_queue_url = PRODUCT_DOWNLOAD_QUEUE_URL
+                retry_task = dict(product_sync_info)
+                retry_task['downloads'] = deferred_downloads
+                anejocommon.send_to_queue(retry_task, retry_queue_url, REPLICATION_RETRY_DELAY)
+                continue
+            if complete_download_task(product_key, task_id, PRODUCT_INFO_TABLE):
+                update_verified_packages(
+                    product_key,
+                    complete_multipart_replications(product_key, S3_BUCKET, PRODUCT_INFO_TABLE),
+                    PRODUCT_INFO_TABLE
+                )
+                # Products published early are rebuilt with mirrored URLs
+                complete_product_download(
+                    product_key,
+                    S3_BUCKET,
+                    PRODUCT_INFO_TABLE,
+                    WRITE_CATALOG_QUEUE_URL,
+                    product_sync_info.get('two_phase_sync', False),
+                    REPLICATION_LEDGER_TABLE,
+                    CATALOG_REBUILD_DELAY
+                )
+            continue
+
+        if prefs is None:
+            prefs = anejocommon.get_prefs(S3_BUCKET)
+
         # Event Variables
         catalog_url = product_sync_info['catalog_url']
         run_time = product_sync_info['run_time']
         download_packages = product_sync_info.get('download_packages', False)
         fast_scan = product_sync_info.get('fast_scan', True)
+        verify_scan = product_sync_info.get('verify_scan', False)
+        two_phase_sync = product_sync_info.get('two_phase_sync', False)
+        lazy_packages = product_sync_info.get('lazy_packages', False)
         product_key = product_sync_info['product_key']
         product_info = anejocommon.uncompress_dict(product_sync_info['product_info'])
 
@@ -380,7 +1060,8 @@ def lambda_handler(event, context):
             product_key,
             run_time,
             catalog_url,
-            PRODUCT_INFO_TABLE
+            PRODUCT_INFO_TABLE,
+            APPLE_CATALOG_PRODUCTS_TABLE
         )
 
         try:
@@ -395,27 +1076,16 @@ def lambda_handler(event, context):
             product['AppleCatalogs'] = set([catalog_url])
             product['CatalogEntry'] = product_info
 
-            if download_packages and ('ServerMetadataURL' in product['CatalogEntry']):
-                unused_path = anejocommon.replicate_url_to_bucket(
-                    product['CatalogEntry']['ServerMetadataURL'],
-                    S3_BUCKET,
-                    copy_only_if_missing=fast_scan
+            # Only mirror the preferred localizations if pruning is enabled
+            localizations = get_pruned_localizations(product['CatalogEntry'], prefs)
+
+            if lazy_packages and not download_packages:
+                # Packages are mirrored the first time a client requests them
+                register_lazy_product(
+                    product['CatalogEntry'],
+                    PACKAGE_FETCH_TABLE,
+                    localizations
                 )
-            
-            if download_packages:
-                for package in product['CatalogEntry'].get('Packages', []):
-                    if 'URL' in package:
-                        unused_path = anejocommon.replicate_url_to_bucket(
-                            package['URL'],
-                            S3_BUCKET,
-                            copy_only_if_missing=fast_scan
-                        )
-                    if 'MetadataURL' in package:
-                        unused_path = anejocommon.replicate_url_to_bucket(
-                            package['MetadataURL'],
-                            S3_BUCKET,
-                            copy_only_if_missing=fast_scan
-                        )
 
             # Calculate total size
             size = 0
@@ -426,20 +1096,21 @@ def lambda_handler(event, context):
             distributions = product['CatalogEntry']['Distributions']
             preferred_lang = get_preferred_localization(
                 distributions.keys(),
-                S3_BUCKET
+                prefs
             )
             preferred_dist = None
 
-            for dist_lang in distributions.keys():
-                dist_url = distributions[dist_lang]
-                if (download_packages or dist_lang == preferred_lang):
-                    dist_path = anejocommon.replicate_url_to_bucket(
-                        dist_url,
-                        S3_BUCKET,
-                        copy_only_if_missing=fast_scan
-                    )
-                    if dist_lang == preferred_lang:
-                        preferred_dist = anejocommon.retrieve_url(dist_url).data
+            if preferred_lang:
+                dist_url = distributions[preferred_lang]
+                dist_path = replicate_url(
+                    dist_url,
+                    S3_BUCKET,
+                    run_time,
+                    REPLICATION_LEDGER_TABLE,
+                    copy_only_if_missing=fast_scan,
+                    verify=verify_scan
+                )
+                preferred_dist = anejocommon.retrieve_url_cached(dist_url)
 
             if not preferred_dist:
                 print("ERROR: No usable .dist file found")
@@ -465,13 +1136,90 @@ def lambda_handler(event, context):
                 PRODUCT_INFO_TABLE
             )
 
-            # Write download status
-            boto3.client('s3').put_object(
-                Body='',
-                Bucket=S3_BUCKET,
-                Key=os.path.join('metadata/DownloadStatus', product_key)
-            )
+            # Relist products once the run's metadata changes settle
+            if request and 'Attributes' in request and WRITE_CATALOG_QUEUE_URL:
+                try:
+                    anejocommon.request_product_listing_update(
+                        WRITE_CATALOG_QUEUE_URL,
+                        LISTING_UPDATE_DELAY,
+                        REPLICATION_LEDGER_TABLE
+                    )
+                except ClientError as e:
+                    print("ERROR: Cannot queue product listing update")
+                    print(str(e))
+
+            # Products found in a catalog are not deprecated
+            if PRODUCT_SEARCH_TABLE:
+                try:
+                    anejocommon.update_product_search_index(
+                        product_key,
+                        PRODUCT_INFO_TABLE,
+                        PRODUCT_SEARCH_TABLE
+                    )
+                except ClientError as e:
+                    print("ERROR: Could not update search index")
+                    print(str(e))
+
+            if localizations is not None and (download_packages or lazy_packages):
+                pruned_count = len(distributions) - len(localizations)
+                if pruned_count:
+                    # Pruned .dist files are never fetched, so their sizes are
+                    # unknown; estimate them from the preferred .dist file
+                    print(
+                        "Pruned " +
+                        str(pruned_count) +
+                        " localizations of product " +
+                        product_key +
+                        " (saved " +
+                        str(pruned_count * 2) +
+                        " requests, an estimated " +
+                        str(pruned_count * len(preferred_dist)) +
+                        " bytes at " +
+                        str(len(preferred_dist)) +
+                        " bytes per .dist file)"
+                    )
+
+            if download_packages:
+                # Split the product's files into download tasks sized by
+                # their catalog Size to fit each download invocation
+                tasks = plan_download_tasks(
+                    get_product_downloads(product['CatalogEntry'], localizations),
+                    DOWNLOAD_TASK_SECONDS,
+                    DOWNLOAD_THROUGHPUT,
+                    DOWNLOAD_REQUEST_OVERHEAD
+                )
+                if not tasks:
+                    write_product_status(product_key, S3_BUCKET)
+                    continue
+                if two_phase_sync:
+                    # Publish with Apple's URLs now, back-fill packages afterwards
+                    write_product_status(product_key, S3_BUCKET, 'metadata/PendingDownload')
+
+                # Recent, pinned, and branch products skip the standard lane
+                download_lane = get_download_lane(
+                    product_key,
+                    product['PostDate'],
+                    prefs,
+                    CATALOG_MEMBERS_TABLE
+                )
+                if download_lane == 'priority':
+                    download_queue_url = PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL
+                else:
+                    download_queue_url = PRODUCT_DOWNLOAD_QUEUE_URL
+                send_download_tasks(
+                    product_key,
+                    run_time,
+                    tasks,
+                    product_sync_info,
+                    download_lane,
+                    PRODUCT_INFO_TABLE,
+                    download_queue_url
+                )
+            else:
+                # Write download status
+                write_product_status(product_key, S3_BUCKET)
 
+    print("/tmp cache stats: " + json.dumps(anejocommon.get_tmp_cache_stats()))
 
 
 if __name__ == "__main__":
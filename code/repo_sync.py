@@ -36,6 +36,8 @@ AWS Lambda function that syncs the Anejo (Reposado) repo by replicating Apple
 SUS catalogs and (optionally) packages to an S3 bucket.
 
 Sends the URL of each ASUS catalog to the catalog_sync Lambda function queue.
+With a replication ledger, the last catalog_sync to finish requests a build
+of all the catalogs; otherwise the build is sent with a fixed delay.
 
 
 Author:  Jacob F. Grant
@@ -51,18 +53,29 @@ import anejocommon
 
 ### Functions ###
 
-def catalog_sync(catalog_url, run_time, download_packages, fast_scan, catalog_queue_url):
+def catalog_sync(catalog_url, run_time, download_packages, fast_scan, verify_scan, two_phase_sync, lazy_packages, catalog_queue_url, write_catalogs=False):
     """Send event data to catalog_sync queue."""
     event_data = {
         'catalog_url': catalog_url,
         'run_time': run_time,
         'download_packages': download_packages,
-        'fast_scan': fast_scan
+        'fast_scan': fast_scan,
+        'verify_scan': verify_scan,
+        'two_phase_sync': two_phase_sync,
+        'lazy_packages': lazy_packages,
+        'write_catalog': False,
+        'write_catalogs': write_catalogs
     }
     print(event_data)
     anejocommon.send_to_queue(event_data, catalog_queue_url)
 
 
+def write_catalogs(catalog_urls, queue_url, delay=0):
+    """Send event data to write_local_catalog queue (all catalogs in one build)."""
+    event_data = {'catalog_urls': catalog_urls}
+    return anejocommon.send_to_queue(event_data, queue_url, delay)
+
+
 
 ### HANDLER FUNCTION ###
 
@@ -71,6 +84,9 @@ def lambda_handler(event, context):
     # Environmental Variables
     S3_BUCKET = anejocommon.set_env_var('S3_BUCKET')
     CATALOG_QUEUE_URL = anejocommon.set_env_var('CATALOG_QUEUE_URL')
+    WRITE_CATALOG_QUEUE_URL = anejocommon.set_env_var('WRITE_CATALOG_QUEUE_URL')
+    WRITE_CATALOG_DELAY = anejocommon.set_env_var('WRITE_CATALOG_DELAY', 300)
+    REPLICATION_LEDGER_TABLE = anejocommon.set_env_var('REPLICATION_LEDGER_TABLE')
 
     # Event Variables
     try:
@@ -80,11 +96,18 @@ def lambda_handler(event, context):
 
     download_packages = event_info.get('download_packages', False)
     fast_scan = event_info.get('fast_scan', True)
+    verify_scan = event_info.get('verify_scan', False)
+    two_phase_sync = event_info.get('two_phase_sync', False)
+    lazy_packages = event_info.get('lazy_packages', False)
 
     # Other Variables
     run_time = int(time())
     catalog_urls = anejocommon.get_pref('AppleCatalogURLs', S3_BUCKET)
 
+    # The last catalog_sync of the run to finish writes all local catalogs
+    if REPLICATION_LEDGER_TABLE and catalog_urls:
+        anejocommon.start_catalog_sync_run(run_time, catalog_urls, REPLICATION_LEDGER_TABLE)
+
     # Sync catalogs (send to SQS queue)
     for catalog_url in catalog_urls:
         catalog_sync(
@@ -92,7 +115,19 @@ def lambda_handler(event, context):
             run_time,
             download_packages,
             fast_scan,
-            CATALOG_QUEUE_URL
+            verify_scan,
+            two_phase_sync,
+            lazy_packages,
+            CATALOG_QUEUE_URL,
+            bool(REPLICATION_LEDGER_TABLE)
+        )
+
+    # Without a ledger, write all local catalogs in one build after a delay
+    if not REPLICATION_LEDGER_TABLE:
+        write_catalogs(
+            catalog_urls,
+            WRITE_CATALOG_QUEUE_URL,
+            WRITE_CATALOG_DELAY
         )
 
 
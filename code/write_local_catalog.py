@@ -43,21 +43,179 @@ Author:  Jacob F. Grant
 Created: 01/06/19
 """
 
+from concurrent.futures import ThreadPoolExecutor
 import json
 import plistlib
+from time import time
+
+import boto3
+from botocore.exceptions import ClientError
 
 import anejocommon
 
 
 
+### Functions ###
+
+def write_catalog(catalog_url, s3_bucket, catalog_branches_table, product_info_table, build_state, index_date=None, catalog_sha256=None):
+    """Write the local and branch catalogs of an Apple catalog.
+
+    Returns the build time in seconds.
+    """
+    start_time = time()
+    apple_bucket_catalog_path = anejocommon.get_path_from_url(
+        catalog_url,
+        'html',
+        append_to_path='.apple'
+    )
+
+    # Use the catalog parsed and cached by catalog_sync if available
+    if not catalog_sha256:
+        index_date, catalog_sha256 = anejocommon.get_catalog_cache_key(
+            apple_bucket_catalog_path,
+            s3_bucket
+        )
+    catalog_cache = None
+    if catalog_sha256:
+        catalog_cache = anejocommon.read_catalog_cache(
+            apple_bucket_catalog_path,
+            index_date,
+            catalog_sha256,
+            s3_bucket
+        )
+    if catalog_cache:
+        anejocommon.write_local_catalogs(
+            apple_bucket_catalog_path,
+            catalog_cache['header'],
+            s3_bucket,
+            catalog_branches_table,
+            product_info_table,
+            catalog_cache['Products'].items(),
+            build_state
+        )
+        return time() - start_time
+
+    # Products are filtered as they are parsed from the catalog stream
+    catalog = anejocommon.retrieve_url(catalog_url)
+    catalog_plist = {}
+    try:
+        # Write our local (filtered) catalogs
+        anejocommon.write_local_catalogs(
+            apple_bucket_catalog_path,
+            catalog_plist,
+            s3_bucket,
+            catalog_branches_table,
+            product_info_table,
+            anejocommon.iter_catalog_products(
+                catalog.stream(65536),
+                catalog_plist
+            ),
+            build_state
+        )
+    finally:
+        catalog.release_conn()
+    return time() - start_time
+
+
+
+def rebuild_catalog_branches(local_catalog_path, s3_bucket, catalog_branches_table, product_info_table, build_state):
+    """Rebuild the branch catalogs of an already written local catalog."""
+    catalog_plist = anejocommon.read_plist_s3(local_catalog_path, s3_bucket)
+    if catalog_plist:
+        anejocommon.write_branch_catalogs(
+            local_catalog_path,
+            s3_bucket,
+            catalog_branches_table,
+            product_info_table,
+            catalog_plist,
+            build_state
+        )
+
+
+def rebuild_branch(catalog_branch, membership_revision, s3_bucket, catalog_branches_table, catalog_members_table, product_info_table, catalog_workers):
+    """Rebuild (or remove) one branch's catalogs from the local catalogs.
+
+    Skips the rebuild if the branch changed again since the message was
+    sent, since the message for that change will rebuild it.
+    """
+    branch = boto3.resource('dynamodb').Table(catalog_branches_table).get_item(
+        Key={
+            'catalog_branch': catalog_branch
+        },
+        ConsistentRead=True
+    ).get('Item')
+    local_catalog_paths = [
+        anejocommon.get_path_from_url(catalog_url, 'html')
+        for catalog_url in anejocommon.get_pref('AppleCatalogURLs', s3_bucket)
+    ]
+
+    # Branch deleted, remove its catalogs
+    if not branch:
+        for local_catalog_path in local_catalog_paths:
+            boto3.client('s3').delete_object(
+                Bucket=s3_bucket,
+                Key=anejocommon.get_branch_catalog_path(local_catalog_path, catalog_branch)
+            )
+        print("Removed catalogs of deleted branch " + catalog_branch)
+        return
+
+    if membership_revision is not None and int(branch.get('membership_revision', 0)) != int(membership_revision):
+        print("Skipping rebuild of branch " + catalog_branch + " (superseded by a newer change)")
+        return
+
+    anejocommon.check_branch_migrated(branch)
+    branch['product_keys'] = anejocommon.get_branch_product_keys(
+        catalog_branch,
+        catalog_members_table
+    )
+    build_state = anejocommon.load_catalog_build_state(
+        s3_bucket,
+        catalog_branches_table,
+        catalog_members_table,
+        catalog_branches=[branch]
+    )
+
+    with ThreadPoolExecutor(max_workers=catalog_workers) as executor:
+        for rebuild in [
+            executor.submit(
+                rebuild_catalog_branches,
+                local_catalog_path,
+                s3_bucket,
+                catalog_branches_table,
+                product_info_table,
+                build_state
+            )
+            for local_catalog_path in local_catalog_paths
+        ]:
+            rebuild.result()
+    print("Rebuilt catalogs of branch " + catalog_branch)
+
+
+
+def update_product_listing(s3_bucket, product_info_table):
+    """Rewrite the product listing snapshot served to GET /products"""
+    start_time = time()
+    try:
+        if anejocommon.write_product_listing(product_info_table, s3_bucket):
+            print("Wrote product listing in %.2f seconds" % (time() - start_time))
+    except ClientError as e:
+        print("WARNING: Cannot write product listing")
+        print(str(e))
+
+
+
 ### HANDLER FUNCTION ###
 
 def lambda_handler(event, context):
     """Handler function for AWS Lambda."""
     # Environmental Variables
     CATALOG_BRANCHES_TABLE = anejocommon.set_env_var('CATALOG_BRANCHES_TABLE')
+    CATALOG_MEMBERS_TABLE = anejocommon.set_env_var('CATALOG_MEMBERS_TABLE')
     PRODUCT_INFO_TABLE = anejocommon.set_env_var('PRODUCT_INFO_TABLE')
     S3_BUCKET = anejocommon.set_env_var('S3_BUCKET')
+    WRITE_CATALOG_WORKERS = int(anejocommon.set_env_var('WRITE_CATALOG_WORKERS', 4))
+    BRANCH_CATALOG_WORKERS = int(anejocommon.set_env_var('BRANCH_CATALOG_WORKERS', 8))
+    REPLICATION_LEDGER_TABLE = anejocommon.set_env_var('REPLICATION_LEDGER_TABLE')
 
     # Loop through event records
     try:
@@ -71,31 +229,85 @@ def lambda_handler(event, context):
         except TypeError:
             catalog_sync_info = record['body']
 
-        # Event Variables
-        catalog_url = catalog_sync_info['catalog_url']
+        # Coalesced update superseded by a newer request (which will run it)
+        if 'update_version' in catalog_sync_info and not anejocommon.is_latest_update(
+                catalog_sync_info['update_key'],
+                catalog_sync_info['update_version'],
+                REPLICATION_LEDGER_TABLE):
+            print("Skipping update " + catalog_sync_info['update_key'] + " (superseded by a newer request)")
+            continue
 
-        apple_bucket_catalog_path = anejocommon.get_path_from_url(
-            catalog_url,
-            'html',
-            append_to_path='.apple'
-        )
-        
-        catalog = anejocommon.retrieve_url(catalog_url)
-        try:
-            catalog_plist = plistlib.readPlistFromBytes(catalog.data)
-        except plistlib.InvalidFileException:
-            print("ERROR: Cannot read catalog plist")
-            return
+        # Branch membership change (sent by the catalogs API)
+        if 'catalog_branch' in catalog_sync_info:
+            start_time = time()
+            rebuild_branch(
+                catalog_sync_info['catalog_branch'],
+                catalog_sync_info.get('membership_revision'),
+                S3_BUCKET,
+                CATALOG_BRANCHES_TABLE,
+                CATALOG_MEMBERS_TABLE,
+                PRODUCT_INFO_TABLE,
+                WRITE_CATALOG_WORKERS
+            )
+            print("Branch rebuild took %.2f seconds" % (time() - start_time))
+            continue
 
-        # Write our local (filtered) catalogs
-        anejocommon.write_local_catalogs(
-            apple_bucket_catalog_path,
-            catalog_plist,
+        # Product metadata change (sent by product_sync and the products API)
+        if catalog_sync_info.get('product_listing'):
+            update_product_listing(S3_BUCKET, PRODUCT_INFO_TABLE)
+            continue
+
+        # Event Variables (one catalog, or all catalogs in one build)
+        if 'catalog_urls' in catalog_sync_info:
+            catalogs = [
+                (catalog_url, None, None)
+                for catalog_url in catalog_sync_info['catalog_urls']
+            ]
+        else:
+            catalogs = [
+                (
+                    catalog_sync_info['catalog_url'],
+                    catalog_sync_info.get('index_date'),
+                    catalog_sync_info.get('catalog_sha256')
+                )
+            ]
+
+        # Load download status, branches, and prefs once for all catalogs
+        start_time = time()
+        build_state = anejocommon.load_catalog_build_state(
             S3_BUCKET,
             CATALOG_BRANCHES_TABLE,
-            PRODUCT_INFO_TABLE
+            CATALOG_MEMBERS_TABLE,
+            BRANCH_CATALOG_WORKERS
         )
 
+        with ThreadPoolExecutor(max_workers=WRITE_CATALOG_WORKERS) as executor:
+            builds = [
+                (
+                    catalog_url,
+                    executor.submit(
+                        write_catalog,
+                        catalog_url,
+                        S3_BUCKET,
+                        CATALOG_BRANCHES_TABLE,
+                        PRODUCT_INFO_TABLE,
+                        build_state,
+                        index_date,
+                        catalog_sha256
+                    )
+                )
+                for catalog_url, index_date, catalog_sha256 in catalogs
+            ]
+
+        for catalog_url, build in builds:
+            try:
+                print("Built " + catalog_url + " in %.2f seconds" % build.result())
+            except plistlib.InvalidFileException:
+                print("ERROR: Cannot read catalog plist " + catalog_url)
+        print("Built " + str(len(builds)) + " catalogs in %.2f seconds" % (time() - start_time))
+
+    print("/tmp cache stats: " + json.dumps(anejocommon.get_tmp_cache_stats()))
+
 
 
 if __name__ == "__main__":
@@ -22,7 +22,14 @@ resource "aws_api_gateway_deployment" "prod_deployment" {
     "aws_api_gateway_integration.anejo_api_catalogs_catalog_post_lambda_integration",
     "aws_api_gateway_integration.anejo_api_catalogs_catalog_product_delete_lambda_integration",
     "aws_api_gateway_integration.anejo_api_catalogs_catalog_product_post_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_catalogs_catalog_products_delete_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_catalogs_catalog_products_post_lambda_integration",
     "aws_api_gateway_integration.anejo_api_catalogs_catalog_copy_source_post_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_catalogs_catalog_snapshots_get_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_catalogs_catalog_snapshots_post_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_catalogs_catalog_snapshots_snapshot_get_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_catalogs_catalog_snapshots_snapshot_delete_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_catalogs_catalog_snapshots_snapshot_post_lambda_integration",
     "aws_api_gateway_integration.anejo_api_prefs_lambda_integration",
     "aws_api_gateway_integration.anejo_api_prefs_pref_get_lambda_integration",
     "aws_api_gateway_integration.anejo_api_prefs_pref_delete_lambda_integration",
@@ -30,7 +37,11 @@ resource "aws_api_gateway_deployment" "prod_deployment" {
     "aws_api_gateway_integration.anejo_api_products_lambda_integration",
     "aws_api_gateway_integration.anejo_api_products_product_get_lambda_integration",
     "aws_api_gateway_integration.anejo_api_products_product_delete_lambda_integration",
-    "aws_api_gateway_integration.anejo_api_sync_lambda_integration"
+    "aws_api_gateway_integration.anejo_api_products_product_catalogs_get_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_products_batch_post_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_sync_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_sync_get_lambda_integration",
+    "aws_api_gateway_integration.anejo_api_fetch_proxy_get_lambda_integration"
   ]
 }
 
@@ -0,0 +1,54 @@
+### Anejo – API Gateway – Resource /fetch/{proxy+} ###
+
+## API Gateway Resource /fetch ##
+
+# API Gateway Resource
+resource "aws_api_gateway_resource" "anejo_api_fetch_resource" {
+  rest_api_id = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
+  parent_id   = "${aws_api_gateway_rest_api.anejo_api_gateway.root_resource_id}"
+  path_part   = "fetch"
+}
+
+
+
+## API Gateway Resource /fetch/{proxy+} ##
+
+# API Gateway Resource
+resource "aws_api_gateway_resource" "anejo_api_fetch_proxy_resource" {
+  rest_api_id = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
+  parent_id   = "${aws_api_gateway_resource.anejo_api_fetch_resource.id}"
+  path_part   = "{proxy+}"
+}
+
+
+
+## API Gateway Resource /fetch/{proxy+} – GET Method ##
+
+# API Gateway Method (GET)
+resource "aws_api_gateway_method" "anejo_api_fetch_proxy_get_method" {
+  rest_api_id   = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
+  resource_id   = "${aws_api_gateway_resource.anejo_api_fetch_proxy_resource.id}"
+  http_method   = "GET"
+  authorization = "NONE"
+}
+
+
+# API Gateway Lambda Proxy Integration (GET) – Anejo Package Fetch Lambda function
+resource "aws_api_gateway_integration" "anejo_api_fetch_proxy_get_lambda_integration" {
+  rest_api_id             = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
+  resource_id             = "${aws_api_gateway_resource.anejo_api_fetch_proxy_resource.id}"
+  http_method             = "${aws_api_gateway_method.anejo_api_fetch_proxy_get_method.http_method}"
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = "arn:aws:apigateway:${var.aws_region}:lambda:path/2015-03-31/functions/${aws_lambda_function.anejo_package_fetch.arn}/invocations"
+}
+
+
+# API Gateway Lambda Permission (GET) – Anejo Package Fetch Lambda function
+resource "aws_lambda_permission" "anejo_api_fetch_proxy_get_lambda_permission" {
+  statement_id_prefix  = "AllowAPIGatewayInvoke"
+  action               = "lambda:InvokeFunction"
+  function_name        = "${aws_lambda_function.anejo_package_fetch.arn}"
+  principal            = "apigateway.amazonaws.com"
+  source_arn           = "${aws_api_gateway_rest_api.anejo_api_gateway.execution_arn}/*/GET/fetch/*"
+}
@@ -17,19 +17,14 @@ resource "aws_api_gateway_method" "anejo_api_products_get" {
 }
 
 
-# API Gateway Lambda Integration - /products
+# API Gateway Lambda Proxy Integration - /products
 resource "aws_api_gateway_integration" "anejo_api_products_lambda_integration" {
   rest_api_id             = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
   resource_id             = "${aws_api_gateway_resource.anejo_api_products_resource.id}"
   http_method             = "${aws_api_gateway_method.anejo_api_products_get.http_method}"
   integration_http_method = "POST"
-  type                    = "AWS"
+  type                    = "AWS_PROXY"
   uri                     = "arn:aws:apigateway:${var.aws_region}:lambda:path/2015-03-31/functions/${aws_lambda_function.anejo_api_products.arn}/invocations"
-
-  passthrough_behavior = "WHEN_NO_TEMPLATES"
-  request_templates    = {
-    "application/json" = "${local.json_request_template}"
-  }
 }
 
 
@@ -41,45 +36,3 @@ resource "aws_lambda_permission" "anejo_api_products_lambda_permission" {
   principal            = "apigateway.amazonaws.com"
   source_arn           = "${aws_api_gateway_rest_api.anejo_api_gateway.execution_arn}/*/GET/products"
 }
-
-
-# API Gateway Method Response (200) - /products
-resource "aws_api_gateway_method_response" "api_products_http_200_response" {
-  rest_api_id = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
-  resource_id = "${aws_api_gateway_resource.anejo_api_products_resource.id}"
-  http_method = "${aws_api_gateway_method.anejo_api_products_get.http_method}"
-  status_code = "200"
-}
-
-
-# API Gateway Lambda Integration Response (200) - /products
-resource "aws_api_gateway_integration_response" "api_products_http_200_lambda_response" {
-  rest_api_id = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
-  resource_id = "${aws_api_gateway_resource.anejo_api_products_resource.id}"
-  http_method = "${aws_api_gateway_method.anejo_api_products_get.http_method}"
-  status_code = "${aws_api_gateway_method_response.api_products_http_200_response.status_code}"
-
-  depends_on  = ["aws_api_gateway_integration.anejo_api_products_lambda_integration"]
-}
-
-
-# API Gateway Method Response (500) - /products
-resource "aws_api_gateway_method_response" "api_products_http_500_response" {
-  rest_api_id = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
-  resource_id = "${aws_api_gateway_resource.anejo_api_products_resource.id}"
-  http_method = "${aws_api_gateway_method.anejo_api_products_get.http_method}"
-  status_code = "500"
-}
-
-
-# API Gateway Lambda Integration Response (500) - /products
-resource "aws_api_gateway_integration_response" "api_products_http_500_lambda_response" {
-  rest_api_id = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
-  resource_id = "${aws_api_gateway_resource.anejo_api_products_resource.id}"
-  http_method = "${aws_api_gateway_method.anejo_api_products_get.http_method}"
-  status_code = "${aws_api_gateway_method_response.api_products_http_500_response.status_code}"
-
-  selection_pattern = "${var.anejo_http_500_response_pattern}"
-
-  depends_on  = ["aws_api_gateway_integration.anejo_api_products_lambda_integration"]
-}
@@ -83,3 +83,33 @@ resource "aws_api_gateway_integration_response" "api_sync_http_500_lambda_respon
 
   depends_on  = ["aws_api_gateway_integration.anejo_api_sync_lambda_integration"]
 }
+
+
+# API Gateway Method - /sync (GET)
+resource "aws_api_gateway_method" "anejo_api_sync_get" {
+  rest_api_id   = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
+  resource_id   = "${aws_api_gateway_resource.anejo_api_sync_resource.id}"
+  http_method   = "GET"
+  authorization = "NONE"
+}
+
+
+# API Gateway Lambda Proxy Integration - /sync (GET)
+resource "aws_api_gateway_integration" "anejo_api_sync_get_lambda_integration" {
+  rest_api_id             = "${aws_api_gateway_rest_api.anejo_api_gateway.id}"
+  resource_id             = "${aws_api_gateway_resource.anejo_api_sync_resource.id}"
+  http_method             = "${aws_api_gateway_method.anejo_api_sync_get.http_method}"
+  integration_http_method = "POST"
+  type                    = "AWS_PROXY"
+  uri                     = "arn:aws:apigateway:${var.aws_region}:lambda:path/2015-03-31/functions/${aws_lambda_function.anejo_api_sync.arn}/invocations"
+}
+
+
+# API Gateway Lambda Permission - /sync (GET)
+resource "aws_lambda_permission" "anejo_api_sync_get_lambda_permission" {
+  statement_id  = "AllowAPIGatewayInvokeGet"
+  action        = "lambda:InvokeFunction"
+  function_name = "${aws_lambda_function.anejo_api_sync.arn}"
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "${aws_api_gateway_rest_api.anejo_api_gateway.execution_arn}/*/GET/sync"
+}
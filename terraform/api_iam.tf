@@ -67,10 +67,20 @@ resource "aws_iam_role_policy" "anejo_api_dynamodb_iam_policy" {
                 "dynamodb:GetItem",
                 "dynamodb:DeleteItem",
                 "dynamodb:Scan",
+                "dynamodb:Query",
+                "dynamodb:BatchGetItem",
+                "dynamodb:BatchWriteItem",
+                "dynamodb:ConditionCheckItem",
                 "dynamodb:UpdateItem"
             ],
             "Resource": [
                 "${aws_dynamodb_table.anejo_catalog_branches_metadata.arn}",
+                "${aws_dynamodb_table.anejo_catalog_branch_members.arn}",
+                "${aws_dynamodb_table.anejo_catalog_branch_members.arn}/index/*",
+                "${aws_dynamodb_table.anejo_catalog_branch_changes.arn}",
+                "${aws_dynamodb_table.anejo_apple_catalog_products.arn}",
+                "${aws_dynamodb_table.anejo_apple_catalog_products.arn}/index/*",
+                "${aws_dynamodb_table.anejo_product_search.arn}",
                 "${aws_dynamodb_table.anejo_product_info_metadata.arn}"
             ]
         },
@@ -117,6 +127,42 @@ EOF
 }
 
 
+# IAM Policy – SQS
+resource "aws_iam_role_policy" "anejo_api_sqs_iam_policy" {
+  name   = "AnejoAPISQSPolicy${local.name_extension}"
+  role   = "${aws_iam_role.anejo_api_iam_role.id}"
+
+  policy = <<EOF
+{
+    "Version": "2012-10-17",
+    "Statement": [
+        {
+            "Sid": "VisualEditor0",
+            "Effect": "Allow",
+            "Action": "sqs:GetQueueAttributes",
+            "Resource": [
+                "${aws_sqs_queue.anejo_product_sync_download_queue.arn}",
+                "${aws_sqs_queue.anejo_product_sync_priority_download_queue.arn}"
+            ]
+        },
+        {
+            "Sid": "VisualEditor1",
+            "Effect": "Allow",
+            "Action": "sqs:SendMessage",
+            "Resource": "${aws_sqs_queue.anejo_write_local_catalog_queue.arn}"
+        },
+        {
+            "Sid": "VisualEditor2",
+            "Effect": "Allow",
+            "Action": "cloudwatch:GetMetricStatistics",
+            "Resource": "*"
+        }
+    ]
+}
+EOF
+}
+
+
 # IAM Policy – S3
 resource "aws_iam_role_policy" "anejo_api_s3_iam_policy" {
   name   = "AnejoAPIS3Policy${local.name_extension}"
@@ -14,9 +14,14 @@ resource "aws_lambda_function" "anejo_api_catalogs" {
 
   environment {
     variables = {
-      CATALOG_BRANCHES_TABLE = "${aws_dynamodb_table.anejo_catalog_branches_metadata.id}",
-      PRODUCT_INFO_TABLE     = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
-      S3_BUCKET              = "${aws_s3_bucket.anejo_repo_bucket.id}"
+      CATALOG_BRANCHES_TABLE  = "${aws_dynamodb_table.anejo_catalog_branches_metadata.id}",
+      CATALOG_MEMBERS_TABLE   = "${aws_dynamodb_table.anejo_catalog_branch_members.id}",
+      CATALOG_CHANGES_TABLE   = "${aws_dynamodb_table.anejo_catalog_branch_changes.id}",
+      PRODUCT_INFO_TABLE      = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
+      PRODUCT_SEARCH_TABLE    = "${aws_dynamodb_table.anejo_product_search.id}",
+      S3_BUCKET               = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      WRITE_CATALOG_QUEUE_URL = "${aws_sqs_queue.anejo_write_local_catalog_queue.id}",
+      BRANCH_REBUILD_DELAY    = "${var.anejo_branch_rebuild_delay}"
     }
   }
 
@@ -55,9 +60,15 @@ resource "aws_lambda_function" "anejo_api_products" {
 
   environment {
     variables = {
-      CATALOG_BRANCHES_TABLE = "${aws_dynamodb_table.anejo_catalog_branches_metadata.id}",
-      PRODUCT_INFO_TABLE     = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
-      S3_BUCKET              = "${aws_s3_bucket.anejo_repo_bucket.id}"
+      CATALOG_BRANCHES_TABLE       = "${aws_dynamodb_table.anejo_catalog_branches_metadata.id}",
+      CATALOG_MEMBERS_TABLE        = "${aws_dynamodb_table.anejo_catalog_branch_members.id}",
+      CATALOG_CHANGES_TABLE        = "${aws_dynamodb_table.anejo_catalog_branch_changes.id}",
+      APPLE_CATALOG_PRODUCTS_TABLE = "${aws_dynamodb_table.anejo_apple_catalog_products.id}",
+      PRODUCT_SEARCH_TABLE         = "${aws_dynamodb_table.anejo_product_search.id}",
+      PRODUCT_INFO_TABLE           = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
+      S3_BUCKET                    = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      WRITE_CATALOG_QUEUE_URL      = "${aws_sqs_queue.anejo_write_local_catalog_queue.id}",
+      BRANCH_REBUILD_DELAY         = "${var.anejo_branch_rebuild_delay}"
     }
   }
 
@@ -77,7 +88,9 @@ resource "aws_lambda_function" "anejo_api_sync" {
 
   environment {
     variables = {
-      REPO_SYNC_FUNCTION = "${aws_lambda_function.anejo_repo_sync.id}"
+      REPO_SYNC_FUNCTION                  = "${aws_lambda_function.anejo_repo_sync.id}",
+      PRODUCT_DOWNLOAD_QUEUE_URL          = "${aws_sqs_queue.anejo_product_sync_download_queue.id}",
+      PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL = "${aws_sqs_queue.anejo_product_sync_priority_download_queue.id}"
     }
   }
 
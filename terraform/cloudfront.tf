@@ -2,7 +2,9 @@
 
 
 locals {
-  anejo_s3_origin_id = "AnejoS3Origin"
+  anejo_s3_origin_id            = "AnejoS3Origin"
+  anejo_package_fetch_origin_id = "AnejoPackageFetchOrigin"
+  anejo_package_origin_group_id = "AnejoPackageOriginGroup"
 }
 
 
@@ -24,6 +26,37 @@ resource "aws_cloudfront_distribution" "anejo_distribution" {
     }
   }
 
+  # Lazy package mirroring (Anejo API /fetch)
+  origin {
+    domain_name = "${aws_api_gateway_rest_api.anejo_api_gateway.id}.execute-api.${var.aws_region}.amazonaws.com"
+    origin_id   = "${local.anejo_package_fetch_origin_id}"
+    origin_path = "/${aws_api_gateway_deployment.prod_deployment.stage_name}/fetch"
+
+    custom_origin_config {
+      http_port              = 80
+      https_port             = 443
+      origin_protocol_policy = "https-only"
+      origin_ssl_protocols   = ["TLSv1.2"]
+    }
+  }
+
+  # Fail over to the package fetch origin for packages missing from S3
+  origin_group {
+    origin_id = "${local.anejo_package_origin_group_id}"
+
+    failover_criteria {
+      status_codes = [403, 404]
+    }
+
+    member {
+      origin_id = "${local.anejo_s3_origin_id}"
+    }
+
+    member {
+      origin_id = "${local.anejo_package_fetch_origin_id}"
+    }
+  }
+
   enabled             = true
   is_ipv6_enabled     = true
   comment             = "Anejo CloudFront distribution"
@@ -82,6 +115,27 @@ resource "aws_cloudfront_distribution" "anejo_distribution" {
     }
   }
 
+  # Cache behavior for packages (mirrored on first request)
+  ordered_cache_behavior {
+    path_pattern     = "/content/downloads/*"
+    allowed_methods  = ["GET", "HEAD"]
+    cached_methods   = ["GET", "HEAD"]
+    target_origin_id = "${local.anejo_package_origin_group_id}"
+
+    forwarded_values {
+      query_string = false
+
+      cookies {
+        forward = "none"
+      }
+    }
+
+    viewer_protocol_policy = "allow-all"
+    min_ttl                = 0
+    default_ttl            = 86400
+    max_ttl                = 31536000
+  }
+
     # Cache behavior for catalogs
   ordered_cache_behavior {
     path_pattern     = "*.sucatalog"
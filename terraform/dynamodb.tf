@@ -28,3 +28,136 @@ resource "aws_dynamodb_table" "anejo_catalog_branches_metadata" {
 
   tags = "${local.tags_map}"
 }
+
+
+# Anejo Catalog Branch Members Table (one item per branch and product)
+resource "aws_dynamodb_table" "anejo_catalog_branch_members" {
+  name           = "AnejoCatalogBranchMembers${local.name_extension}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "catalog_branch"
+  range_key      = "product_key"
+
+  attribute {
+    name = "catalog_branch"
+    type = "S"
+  }
+
+  attribute {
+    name = "product_key"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name            = "product_key-index"
+    hash_key        = "product_key"
+    range_key       = "catalog_branch"
+    projection_type = "KEYS_ONLY"
+  }
+
+  tags = "${local.tags_map}"
+}
+
+
+# Anejo Catalog Branch Changes Table (member changes recorded for snapshots)
+resource "aws_dynamodb_table" "anejo_catalog_branch_changes" {
+  name           = "AnejoCatalogBranchChanges${local.name_extension}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "catalog_branch"
+  range_key      = "revision"
+
+  attribute {
+    name = "catalog_branch"
+    type = "S"
+  }
+
+  attribute {
+    name = "revision"
+    type = "N"
+  }
+
+  tags = "${local.tags_map}"
+}
+
+
+# Anejo Apple Catalog Products Table (one item per Apple catalog and product)
+resource "aws_dynamodb_table" "anejo_apple_catalog_products" {
+  name           = "AnejoAppleCatalogProducts${local.name_extension}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "apple_catalog"
+  range_key      = "product_key"
+
+  attribute {
+    name = "apple_catalog"
+    type = "S"
+  }
+
+  attribute {
+    name = "product_key"
+    type = "S"
+  }
+
+  global_secondary_index {
+    name            = "product_key-index"
+    hash_key        = "product_key"
+    range_key       = "apple_catalog"
+    projection_type = "KEYS_ONLY"
+  }
+
+  tags = "${local.tags_map}"
+}
+
+
+# Anejo Product Search Table (token, version, PostDate and deprecation indexes)
+resource "aws_dynamodb_table" "anejo_product_search" {
+  name           = "AnejoProductSearch${local.name_extension}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "index_key"
+  range_key      = "sort_key"
+
+  attribute {
+    name = "index_key"
+    type = "S"
+  }
+
+  attribute {
+    name = "sort_key"
+    type = "S"
+  }
+
+  tags = "${local.tags_map}"
+}
+
+
+# Anejo Package Fetch Table (lazy package mirroring)
+resource "aws_dynamodb_table" "anejo_package_fetch_metadata" {
+  name           = "AnejoPackageFetch${local.name_extension}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "s3_file_path"
+
+  attribute {
+    name = "s3_file_path"
+    type = "S"
+  }
+
+  tags = "${local.tags_map}"
+}
+
+
+# Anejo Replication Ledger Table (per-run URL deduplication)
+resource "aws_dynamodb_table" "anejo_replication_ledger" {
+  name           = "AnejoReplicationLedger${local.name_extension}"
+  billing_mode   = "PAY_PER_REQUEST"
+  hash_key       = "source_url"
+
+  attribute {
+    name = "source_url"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expiration"
+    enabled        = true
+  }
+
+  tags = "${local.tags_map}"
+}
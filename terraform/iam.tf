@@ -114,12 +114,22 @@ resource "aws_iam_role_policy" "anejo_dynamodb_iam_policy" {
             "Action": [
                 "dynamodb:PutItem",
                 "dynamodb:GetItem",
+                "dynamodb:DeleteItem",
                 "dynamodb:Scan",
+                "dynamodb:Query",
+                "dynamodb:BatchWriteItem",
                 "dynamodb:UpdateItem"
             ],
             "Resource": [
                 "${aws_dynamodb_table.anejo_product_info_metadata.arn}",
-                "${aws_dynamodb_table.anejo_catalog_branches_metadata.arn}"
+                "${aws_dynamodb_table.anejo_catalog_branches_metadata.arn}",
+                "${aws_dynamodb_table.anejo_catalog_branch_members.arn}",
+                "${aws_dynamodb_table.anejo_catalog_branch_members.arn}/index/*",
+                "${aws_dynamodb_table.anejo_apple_catalog_products.arn}",
+                "${aws_dynamodb_table.anejo_apple_catalog_products.arn}/index/*",
+                "${aws_dynamodb_table.anejo_product_search.arn}",
+                "${aws_dynamodb_table.anejo_package_fetch_metadata.arn}",
+                "${aws_dynamodb_table.anejo_replication_ledger.arn}"
             ]
         },
         {
@@ -149,6 +159,7 @@ resource "aws_iam_role_policy" "anejo_s3_iam_policy" {
             "Action": [
                 "s3:PutObject",
                 "s3:GetObject",
+                "s3:DeleteObject",
                 "s3:ListBucket"
             ],
             "Resource": [
@@ -193,8 +204,10 @@ resource "aws_iam_role_policy" "anejo_sqs_iam_policy" {
                 "${aws_sqs_queue.anejo_catalog_sync_queue.arn}",
                 "${aws_sqs_queue.anejo_product_sync_queue.arn}",
                 "${aws_sqs_queue.anejo_product_sync_download_queue.arn}",
+                "${aws_sqs_queue.anejo_product_sync_priority_download_queue.arn}",
                 "${aws_sqs_queue.anejo_product_sync_failed_queue.arn}",
-                "${aws_sqs_queue.anejo_write_local_catalog_queue.arn}"
+                "${aws_sqs_queue.anejo_write_local_catalog_queue.arn}",
+                "${aws_sqs_queue.anejo_package_fetch_queue.arn}"
             ]
         },
         {
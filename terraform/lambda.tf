@@ -14,8 +14,11 @@ resource "aws_lambda_function" "anejo_repo_sync" {
 
   environment {
     variables = {
-      S3_BUCKET         = "${aws_s3_bucket.anejo_repo_bucket.id}",
-      CATALOG_QUEUE_URL = "${aws_sqs_queue.anejo_catalog_sync_queue.id}"
+      S3_BUCKET                = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      CATALOG_QUEUE_URL        = "${aws_sqs_queue.anejo_catalog_sync_queue.id}",
+      WRITE_CATALOG_QUEUE_URL  = "${aws_sqs_queue.anejo_write_local_catalog_queue.id}",
+      WRITE_CATALOG_DELAY      = "${min(900, var.anejo_write_catalog_delay + 300)}",
+      REPLICATION_LEDGER_TABLE = "${aws_dynamodb_table.anejo_replication_ledger.id}"
     }
   }
 
@@ -35,11 +38,14 @@ resource "aws_lambda_function" "anejo_catalog_sync" {
 
   environment {
     variables = {
-      S3_BUCKET                  = "${aws_s3_bucket.anejo_repo_bucket.id}",
-      PRODUCT_QUEUE_URL          = "${aws_sqs_queue.anejo_product_sync_queue.id}",
-      PRODUCT_DOWNLOAD_QUEUE_URL = "${aws_sqs_queue.anejo_product_sync_download_queue.id}",
-      WRITE_CATALOG_QUEUE_URL    = "${aws_sqs_queue.anejo_write_local_catalog_queue.id}",
-      WRITE_CATALOG_DELAY        = "${var.anejo_write_catalog_delay}"
+      S3_BUCKET                    = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      PRODUCT_QUEUE_URL            = "${aws_sqs_queue.anejo_product_sync_queue.id}",
+      WRITE_CATALOG_QUEUE_URL      = "${aws_sqs_queue.anejo_write_local_catalog_queue.id}",
+      WRITE_CATALOG_DELAY          = "${var.anejo_write_catalog_delay}",
+      APPLE_CATALOG_PRODUCTS_TABLE = "${aws_dynamodb_table.anejo_apple_catalog_products.id}",
+      PRODUCT_INFO_TABLE           = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
+      PRODUCT_SEARCH_TABLE         = "${aws_dynamodb_table.anejo_product_search.id}",
+      REPLICATION_LEDGER_TABLE     = "${aws_dynamodb_table.anejo_replication_ledger.id}"
     }
   }
 
@@ -60,8 +66,20 @@ resource "aws_lambda_function" "anejo_product_sync" {
 
   environment {
     variables = {
-      PRODUCT_INFO_TABLE = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
-      S3_BUCKET          = "${aws_s3_bucket.anejo_repo_bucket.id}"
+      PRODUCT_INFO_TABLE                  = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
+      S3_BUCKET                           = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      PRODUCT_DOWNLOAD_QUEUE_URL          = "${aws_sqs_queue.anejo_product_sync_download_queue.id}",
+      PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL = "${aws_sqs_queue.anejo_product_sync_priority_download_queue.id}",
+      CATALOG_MEMBERS_TABLE               = "${aws_dynamodb_table.anejo_catalog_branch_members.id}",
+      APPLE_CATALOG_PRODUCTS_TABLE        = "${aws_dynamodb_table.anejo_apple_catalog_products.id}",
+      PRODUCT_SEARCH_TABLE                = "${aws_dynamodb_table.anejo_product_search.id}",
+      WRITE_CATALOG_QUEUE_URL             = "${aws_sqs_queue.anejo_write_local_catalog_queue.id}",
+      PACKAGE_FETCH_TABLE                 = "${aws_dynamodb_table.anejo_package_fetch_metadata.id}",
+      REPLICATION_LEDGER_TABLE            = "${aws_dynamodb_table.anejo_replication_ledger.id}",
+      LISTING_UPDATE_DELAY                = "${var.anejo_listing_update_delay}",
+      DOWNLOAD_TASK_SECONDS               = "${var.anejo_download_task_seconds}",
+      DOWNLOAD_THROUGHPUT                 = "${var.anejo_download_throughput}",
+      DOWNLOAD_REQUEST_OVERHEAD           = "1"
     }
   }
 
@@ -80,10 +98,51 @@ resource "aws_lambda_function" "anejo_product_sync_download" {
   timeout       = 900
   memory_size   = 512
 
+  # Leave account concurrency free for the priority lane
+  reserved_concurrent_executions = "${var.anejo_standard_download_concurrency}"
+
   environment {
     variables = {
-      PRODUCT_INFO_TABLE = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
-      S3_BUCKET          = "${aws_s3_bucket.anejo_repo_bucket.id}"
+      PRODUCT_INFO_TABLE                  = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
+      S3_BUCKET                           = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      PRODUCT_DOWNLOAD_QUEUE_URL          = "${aws_sqs_queue.anejo_product_sync_download_queue.id}",
+      PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL = "${aws_sqs_queue.anejo_product_sync_priority_download_queue.id}",
+      WRITE_CATALOG_QUEUE_URL             = "${aws_sqs_queue.anejo_write_local_catalog_queue.id}",
+      PACKAGE_FETCH_TABLE                 = "${aws_dynamodb_table.anejo_package_fetch_metadata.id}",
+      REPLICATION_LEDGER_TABLE            = "${aws_dynamodb_table.anejo_replication_ledger.id}",
+      REPLICATION_RETRY_DELAY             = "${var.anejo_replication_retry_delay}",
+      CATALOG_REBUILD_DELAY               = "${var.anejo_catalog_rebuild_delay}",
+      LISTING_UPDATE_DELAY                = "${var.anejo_listing_update_delay}"
+    }
+  }
+
+  tags = "${local.tags_map}"
+}
+
+
+# Product Sync/Priority Download Function
+resource "aws_lambda_function" "anejo_product_sync_priority_download" {
+  function_name = "anejo_product_sync_priority_download${local.name_extension}"
+  description   = "Replicate priority Apple SUS product packages to Anejo repo"
+  filename      = "${var.zip_file_path}"
+  role          = "${aws_iam_role.anejo_iam_role.arn}"
+  handler       = "product_sync.lambda_handler"
+  runtime       = "python3.7"
+  timeout       = 900
+  memory_size   = 512
+
+  environment {
+    variables = {
+      PRODUCT_INFO_TABLE                  = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
+      S3_BUCKET                           = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      PRODUCT_DOWNLOAD_QUEUE_URL          = "${aws_sqs_queue.anejo_product_sync_download_queue.id}",
+      PRODUCT_PRIORITY_DOWNLOAD_QUEUE_URL = "${aws_sqs_queue.anejo_product_sync_priority_download_queue.id}",
+      WRITE_CATALOG_QUEUE_URL             = "${aws_sqs_queue.anejo_write_local_catalog_queue.id}",
+      PACKAGE_FETCH_TABLE                 = "${aws_dynamodb_table.anejo_package_fetch_metadata.id}",
+      REPLICATION_LEDGER_TABLE            = "${aws_dynamodb_table.anejo_replication_ledger.id}",
+      REPLICATION_RETRY_DELAY             = "${var.anejo_replication_retry_delay}",
+      CATALOG_REBUILD_DELAY               = "${var.anejo_catalog_rebuild_delay}",
+      LISTING_UPDATE_DELAY                = "${var.anejo_listing_update_delay}"
     }
   }
 
@@ -99,13 +158,64 @@ resource "aws_lambda_function" "anejo_write_local_catalog" {
   role          = "${aws_iam_role.anejo_iam_role.arn}"
   handler       = "write_local_catalog.lambda_handler"
   runtime       = "python3.7"
-  timeout       = 300
+  timeout       = 900
+  memory_size   = 1024
+
+  environment {
+    variables = {
+      CATALOG_BRANCHES_TABLE   = "${aws_dynamodb_table.anejo_catalog_branches_metadata.id}",
+      CATALOG_MEMBERS_TABLE    = "${aws_dynamodb_table.anejo_catalog_branch_members.id}",
+      PRODUCT_INFO_TABLE       = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
+      S3_BUCKET                = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      REPLICATION_LEDGER_TABLE = "${aws_dynamodb_table.anejo_replication_ledger.id}",
+      WRITE_CATALOG_WORKERS    = "4",
+      BRANCH_CATALOG_WORKERS   = "8"
+    }
+  }
+
+  tags = "${local.tags_map}"
+}
+
+
+# Migrate Catalog Branches Function (one-off, invoke manually)
+resource "aws_lambda_function" "anejo_migrate_catalog_branches" {
+  function_name = "anejo_migrate_catalog_branches${local.name_extension}"
+  description   = "Move Anejo branch catalog product_keys lists to the members table"
+  filename      = "${var.zip_file_path}"
+  role          = "${aws_iam_role.anejo_iam_role.arn}"
+  handler       = "migrate_catalog_branches.lambda_handler"
+  runtime       = "python3.7"
+  timeout       = 900
+  memory_size   = 128
 
   environment {
     variables = {
       CATALOG_BRANCHES_TABLE = "${aws_dynamodb_table.anejo_catalog_branches_metadata.id}",
-      PRODUCT_INFO_TABLE     = "${aws_dynamodb_table.anejo_product_info_metadata.id}",
-      S3_BUCKET              = "${aws_s3_bucket.anejo_repo_bucket.id}",
+      CATALOG_MEMBERS_TABLE  = "${aws_dynamodb_table.anejo_catalog_branch_members.id}"
+    }
+  }
+
+  tags = "${local.tags_map}"
+}
+
+
+# Package Fetch Function
+resource "aws_lambda_function" "anejo_package_fetch" {
+  function_name = "anejo_package_fetch${local.name_extension}"
+  description   = "Mirror Apple SUS packages to Anejo repo on first request"
+  filename      = "${var.zip_file_path}"
+  role          = "${aws_iam_role.anejo_iam_role.arn}"
+  handler       = "package_fetch.lambda_handler"
+  runtime       = "python3.7"
+  timeout       = 900
+  memory_size   = 512
+
+  environment {
+    variables = {
+      PACKAGE_FETCH_TABLE     = "${aws_dynamodb_table.anejo_package_fetch_metadata.id}",
+      PACKAGE_FETCH_QUEUE_URL = "${aws_sqs_queue.anejo_package_fetch_queue.id}",
+      PACKAGE_FETCH_LEASE     = "900",
+      S3_BUCKET               = "${aws_s3_bucket.anejo_repo_bucket.id}"
     }
   }
 
@@ -156,9 +266,25 @@ resource "aws_lambda_event_source_mapping" "anejo_product_sync_download_trigger"
 }
 
 
+# Products Sync Priority Download Trigger
+resource "aws_lambda_event_source_mapping" "anejo_product_sync_priority_download_trigger" {
+  event_source_arn = "${aws_sqs_queue.anejo_product_sync_priority_download_queue.arn}"
+  function_name    = "${aws_lambda_function.anejo_product_sync_priority_download.arn}"
+  batch_size       = 1
+}
+
+
 # Write Local Catalog Trigger
 resource "aws_lambda_event_source_mapping" "anejo_write_local_catalog_trigger" {
   event_source_arn = "${aws_sqs_queue.anejo_write_local_catalog_queue.arn}"
   function_name    = "${aws_lambda_function.anejo_write_local_catalog.arn}"
   batch_size       = 1
 }
+
+
+# Package Fetch Trigger
+resource "aws_lambda_event_source_mapping" "anejo_package_fetch_trigger" {
+  event_source_arn = "${aws_sqs_queue.anejo_package_fetch_queue.arn}"
+  function_name    = "${aws_lambda_function.anejo_package_fetch.arn}"
+  batch_size       = 1
+}
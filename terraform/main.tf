@@ -45,6 +45,48 @@ variable "anejo_write_catalog_delay" {
   default     = "300"
 }
 
+variable "anejo_catalog_rebuild_delay" {
+  type        = "string"
+  description = "Delay (in seconds) before rebuilding a catalog after back-filled packages finish downloading, to coalesce rebuilds"
+  default     = "60"
+}
+
+variable "anejo_replication_retry_delay" {
+  type        = "string"
+  description = "Delay (in seconds) before retrying a download task's files that another worker was replicating"
+  default     = "60"
+}
+
+variable "anejo_listing_update_delay" {
+  type        = "string"
+  description = "Delay (in seconds) before rewriting the product listing after product metadata changes, to coalesce a sync run's changes"
+  default     = "300"
+}
+
+variable "anejo_branch_rebuild_delay" {
+  type        = "string"
+  description = "Delay (in seconds) before rebuilding a branch's catalogs after a change, to coalesce bursts of changes"
+  default     = "30"
+}
+
+variable "anejo_download_task_seconds" {
+  type        = "string"
+  description = "Estimated time budget (in seconds) for each package download task"
+  default     = "600"
+}
+
+variable "anejo_download_throughput" {
+  type        = "string"
+  description = "Estimated package download throughput (in bytes per second)"
+  default     = "20971520"
+}
+
+variable "anejo_standard_download_concurrency" {
+  type        = "string"
+  description = "Maximum concurrent package downloads from the standard (non-priority) lane"
+  default     = "10"
+}
+
 variable "anejo_environment" {
   type        = "string"
   description = "Environment (production, development, testing, etc.)"
@@ -6,6 +6,13 @@ resource "aws_s3_bucket" "anejo_repo_bucket" {
   acl           = "private"
   force_destroy = true
 
+  # Packages replicated in ranges by download tasks that never finished
+  lifecycle_rule {
+    id                                     = "abort-incomplete-multipart-uploads"
+    enabled                                = true
+    abort_incomplete_multipart_upload_days = 7
+  }
+
   tags = "${local.tags_map}"
 }
 
@@ -33,6 +33,18 @@ resource "aws_sqs_queue" "anejo_product_sync_download_queue" {
 }
 
 
+# Product Sync/Priority Download Queue
+resource "aws_sqs_queue" "anejo_product_sync_priority_download_queue" {
+  name                       = "AnejoProductSyncPriorityDownloadQueue${local.name_extension}"
+  visibility_timeout_seconds = 900
+  message_retention_seconds  = 900
+  receive_wait_time_seconds  = 0
+  redrive_policy             = "{\"deadLetterTargetArn\":\"${aws_sqs_queue.anejo_product_sync_failed_queue.arn}\",\"maxReceiveCount\":3}"
+
+  tags = "${local.tags_map}"
+}
+
+
 # Product Sync Failed Queue (Dead Letter Queue)
 resource "aws_sqs_queue" "anejo_product_sync_failed_queue" {
   name                       = "AnejoProductSyncFailedQueue${local.name_extension}"
@@ -47,9 +59,20 @@ resource "aws_sqs_queue" "anejo_product_sync_failed_queue" {
 # Write Local Catalog Queue
 resource "aws_sqs_queue" "anejo_write_local_catalog_queue" {
   name                       = "AnejoWriteLocalCatalogQueue${local.name_extension}"
-  visibility_timeout_seconds = 300
+  visibility_timeout_seconds = 900
   message_retention_seconds  = 900
   receive_wait_time_seconds  = 0
 
   tags = "${local.tags_map}"
 }
+
+
+# Package Fetch Queue (lazy package mirroring)
+resource "aws_sqs_queue" "anejo_package_fetch_queue" {
+  name                       = "AnejoPackageFetchQueue${local.name_extension}"
+  visibility_timeout_seconds = 900
+  message_retention_seconds  = 3600
+  receive_wait_time_seconds  = 0
+
+  tags = "${local.tags_map}"
+}
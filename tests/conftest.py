@@ -0,0 +1,111 @@
+"""Shared test fixtures.
+
+Lambda functions run against moto's AWS mocks, with a local HTTP server
+standing in for Apple's software update servers.
+"""
+import functools
+import http.server
+import io
+import os
+import re
+import sys
+import threading
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'code'))
+
+import boto3
+from moto import mock_aws
+import pytest
+
+
+S3_BUCKET = 'anejo-test'
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def send_head(self):
+        """Answer single byte range requests with a 206."""
+        byte_range = re.match(r'bytes=(\d+)-(\d+)$', self.headers.get('Range', ''))
+        if not byte_range:
+            return super().send_head()
+        try:
+            with open(self.translate_path(self.path), 'rb') as local_file:
+                local_file.seek(int(byte_range.group(1)))
+                data = local_file.read(int(byte_range.group(2)) - int(byte_range.group(1)) + 1)
+                file_size = os.fstat(local_file.fileno()).st_size
+        except OSError:
+            self.send_error(404)
+            return None
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes ' + byte_range.group(1) + '-' + byte_range.group(2) + '/' + str(file_size))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        return io.BytesIO(data)
+
+
+class UpstreamServer(object):
+    """Local HTTP server serving files from a directory.
+
+    Answers If-Modified-Since with 304 and byte range requests with 206,
+    like Apple's servers.
+    """
+
+    def __init__(self, root_dir):
+        self.root_dir = root_dir
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0),
+            functools.partial(QuietHandler, directory=str(root_dir))
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def add_file(self, file_path, data):
+        """Serve data at file_path and return its URL."""
+        local_path = os.path.join(str(self.root_dir), file_path)
+        os.makedirs(os.path.dirname(local_path), exist_ok=True)
+        with open(local_path, 'wb') as local_file:
+            local_file.write(data)
+        return 'http://127.0.0.1:' + str(self.server.server_port) + '/' + file_path
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    """A local stand-in for Apple's software update servers."""
+    server = UpstreamServer(tmp_path)
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    """Start moto's AWS mocks and return the (mocked) repo bucket."""
+    with mock_aws():
+        boto3.client('s3').create_bucket(Bucket=S3_BUCKET)
+        monkeypatch.setenv('S3_BUCKET', S3_BUCKET)
+        yield S3_BUCKET
+
+
+@pytest.fixture
+def create_table(s3_bucket, monkeypatch):
+    """Return a function creating a (mocked) DynamoDB table.
+
+    The table name is set as the Lambda environment variable env_var.
+    """
+    def create(env_var, table_name, hash_key):
+        boto3.client('dynamodb').create_table(
+            TableName=table_name,
+            KeySchema=[{'AttributeName': hash_key, 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': hash_key, 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST'
+        )
+        monkeypatch.setenv(env_var, table_name)
+        return table_name
+    return create
@@ -0,0 +1,101 @@
+"""Download task planning for packages too large for one download task.
+
+Ranges are replicated against moto's AWS mocks and a local HTTP server
+standing in for Apple's software update servers.
+"""
+import hashlib
+from unittest import mock
+
+import boto3
+import pytest
+
+import anejocommon
+import product_sync
+
+
+PRODUCT_INFO_TABLE = 'AnejoProductInfo'
+PRODUCT_KEY = '041-00001'
+PACKAGE_PATH = 'content/downloads/00/01/041-00001/example/Example.pkg'
+PART_SIZE = 5242880
+PACKAGE = bytes(range(256)) * (PART_SIZE * 5 // 2 // 256)
+
+
+def test_oversized_package_is_split_into_ranges():
+    downloads = [
+        {'url': 'https://swcdn.apple.com/Large.pkg', 'Size': 10 * PART_SIZE + 1},
+        {'url': 'https://swcdn.apple.com/Small.pkg', 'Size': 1024}
+    ]
+    # Three parts fit in a task
+    tasks = product_sync.plan_download_tasks(downloads, 4, PART_SIZE, 1, PART_SIZE)
+
+    for estimated_seconds, task_downloads in tasks:
+        assert estimated_seconds <= 4
+    ranges = sorted(
+        download['Range']
+        for estimated_seconds, task_downloads in tasks
+        for download in task_downloads
+        if 'Range' in download
+    )
+    assert ranges == [
+        [0, 3 * PART_SIZE],
+        [3 * PART_SIZE, 6 * PART_SIZE],
+        [6 * PART_SIZE, 9 * PART_SIZE],
+        [9 * PART_SIZE, 10 * PART_SIZE + 1]
+    ]
+    # Files that fit in a task are not split
+    assert any(
+        download == downloads[1]
+        for estimated_seconds, task_downloads in tasks
+        for download in task_downloads
+    )
+
+
+@pytest.fixture
+def package_url(upstream, create_table):
+    create_table('PRODUCT_INFO_TABLE', PRODUCT_INFO_TABLE, 'product_key')
+    return upstream.add_file(PACKAGE_PATH, PACKAGE)
+
+
+def replicate_tasks(package_url, s3_bucket, digest):
+    download = {'url': package_url, 'Size': len(PACKAGE), 'Digest': digest}
+    tasks = product_sync.plan_download_tasks([download], 2, PART_SIZE, 1, PART_SIZE)
+    assert len(tasks) == 3
+
+    # Ranges are replicated by separate tasks, in any order
+    for estimated_seconds, task_downloads in reversed(tasks):
+        product_sync.replicate_download_ranges(PRODUCT_KEY, task_downloads, s3_bucket, True, {}, PRODUCT_INFO_TABLE)
+    return product_sync.complete_multipart_replications(PRODUCT_KEY, s3_bucket, PRODUCT_INFO_TABLE)
+
+
+def test_ranges_are_assembled_and_verified(package_url, s3_bucket):
+    verified_packages = replicate_tasks(package_url, s3_bucket, hashlib.sha1(PACKAGE).hexdigest())
+
+    s3_file_path = 'html/' + PACKAGE_PATH
+    assert verified_packages[s3_file_path]['sha256'] == hashlib.sha256(PACKAGE).hexdigest()
+    s3_object = boto3.client('s3').get_object(Bucket=s3_bucket, Key=s3_file_path)
+    assert s3_object['Body'].read() == PACKAGE
+    assert s3_object['Metadata']['verified-size'] == str(len(PACKAGE))
+
+
+def test_assembled_file_failing_verification_is_removed(package_url, s3_bucket):
+    assert replicate_tasks(package_url, s3_bucket, '0' * 40) == {}
+
+    listing = boto3.client('s3').list_objects_v2(Bucket=s3_bucket)
+    assert listing.get('KeyCount') == 0
+
+
+def test_replicated_digest_is_stored_and_reused(package_url, s3_bucket):
+    # Replicated without an expected digest, as from a catalog without one
+    anejocommon.replicate_url_to_bucket(package_url, s3_bucket, expected_size=len(PACKAGE))
+
+    s3_file_path = 'html/' + PACKAGE_PATH
+    s3_metadata = boto3.client('s3').head_object(Bucket=s3_bucket, Key=s3_file_path)['Metadata']
+    assert s3_metadata['sha256'] == hashlib.sha256(PACKAGE).hexdigest()
+    assert s3_metadata['verified-size'] == str(len(PACKAGE))
+
+    # A later sync verifies it from its metadata instead of transferring it again
+    download = {'url': package_url, 'Size': len(PACKAGE), 'Digest': hashlib.sha1(PACKAGE).hexdigest()}
+    with mock.patch.object(anejocommon, 'replicate_url_to_bucket') as replicate_url_to_bucket:
+        verified_packages, deferred_downloads = product_sync.replicate_downloads([download], s3_bucket, False)
+    replicate_url_to_bucket.assert_not_called()
+    assert verified_packages[s3_file_path]['sha256'] == hashlib.sha256(PACKAGE).hexdigest()
@@ -0,0 +1,105 @@
+"""Lazy package mirroring against a local HTTP stand-in for Apple.
+
+Runs package_fetch's miss handler and queue worker against moto's AWS
+mocks.
+"""
+import hashlib
+import json
+
+import boto3
+import pytest
+
+import anejocommon
+import package_fetch
+
+
+PACKAGE_FETCH_TABLE = 'AnejoPackageFetch'
+PACKAGE_PATH = 'content/downloads/00/01/041-00001/example/Example.pkg'
+PACKAGE = b'package payload' * 1024
+
+
+@pytest.fixture
+def package_url(upstream, create_table, monkeypatch):
+    """Serve the package upstream and set up package_fetch's table and queue."""
+    create_table('PACKAGE_FETCH_TABLE', PACKAGE_FETCH_TABLE, 's3_file_path')
+    queue_url = boto3.client('sqs').create_queue(QueueName='AnejoPackageFetch')['QueueUrl']
+    monkeypatch.setenv('PACKAGE_FETCH_QUEUE_URL', queue_url)
+    return upstream.add_file(PACKAGE_PATH, PACKAGE)
+
+
+def request_package(package_path=PACKAGE_PATH):
+    return package_fetch.lambda_handler(
+        {
+            'path': '/' + package_path,
+            'pathParameters': {'proxy': package_path}
+        },
+        None
+    )
+
+
+def receive_messages():
+    """Return the queued messages as Lambda SQS event records."""
+    queue_url = boto3.client('sqs').get_queue_url(QueueName='AnejoPackageFetch')['QueueUrl']
+    messages = boto3.client('sqs').receive_message(
+        QueueUrl=queue_url,
+        MaxNumberOfMessages=10
+    ).get('Messages', [])
+    return [{'body': message['Body']} for message in messages]
+
+
+def get_fetch_status():
+    return boto3.resource('dynamodb').Table(PACKAGE_FETCH_TABLE).get_item(
+        Key={'s3_file_path': 'html/' + PACKAGE_PATH}
+    )['Item']['fetch_status']
+
+
+def test_miss_redirects_and_queues_one_replication(package_url, s3_bucket):
+    anejocommon.register_lazy_url(
+        package_url,
+        PACKAGE_FETCH_TABLE,
+        len(PACKAGE),
+        hashlib.sha1(PACKAGE).hexdigest()
+    )
+
+    # Every request before the package is mirrored is redirected to the source
+    responses = [request_package() for i in range(3)]
+    for response in responses:
+        assert response['statusCode'] == 302
+        assert response['headers']['Location'] == package_url
+
+    # Only the request that won the claim queued a replication
+    messages = receive_messages()
+    assert len(messages) == 1
+    fetch_info = json.loads(messages[0]['body'])
+    assert fetch_info['s3_file_path'] == 'html/' + PACKAGE_PATH
+    assert int(fetch_info['expected_size']) == len(PACKAGE)
+    assert get_fetch_status() == 'fetching'
+
+    # The queue worker replicates it to the path replicate_url_to_bucket uses
+    package_fetch.lambda_handler({'Records': messages}, None)
+    s3_object = boto3.client('s3').get_object(Bucket=s3_bucket, Key='html/' + PACKAGE_PATH)
+    assert s3_object['Body'].read() == PACKAGE
+    assert get_fetch_status() == 'mirrored'
+
+    # Later misses (e.g. before the origin fails back) queue nothing
+    assert request_package()['statusCode'] == 302
+    assert receive_messages() == []
+
+
+def test_failed_replication_releases_claim(package_url):
+    anejocommon.register_lazy_url(package_url, PACKAGE_FETCH_TABLE, len(PACKAGE) + 1)
+    request_package()
+    messages = receive_messages()
+
+    with pytest.raises(anejocommon.IntegrityError):
+        package_fetch.lambda_handler({'Records': messages}, None)
+    assert get_fetch_status() == 'pending'
+
+    # The next request claims it again
+    request_package()
+    assert len(receive_messages()) == 1
+
+
+def test_unregistered_package_is_not_found(package_url):
+    assert request_package('content/downloads/unknown.pkg')['statusCode'] == 404
+    assert receive_messages() == []
@@ -0,0 +1,87 @@
+"""Repeated product_sync invocations in one process (a warm Lambda container).
+
+Runs against moto's AWS mocks and a local HTTP server standing in for
+Apple's software update servers.
+"""
+import json
+import shutil
+from unittest import mock
+
+import boto3
+import pytest
+
+import anejocommon
+import product_sync
+
+
+PRODUCT_INFO_TABLE = 'AnejoProductInfo'
+PRODUCT_KEY = '041-00001'
+DIST = b"""<?xml version="1.0" encoding="utf-8"?>
+<installer-gui-script minSpecVersion="1">
+    <choices-outline ui="SoftwareUpdate">
+        <line choice="su"/>
+    </choices-outline>
+    <choice id="su" title="SU_TITLE" versStr="1.0" description="SU_DESCRIPTION">
+        <pkg-ref id="com.example.pkg">Example.pkg</pkg-ref>
+    </choice>
+    <localization>
+        <strings language="English"><![CDATA[
+"SU_TITLE" = "Example Update";
+"SU_DESCRIPTION" = "An example update.";
+]]></strings>
+    </localization>
+</installer-gui-script>
+"""
+
+
+@pytest.fixture
+def dist_url(upstream, create_table, s3_bucket):
+    """Serve the .dist file upstream, with an empty /tmp cache."""
+    shutil.rmtree(anejocommon.TMP_CACHE_DIR, ignore_errors=True)
+    anejocommon.tmp_cache_stats.update({'hits': 0, 'misses': 0})
+    create_table('PRODUCT_INFO_TABLE', PRODUCT_INFO_TABLE, 'product_key')
+    anejocommon.write_pref('PreferredLocalizations', ['English'], s3_bucket)
+    yield upstream.add_file('English.dist', DIST)
+    shutil.rmtree(anejocommon.TMP_CACHE_DIR, ignore_errors=True)
+
+
+def invoke(dist_url, run_time):
+    product_info = {
+        'Distributions': {'English': dist_url},
+        'Packages': [],
+        'PostDate': '2020-01-01 00:00:00'
+    }
+    event = {
+        'Records': [
+            {
+                'body': json.dumps({
+                    'catalog_url': 'https://swscan.apple.com/index.sucatalog',
+                    'run_time': run_time,
+                    'product_key': PRODUCT_KEY,
+                    'product_info': anejocommon.compress_dict(product_info, True)
+                })
+            }
+        ]
+    }
+    product_sync.lambda_handler(event, None)
+
+
+def test_warm_invocation_reuses_tmp_cache(dist_url):
+    with mock.patch.object(anejocommon, 'read_plist_s3', wraps=anejocommon.read_plist_s3) as read_plist_s3:
+        invoke(dist_url, '2020-01-01 00:00:00')
+        assert anejocommon.get_tmp_cache_stats()['hits'] == 0
+        cold_misses = anejocommon.get_tmp_cache_stats()['misses']
+
+        invoke(dist_url, '2020-01-02 00:00:00')
+
+    # Preferences and the .dist file are revalidated, not fetched again
+    stats = anejocommon.get_tmp_cache_stats()
+    assert stats['hits'] == 2
+    assert stats['misses'] == cold_misses
+    # Preferences are read once per invocation
+    assert read_plist_s3.call_count == 2
+
+    product = boto3.resource('dynamodb').Table(PRODUCT_INFO_TABLE).get_item(
+        Key={'product_key': PRODUCT_KEY}
+    )['Item']
+    assert product['title'] == 'Example Update'